@@ -38,17 +38,30 @@ def parse_arguments():
     parser.add_argument('-O', '--FormatType', help='Specify the type of output',
                         choices=['HCAI_Inpatient_CSV', 'HCAI_Inpatient_FW', 'HCAI_PDD_CSV', 'HCAI_PDD_SAS', "all"],
                         default="HCAI_PDD_CSV")
+    parser.add_argument('-J', '--Shards', help='Number of concurrent Synthea processes to split PersonCount across',
+                        type=int, default=1)
+    parser.add_argument('-S', '--Seed', help='Synthea random seed (shard i of a sharded run uses Seed + i), also used '
+                        'for the random substitutions made while formatting', type=int, default=None)
     parser.add_argument('-K', '--KeepModule', help='Specify a keep module JSON', action='store_true', default=False)
     parser.add_argument('-Study', choices=predefined_studies.keys(), help='Specify a predefined study name', default=None)
     parser.add_argument('-T', '--EncounterType', help='Specify Encounter Type',
                         choices=['inpatient', 'outpatient', 'ambulatory', 'wellness', 'virtual', 'urgentcare',
                                  'emergency'], default='inpatient')
+    parser.add_argument('-Z', '--Compression', help='Compress the formatted output', choices=['gzip', 'xz', 'bz2'],
+                        default=None)
     parser.add_argument('-V', '--Verbose', help='Include additional fields, not part of offical outputs', default=False)
+    parser.add_argument('-B', '--MemoryBudget', help='Format out-of-core: split the patients into partitions small '
+                        'enough that formatting them stays within this memory budget (in MB), split evenly between the '
+                        'workers (see --Workers)', type=float, default=None)
+    parser.add_argument('-W', '--Workers', help='Number of processes to format patient partitions with in parallel. '
+                        'With --MemoryBudget each worker gets an equal share of the budget', type=int, default=1)
 
     # Add arguments that allow reports to be generated on a yearly basis.  To avoid excess files, add date restriction
     group1 = parser.add_argument_group()
     parser.add_argument('-Y', '--Yearly', help='Separate the output by year', action='store_true', default=False)
     parser.add_argument('-R', '--YearRange', help='Restrict output to certain years', default=False)
+    parser.add_argument('-P', '--PartitionBy', help='Also write the output split into one file per year, facility or county',
+                        choices=['year', 'facility', 'county'], default=None)
 
     # Add an argument to just run formatting code (i.e. bypass running synthea again and do not delete output/ files)
     group2 = parser.add_mutually_exclusive_group()
@@ -74,10 +87,23 @@ def main():
     args_dict = vars(parse_arguments())
 
     print(args_dict)
-    # Custom validation for PersonCount
-    if not (1 <= args_dict['PersonCount'] <= 50000):
-        print("Error: PersonCount must be between 1 and 50000.")
+    # Custom validation for PersonCount.  Larger populations have to be formatted out-of-core
+    if args_dict['PersonCount'] < 1:
+        print("Error: PersonCount must be at least 1.")
         return
+    if args_dict['PersonCount'] > 50000 and not args_dict['MemoryBudget']:
+        print("Error: PersonCount must be between 1 and 50000, unless a MemoryBudget is given.")
+        return
+
+    # Check the output format can be written as asked before spending any time generating patients
+    formatter = None
+    if not args_dict['SyntheaGenOnly']:
+        formatter = create_formatter(timers, **args_dict)
+        try:
+            formatter.check_partition_by()
+        except ValueError as e:
+            print(f"Error: {e}.")
+            return
 
     # Call this first to provide some command line feedback to the user about location choices
     city, state = parse_city(args_dict['City'])
@@ -89,7 +115,7 @@ def main():
     generate_synthea_patients(city, state, **args_dict)
 
     # Format patient data
-    report_data(**args_dict)
+    report_data(formatter, **args_dict)
 
     # Timekeeping stats
     printSectionSubHeader('Timekeeping Stats')
@@ -119,26 +145,28 @@ def generate_synthea_patients(city, state, **kwargs):
     printSectionSubHeader('Creating Patient Records')
     synth_start = time.time()
     synthea.specify_popsize(size=kwargs['PersonCount'])
+    synthea.specify_seed(seed=kwargs['Seed'])
     synthea.specify_gender(gender=kwargs['Gender'])
     synthea.specify_keep_module(keep_module=kwargs['KeepModule'], studyfolder=studyfolder)
     synthea.specify_module_overrides(module_overrides=kwargs['ModuleOverrides'], studyfolder=studyfolder)
     if kwargs['Age']:
         synthea.specify_age(minage=kwargs['Age'].split("-")[0], maxage=kwargs['Age'].split("-")[1])
     synthea.specify_city(state, city)
-    synthea.run_synthea()
+    synthea.run_synthea(shards=kwargs['Shards'])
     timers.record_time('Patient Records', synth_start)
 
 
-def report_data(**kwargs):
+def report_data(formatter, **kwargs):
     if kwargs['SyntheaGenOnly']:
         return
     # Format data to our desired layout
     printSectionHeader('Formatting Data')
     form_start = time.time()
-    formatter = create_formatter(timers, **kwargs)
-    formatter.gather_data()
-    data = formatter.format_data()
-    formatter.write_data(data)
+    if kwargs['MemoryBudget'] or kwargs['Workers'] > 1:
+        formatter.stream_partitioned(kwargs['MemoryBudget'], kwargs['Workers'], compression=kwargs['Compression'])
+    else:
+        formatter.gather_data()
+        formatter.stream_data(compression=kwargs['Compression'])
     timers.record_time('Formatted Output', form_start)
 
 
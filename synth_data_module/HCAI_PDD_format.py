@@ -1,7 +1,8 @@
-from io import StringIO
-from synth_data_module import HCAIBase, get_procedure_list, get_diagnosis_list, get_morbidity_list, calculate_age
+from synth_data_module import HCAIBase, get_procedure_list, get_diagnosis_list, get_morbidity_list, calculate_age, \
+    whole_dollars
 import datetime as dt
 import pandas as pd
+import numpy as np
 import synth_data_module.mappings as mappings
 import time
 
@@ -103,94 +104,92 @@ class HCAIPDDFormat(HCAIBase):
         return f'{self.synthea_output.output_loc}/formatted_data/HCAIPDD/{ftype}_HCAIPDD_' \
                f'{date_time.strftime("%m-%d-%Y_%H%M")}.{fextension}'
 
-    def format_data(self):
-        # StringIO acts like a file object, but collects its output in
-        # a string instead of writing to a file.
-        sbuffer = StringIO()
-        df = self.output_df.copy()
-        if self.kwargs['Verbose']:
-            df[self.final_fields['name'].tolist()].to_csv(sbuffer, index=False)
-        else:
-            df.rename(columns=dict(zip(self.all_fields["name"], self.all_fields["fieldid"])), inplace=True)
-            df[self.final_fields['fieldid'].tolist()].to_csv(sbuffer, index=False)
-        return sbuffer.getvalue()
+    def output_columns(self):
+        columns = self.final_fields['name'].tolist()
+        return columns, (columns if self.kwargs['Verbose'] else self.final_fields['fieldid'].tolist())
+
+    def encode_rows(self, df, out, header=True):
+        df.to_csv(out, header=header, index=False)
+
+    def input_reads(self):
+        return {**super().input_reads(),
+                'encounters': {'subfields': ['Id', 'START', 'STOP', 'PATIENT', 'ORGANIZATION', 'PAYER',
+                                               'ENCOUNTERCLASS', 'TOTAL_CLAIM_COST', 'REASONCODE'],
+                                'where': self.encounter_filter(by_year=True)},
+                'organizations': {'subfields': ['Id', 'NAME', 'CITY', 'ZIP']},
+                'payers': {'subfields': ['Id', 'NAME', 'OWNERSHIP']},
+                'observations': {'subfields': ['ENCOUNTER', 'DESCRIPTION', 'VALUE'], 'where': self.language_filter}}
 
     def add_encounters(self):
         encount_start = time.time()
-        encounters = self.synthea_output.encounters_df()
+        # The encounter type and year range filters are applied as the csv is read
+        encounters = self.read_input('encounters')
 
-        encounters['encounter_id'] = encounters.iloc[:, 0]
-        encounters['organization_id'] = encounters.iloc[:, 4]
-        encounters['payer_id'] = encounters.iloc[:, 6]
-        encounters['EncounterClass'] = encounters.iloc[:, 7]
-        if self.kwargs['EncounterType']:
-            encounters = encounters.loc[encounters['EncounterClass'] == self.kwargs['EncounterType'], :].copy()
+        encounters['encounter_id'] = encounters['Id']
+        encounters['organization_id'] = encounters['ORGANIZATION']
+        encounters['payer_id'] = encounters['PAYER']
+        encounters['EncounterClass'] = encounters['ENCOUNTERCLASS']
 
         # We had some issues getting the date format correct if headers were used in synthea, this try/except handles
         # both cases more smoothly now
         try:
-            encounters['Admission Date'] = encounters.iloc[:, 1].apply(lambda x: x.strftime('%m%d%Y'))
-            encounters['Discharge Date'] = encounters.iloc[:, 2].apply(lambda x: x.strftime('%m%d%Y'))
+            encounters['Admission Date'] = encounters['START'].apply(lambda x: x.strftime('%m%d%Y'))
+            encounters['Discharge Date'] = encounters['STOP'].apply(lambda x: x.strftime('%m%d%Y'))
         except TypeError:
-            encounters['Admission Date'] = encounters.iloc[:, 1].apply(
+            encounters['Admission Date'] = encounters['START'].apply(
                 lambda x: dt.datetime.strptime(x, '%Y-%m-%dT%H:%M:%SZ').strftime('%m%d%Y'))
-            encounters['Discharge Date'] = encounters.iloc[:, 2].apply(
+            encounters['Discharge Date'] = encounters['STOP'].apply(
                 lambda x: dt.datetime.strptime(x, '%Y-%m-%dT%H:%M:%SZ').strftime('%m%d%Y'))
 
         # Pandas dayofweek is indexed starting 2 days before the desired index for HCAI format, so we add 2 and mod 7
         # Pandas dayofweek is indexed starting 2 days before the desired index for HCAI format, so we add 2 and mod 7
-        encounters['Admission Day of the Week'] = encounters.iloc[:, 1].apply(
+        encounters['Admission Day of the Week'] = encounters['START'].apply(
             lambda x: (pd.to_datetime(x).dayofweek + 2) % 7).astype(object)
-        encounters['Admission Month'] = pd.to_datetime(encounters.iloc[:, 1]).dt.month.astype(object)
-        encounters['Admission Quarter'] = pd.to_datetime(encounters.iloc[:, 1]).dt.quarter.astype(object)
-        encounters['Admission Year'] = pd.to_datetime(encounters.iloc[:, 1]).dt.year.astype(object)
-        encounters['Discharge Month'] = pd.to_datetime(encounters.iloc[:, 2]).dt.month.astype(object)
-        encounters['Discharge Quarter'] = pd.to_datetime(encounters.iloc[:, 2]).dt.quarter.astype(object)
-        encounters['Discharge Year'] = pd.to_datetime(encounters.iloc[:, 2]).dt.year.astype(object)
-
-        if self.kwargs['YearRange']:
-            year_range = list(map(int, self.kwargs['YearRange'].split("-")))
-            encounters = encounters[(encounters['Discharge Year'] >= year_range[0])
-                                    & (encounters['Discharge Year'] <= year_range[1])]
-
-        encounters['Principal Diagnosis'] = mappings.snomedicdbasicmap(encounters.iloc[:, 13])
-        encounters['Total Charges'] = encounters.iloc[:, 11].apply(lambda x: str(min(int(x.split('.')[0]), 9999999)))
-        encounters['Total Charges Adjusted'] = encounters.iloc[:, 11].apply(lambda x: str(min(int(x.split('.')[0]), 9999999)))
+        encounters['Admission Month'] = pd.to_datetime(encounters['START']).dt.month.astype(object)
+        encounters['Admission Quarter'] = pd.to_datetime(encounters['START']).dt.quarter.astype(object)
+        encounters['Admission Year'] = pd.to_datetime(encounters['START']).dt.year.astype(object)
+        encounters['Discharge Month'] = pd.to_datetime(encounters['STOP']).dt.month.astype(object)
+        encounters['Discharge Quarter'] = pd.to_datetime(encounters['STOP']).dt.quarter.astype(object)
+        encounters['Discharge Year'] = pd.to_datetime(encounters['STOP']).dt.year.astype(object)
+
+        encounters['Principal Diagnosis'] = mappings.snomedicdbasicmap(encounters['REASONCODE'])
+        encounters['Total Charges'] = whole_dollars(encounters['TOTAL_CLAIM_COST'])
+        encounters['Total Charges Adjusted'] = whole_dollars(encounters['TOTAL_CLAIM_COST'])
         print('SUB-CHECK - Encounters Shape: ', encounters.shape)
 
         # Prepare and merge organizations name as Facility Name (replace IDs with real names) into encounters
-        organizations = self.synthea_output.organizations_df()
-        organizations['organization_id'] = organizations.iloc[:, 0]
-        organizations['Facility Identification Number'] = mappings.hcai(organizations.iloc[:, 1], length=6)
-        organizations['Facility Identification Number Long'] = mappings.hcai(organizations.iloc[:, 1], length=9)
-        organizations['Hospital County'] = mappings.CAcity(organizations.iloc[:, 3])
-        organizations['Hospital Zip Code'] = organizations.iloc[:, 5].apply(lambda x: x[:5])
+        organizations = self.read_input('organizations')
+        organizations['organization_id'] = organizations['Id']
+        organizations['Facility Identification Number'] = mappings.hcai(organizations['NAME'], length=6)
+        organizations['Facility Identification Number Long'] = mappings.hcai(organizations['NAME'], length=9)
+        organizations['Hospital County'] = mappings.CAcity(organizations['CITY'])
+        organizations['Hospital Zip Code'] = organizations['ZIP'].apply(lambda x: x[:5])
         encounters = encounters.merge(organizations[['organization_id', 'Hospital County', 'Hospital Zip Code',
                                       'Facility Identification Number', 'Facility Identification Number Long']],
                                       how='left', left_on='organization_id', right_on='organization_id')
         print('SUB-CHECK - Facility  merged.  Encounters Shape: ', encounters.shape)
 
         # Prepare and merge payers info (replace IDs with real payer data) into encounters
-        payers = self.synthea_output.payers_df()
-        payers['payer_id'] = payers.iloc[:, 0]
-        payers['Plan Code Number'] = mappings.hmo_plan_codes(payers.iloc[:, 1])
-        payers['Payer Category'] = payers.apply(mappings.payer_category, axis=1, study='LARC').astype(str)
+        payers = self.read_input('payers')
+        payers['payer_id'] = payers['Id']
+        payers['Plan Code Number'] = mappings.hmo_plan_codes(payers['NAME'])
+        payers['Payer Category'] = mappings.payer_category(payers['NAME'], payers['OWNERSHIP'], study='LARC')
         encounters = encounters.merge(payers[['payer_id', 'Plan Code Number', 'Payer Category']], how='left', left_on='payer_id',
                                       right_on='payer_id')
         print('SUB-CHECK - Payers and codes merged.  Encounters Shape: ', encounters.shape)
 
         # Prepare and merge observations info (for language) into encounters
-        observations = self.synthea_output.observations_df(subfields=[2, 5, 6])
-        observations['encounter_id'] = observations.iloc[:, 0]
-        observations['description'] = observations.iloc[:, 1]
-        observations = observations.loc[observations['description'] == 'Preferred language']
-        observations['Preferred Language Spoken Write In'] = observations.iloc[:, 2]
+        observations = self.read_input('observations')
+        observations['encounter_id'] = observations['ENCOUNTER']
+        observations['description'] = observations['DESCRIPTION']
+        observations['Preferred Language Spoken Write In'] = observations['VALUE']
         encounters = encounters.merge(observations[['encounter_id', 'Preferred Language Spoken Write In']],
                                       how='left', left_on='encounter_id', right_on='encounter_id')
         print('SUB-CHECK - observations and language merged.  Encounters Shape: ', encounters.shape)
 
+        encounter_keys = self.synthea_output.decode_keys('encounter', encounters['encounter_id'])
         encounters['Preferred Language Spoken Write In'] = mappings.languagewritein(
-            encounters['Preferred Language Spoken Write In'])
+            encounters['Preferred Language Spoken Write In'], keys=encounter_keys, seed=self.seed)
         encounters['Preferred Language Spoken'] = mappings.language(encounters['Preferred Language Spoken Write In'])
 
         # Merge the encounters dataframe into self.output_df, keeping only the fields we care about
@@ -200,30 +199,44 @@ class HCAIPDDFormat(HCAIBase):
             'Principal Diagnosis', 'Total Charges', 'Total Charges Adjusted', 'Plan Code Number', 'Payer Category',
             'Hospital County', 'Hospital Zip Code', 'Facility Identification Number',
             'Facility Identification Number Long', 'Preferred Language Spoken Write In', 'Preferred Language Spoken']],
-            how='left', left_on='patient_id', right_on=encounters.iloc[:, 3])
+            how='left', left_on='patient_id', right_on=encounters['PATIENT'])
         print('Encounter info added.  Shape: ', self.output_df.shape)
+        # The left merge leaves patients without encounters as NaN, so the encounter codes come back as floats
         self.output_df = self.output_df.dropna(subset=['encounter_id']).reset_index(drop=True)
+        self.output_df['encounter_id'] = self.output_df['encounter_id'].astype(np.int64)
         print('Patients with no encounters of desired type dropped.  Shape: ', self.output_df.shape)
         self.timers.record_time('Encounters Before Day Calcs', encount_start)
 
+        # The same three date columns feed every calculation below, so parse each of them only once
+        parsed_dates = {}
+
         self.output_df = calculate_age(self.output_df, date1='Date of Birth', date2='Admission Date',
-                                       form='agedays', fieldname='Age in Days at Admission')
+                                       form='agedays', fieldname='Age in Days at Admission',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Date of Birth', date2='Discharge Date',
-                                       form='agedays', fieldname='Age in Days at Discharge')
+                                       form='agedays', fieldname='Age in Days at Discharge',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Date of Birth', date2='Admission Date',
-                                       form='years', fieldname='Age in Years at Admission')
+                                       form='years', fieldname='Age in Years at Admission',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Date of Birth', date2='Discharge Date',
-                                       form='years', fieldname='Age in Years at Discharge')
+                                       form='years', fieldname='Age in Years at Discharge',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Date of Birth', date2='Admission Date',
-                                       form='range5', fieldname='Age Range at Admission')
+                                       form='range5', fieldname='Age Range at Admission',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Date of Birth', date2='Discharge Date',
-                                       form='range5', fieldname='Age Range at Discharge')
+                                       form='range5', fieldname='Age Range at Discharge',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Date of Birth', date2='Discharge Date',
-                                       form='range10', fieldname='Age in Years at Discharge 10')
+                                       form='range10', fieldname='Age in Years at Discharge 10',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Admission Date', date2='Discharge Date',
-                                       form='staydays', fieldname='Length Of Stay')
+                                       form='staydays', fieldname='Length Of Stay',
+                                       parsed_dates=parsed_dates)
         self.output_df = calculate_age(self.output_df, date1='Admission Date', date2='Discharge Date',
-                                       form='adjstaydays', fieldname='Adjusted Length Of Stay')
+                                       form='adjstaydays', fieldname='Adjusted Length Of Stay',
+                                       parsed_dates=parsed_dates)
         print('Added age and duration statistics for admission and discharge.  Shape: ', self.output_df.shape)
         self.timers.record_time('Encounters After Day Calcs', encount_start)
 
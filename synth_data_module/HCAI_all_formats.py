@@ -0,0 +1,71 @@
+from synth_data_module import Formatter, HCAIInpatientFormat, HCAIPDDFormat, SyntheaOutput, printSectionSubHeader
+import random
+
+
+# Every HCAI output (-O all) from one pass over the Synthea output.  One formatter per layout gathers its output_df, and
+# they share one SyntheaOutput, the tables their add_encounters read and the results of the stages that do not depend on
+# the layout (see HCAIBase.shared_stages), so those are only read and built once.  The CSV and fixed width/SAS versions
+# of a layout only differ in how the rows are encoded, so both are written from the same gathered frame.  The Inpatient
+# layout is gathered first: its encounters are not restricted to the year range, so the shared procedure lists have the
+# admission dates of every encounter either layout needs
+class HCAIAllFormats(Formatter):
+    layouts = {HCAIInpatientFormat: ['HCAI_Inpatient_CSV', 'HCAI_Inpatient_FW'],
+               HCAIPDDFormat: ['HCAI_PDD_CSV', 'HCAI_PDD_SAS']}
+
+    def __init__(self, timers, **kwargs):
+        self.timers = timers
+        self.kwargs = kwargs
+        # All of the layouts draw their random fields from the same seed, like separate runs with -S/--Seed would
+        self.seed = kwargs.get('Seed')
+        if self.seed is None:
+            self.seed = random.getrandbits(64)
+        self.synthea_output = SyntheaOutput()
+        # One formatter per format type, keyed by it.  The first of each layout's format types is the one gathered
+        self.formatters = {format_type: layout(timers, **{**kwargs, 'FormatType': format_type, 'Seed': self.seed})
+                           for layout, format_types in self.layouts.items() for format_type in format_types}
+        for formatter in self.formatters.values():
+            formatter.synthea_output = self.synthea_output
+
+    def gatherers(self):
+        return [(self.formatters[format_types[0]], [self.formatters[format_type] for format_type in format_types[1:]])
+                for format_types in self.layouts.values()]
+
+    def gather_data(self):
+        shared = {}
+        for gatherer, others in self.gatherers():
+            printSectionSubHeader(f'Gathering {type(gatherer).__name__}')
+            gatherer.shared = shared
+            gatherer.gather_data()
+            gatherer.shared = None
+            for formatter in others:
+                formatter.output_df = gatherer.output_df
+
+    def check_partition_by(self):
+        for formatter in self.formatters.values():
+            formatter.check_partition_by()
+
+    # The formatted output of every format type, keyed by it
+    def format_data(self):
+        return {format_type: formatter.format_data() for format_type, formatter in self.formatters.items()}
+
+    # The folder the outputs are written under, each format type in its own folder and file (see their formatters)
+    def suggested_filename(self) -> str:
+        return f'{self.synthea_output.output_loc}/formatted_data/'
+
+    def write_data(self, data, filename=None):
+        self.check_partition_by()
+        for format_type, formatter in self.formatters.items():
+            formatter.write_data(data[format_type])
+
+    # Stream every format type to its own file.  Returns the names of the files written
+    def stream_data(self, filename=None, compression=None, batch_size=100000):
+        self.check_partition_by()
+        return [formatter.stream_data(compression=compression, batch_size=batch_size)
+                for formatter in self.formatters.values()]
+
+    # Partitioned formatting does not share anything between the format types, each one is partitioned and gathered
+    # in turn as if it had been run on its own
+    def stream_partitioned(self, memory_budget=None, workers=1, filename=None, compression=None, batch_size=100000):
+        self.check_partition_by()
+        return [formatter.stream_partitioned(memory_budget, workers, compression=compression, batch_size=batch_size)
+                for formatter in self.formatters.values()]
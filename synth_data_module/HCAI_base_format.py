@@ -1,9 +1,19 @@
 from abc import ABC, abstractmethod
 from configparser import ConfigParser
 from io import StringIO
-from synth_data_module import Formatter, SyntheaOutput, modify_procedure_row, modify_diagnosis_row, calculate_age
+import bz2
+import gzip
+import lzma
+from synth_data_module import Formatter, SyntheaOutput, RaggedLists, calculate_age, FirstSeenCounter, \
+    parse_date_vectorized, printSectionSubHeader, CreateTimers
+import collections
+import contextlib
 import datetime as dt
+import functools
+import multiprocessing
 import os
+import random
+import sys
 import pandas as pd
 import numpy as np
 import synth_data_module.mappings as mappings
@@ -16,6 +26,19 @@ class HCAIBase(Formatter, ABC):
         self.timers = timers
         self.synthea_output = SyntheaOutput()
         self.kwargs = kwargs
+        # Patient IDs keep counting across calls to hard_coding, so chunked/partitioned runs get the same IDs
+        self.patient_id_counter = FirstSeenCounter(start=100000000000)
+        # Rows already written by earlier partitions, which the data set numbers and counter carry on from
+        self.row_offset = 0
+        # The per-year/facility/county files already written (see write_partitions)
+        self.written_partitions = set()
+        # Run-level seed that every randomized field is drawn from (keyed by encounter), reproducible with -S/--Seed
+        self.seed = kwargs.get('Seed')
+        if self.seed is None:
+            self.seed = random.getrandbits(64)
+        # Results of the shared stages and input reads, when this formatter shares them with the formatters of other
+        # layouts (see HCAIAllFormats), otherwise None
+        self.shared = None
         # TODO all_fields and final_fields will be defined in the subclass - I dont know the proper way to handle this
         self.all_fields = pd.DataFrame()
         self.final_fields = pd.DataFrame()
@@ -32,70 +55,309 @@ class HCAIBase(Formatter, ABC):
         self.country_code = java_configs['SETTINGS']['generate.geography.country_code']
 
     def gather_data(self):
-        self.add_demographics()
-        self.add_encounters()
-        self.add_procedures()
-        self.add_other_diagnosis()
-        self.hard_coding()
-        self.fill_missing()
+        # Every input table is read at once in the background, and each stage takes its tables as they are ready.  Not
+        # with a memory budget, where holding all of the tables at once would throw off the partition sizes
+        if not self.kwargs.get('MemoryBudget'):
+            self.synthea_output.prefetch(self.prefetch_reads())
+        try:
+            self.add_demographics()
+            self.add_encounters()
+            # Nothing else to add if no encounter passed the filters (e.g. in a small patient partition), the output is
+            # just empty columns
+            if self.output_df.empty:
+                self.output_df = pd.DataFrame(columns=self.all_fields['name'].tolist())
+                return
+            self.add_procedures()
+            self.add_other_diagnosis()
+            self.add_drgs()
+        finally:
+            self.synthea_output.end_prefetch()
+        self.allocate_output(self.hard_coding())
         self.type_data()
 
+    # The Synthea tables the gather_data stages read, as the arguments for each table's SyntheaOutput reader.  The
+    # columns are named as in the schema registry (see schemas.py).  Subclasses add the tables their add_encounters reads
+    def input_reads(self):
+        return {
+            'patients': {'subfields': ['Id', 'BIRTHDATE', 'SSN', 'RACE', 'ETHNICITY', 'GENDER', 'ADDRESS', 'CITY',
+                                       'STATE', 'COUNTY', 'ZIP']},
+            'procedures': {'subfields': ['START', 'ENCOUNTER', 'CODE']},
+            'diagnosis': {'subfields': ['ENCOUNTER', 'COVERAGE', 'DIAGNOSIS_CODE', 'DIAGNOSIS_POA']},
+            'coverages': {'subfields': ['Id', 'TYPE']},
+        }
+
+    # The stages whose results do not depend on the output layout, and the tables they read.  Formatters sharing their
+    # stages build each of them only once (see shared_stage)
+    shared_stages = {'demographics': ['patients'], 'procedures': ['procedures'], 'diagnoses': ['diagnosis', 'coverages'],
+                     'drgs': []}
+
+    # The input_reads this formatter still has to make: all of them, less any that shared stages or reads have covered
+    def prefetch_reads(self):
+        reads = self.input_reads()
+        if self.shared is None:
+            return reads
+        covered = [table for stage, tables in self.shared_stages.items() if stage in self.shared for table in tables]
+        return {table: args for table, args in reads.items()
+                if table not in covered and self.read_key(table, args) not in self.shared}
+
+    @staticmethod
+    def read_key(table, args):
+        return 'read', table, tuple(args['subfields']), args.get('where')
+
+    # Read one of the input_reads tables (taking it from the prefetch, if gather_data started one).  Shared reads are
+    # kept, and each formatter gets its own copy of the table to add its columns to.  The tables of the shared stages
+    # are only ever read once, so they are not kept
+    def read_input(self, table):
+        args = self.input_reads()[table]
+        if self.shared is None or table in sum(self.shared_stages.values(), []):
+            return getattr(self.synthea_output, f'{table}_df')(**args)
+        key = self.read_key(table, args)
+        if key not in self.shared:
+            self.shared[key] = getattr(self.synthea_output, f'{table}_df')(**args)
+        return self.shared[key].copy()
+
+    # The result of one of the shared_stages, built by build unless it has been built already for another formatter
+    def shared_stage(self, stage, build):
+        if self.shared is None:
+            return build()
+        if stage not in self.shared:
+            self.shared[stage] = build()
+        return self.shared[stage]
+
+    # Openers for the compression options of stream_data, with the extension each one adds to the filename
+    compressors = {'gzip': ('gz', gzip.open), 'xz': ('xz', lzma.open), 'bz2': ('bz2', bz2.open)}
+
+    # output_df columns the output can be partitioned on (see write_partitions)
+    partition_columns = {'year': 'Discharge Date',
+                         'facility': 'Facility Identification Number',
+                         'county': 'Hospital County'}
+
+    # The output_df columns that get written out, and the names the output format gives them
+    @abstractmethod
+    def output_columns(self) -> tuple:
+        pass
+
+    # Encode the rows of df onto the open text file out, including the header (if the format has one) when header=True
+    @abstractmethod
+    def encode_rows(self, df, out, header=True):
+        pass
+
+    # The output rows (all of them, or the slice or positions in rows) with just the written columns, named the way the
+    # output format wants them.  Only the selected rows are copied, so writing a batch at a time never holds a second
+    # copy of the whole wide frame
+    def output_frame(self, rows=slice(None)):
+        columns, names = self.output_columns()
+        df = self.output_df.iloc[rows][columns]
+        df.columns = names
+        return df
+
+    def format_data(self):
+        # StringIO acts like a file object, but collects its output in
+        # a string instead of writing to a file.
+        sbuffer = StringIO()
+        self.write_frame(sbuffer)
+        return sbuffer.getvalue()
+
+    def partition_by(self):
+        if self.kwargs.get('PartitionBy'):
+            return self.kwargs['PartitionBy']
+        return 'year' if self.kwargs['Yearly'] else None
+
+    # Raise before anything is written if this format has no column to partition the output by (see partition_key)
+    def check_partition_by(self):
+        partition_by = self.partition_by()
+        if partition_by and self.partition_columns[partition_by] not in self.all_fields['name'].tolist():
+            raise ValueError(f'This format has no {self.partition_columns[partition_by]} to partition the output by '
+                             f'{partition_by}')
+
     def write_data(self, data, filename=None):
+        self.check_partition_by()
         filename = (filename or self.suggested_filename())
         with open(filename, "w") as f:
             f.write(data)
 
-        if self.kwargs['Yearly']:
-            self.write_yearly_data(data, filename)
-
-    def write_yearly_data(self, data, filename):
-        # Create the directory to put the yearly files in and identify their base names
-        basename = os.path.basename(filename).split(".")[0]
-        directory = os.path.abspath(filename).split(".")[0]
-        os.mkdir(directory)
-
-        all_data = pd.read_csv(StringIO(data), dtype=str)
-        year_range = list(map(int, self.kwargs['YearRange'].split("-")))
-        for year in range(year_range[0], year_range[1]+1):
-            sbuffer = StringIO()
-            all_data[all_data['dsch_yr'] == str(year)].to_csv(sbuffer, index=False)
-            yearly_filename = f'{directory}/{basename}_{year}.csv'
-            with open(yearly_filename, "w") as f:
-                f.write(sbuffer.getvalue())
+        if self.partition_by():
+            self.write_partitions(filename, self.partition_by())
+
+    def open_output(self, filename, compression=None, mode='w'):
+        if compression:
+            extension, opener = self.compressors[compression]
+            filename = f'{filename}.{extension}'
+            return filename, opener(filename, f'{mode}t')
+        return filename, open(filename, mode)
+
+    # Encode the output (or just the rows at the positions in rows) onto out, one batch of rows at a time.  header=False
+    # leaves out the header, for output appended to a file that already has one
+    def write_frame(self, out, rows=None, batch_size=100000, header=True):
+        count = len(self.output_df) if rows is None else len(rows)
+        # Always run at least once so an empty output still gets its header
+        for start in range(0, max(count, 1), batch_size):
+            batch = slice(start, start + batch_size) if rows is None else rows[start:start + batch_size]
+            self.encode_rows(self.output_frame(batch), out, header=(header and start == 0))
+
+    # Encode the output straight to the file in batches of rows instead of building the whole file as a string first,
+    # optionally compressing it (gzip, xz or bz2).  Returns the name of the file written
+    def stream_data(self, filename=None, compression=None, batch_size=100000):
+        write_start = time.time()
+        self.check_partition_by()
+        base_filename = (filename or self.suggested_filename())
+        filename, out = self.open_output(base_filename, compression)
+        with out:
+            self.write_frame(out, batch_size=batch_size)
+
+        if self.partition_by():
+            self.write_partitions(base_filename, self.partition_by(), compression, batch_size)
+        self.timers.record_time('Output Written', write_start)
+        return filename
+
+    # How many partitions stream_partitioned splits the patients into when it is not given a memory budget
+    unbudgeted_partitions = 16
+
+    # Partitioned formatting: split the per-patient Synthea inputs into partitions of patients, enough for the workers
+    # formatting them at once to stay within memory_budget MB between them (or unbudgeted_partitions).  The partitions
+    # are gathered one at a time, or by a pool of worker processes (no more than one each ahead of the output), and
+    # written in partition order, each appended to the output as it comes in.  The partitions are contiguous runs of
+    # patients.csv (see partition_by_patient), so the rows are written, and numbered, in the same order as gather_data
+    # and stream_data would, and the file is the same whatever the budget and number of workers.  Returns the name of
+    # the file written
+    def stream_partitioned(self, memory_budget=None, workers=1, filename=None, compression=None, batch_size=100000):
+        write_start = time.time()
+        self.check_partition_by()
+        synthea_output = self.synthea_output
+        base_filename = (filename or self.suggested_filename())
+        if memory_budget:
+            partitions = synthea_output.partition_count(memory_budget, workers)
+        else:
+            partitions = self.unbudgeted_partitions
+        print(f'Formatting in {partitions} partition(s) by patient with {workers} worker(s)')
+        try:
+            partition_outputs = synthea_output.partition_by_patient(partitions)
+            gather = functools.partial(gather_partition, type(self), {**self.kwargs, 'Seed': self.seed})
+            filename, out = self.open_output(base_filename, compression)
+            with out, self.worker_pool(workers) as pool:
+                frames = self.in_order(pool, workers, gather, partition_outputs) if pool else \
+                    map(gather, partition_outputs)
+                for i, (frame, partition_timers) in enumerate(frames):
+                    self.output_df = frame
+                    self.timers.add_timers(partition_timers)
+                    printSectionSubHeader(f'Partition {i + 1} of {len(partition_outputs)}')
+                    self.number_rows()
+                    self.write_frame(out, batch_size=batch_size, header=(i == 0))
+                    if self.partition_by():
+                        self.write_partitions(base_filename, self.partition_by(), compression, batch_size,
+                                              append=(i > 0))
+                    self.row_offset += len(self.output_df)
+                    self.output_df = pd.DataFrame()
+        finally:
+            synthea_output.remove_partitions()
+        self.timers.record_time('Output Written', write_start)
+        return filename
+
+    # The results of func for each of items from the pool, in order.  No more than workers items are handed out ahead of
+    # the result being used, so finished frames never pile up waiting to be written
+    @staticmethod
+    def in_order(pool, workers, func, items):
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) > workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    # A process pool with the given number of workers, or None to work in this process.  The mapping tables are loaded
+    # first so forked workers share them rather than each reading them again
+    @staticmethod
+    def worker_pool(workers):
+        if workers <= 1:
+            return contextlib.nullcontext()
+        mappings.load_tables()
+        sys.stdout.flush()
+        return multiprocessing.Pool(workers)
+
+    def partition_key(self, partition_by):
+        column_name = self.partition_columns[partition_by]
+        if column_name not in self.output_df.columns:
+            raise ValueError(f'This format has no {column_name} to partition the output by {partition_by}')
+        column = self.output_df[column_name]
+        if partition_by == 'year':
+            column = parse_date_vectorized(column).dt.year.astype('Int64')
+        # Rows without a value (e.g. organizations with no HCAI id) are grouped together as 'unknown'
+        key = column.astype(object).where(column.notna(), '').astype(str)
+        return key.where(key != '', 'unknown').reset_index(drop=True)
+
+    # Split the output into one file per discharge year, facility or county, written to a directory named after the
+    # main output file.  Rows are grouped once from the in-memory frame and each group is encoded straight to its file.
+    # With append=True the rows are added to the files already written by the previous calls
+    def write_partitions(self, filename, partition_by, compression=None, batch_size=100000, append=False):
+        basename, extension = os.path.basename(filename).split(".", 1)
+        directory = os.path.join(os.path.dirname(os.path.abspath(filename)), basename)
+        os.makedirs(directory, exist_ok=True)
+
+        key = self.partition_key(partition_by)
+        partitions = key.groupby(key.to_numpy()).indices
+        names = sorted(partitions)
+        # For yearly output every year of the requested range gets a file (even if empty), and only those years
+        if partition_by == 'year' and self.kwargs['YearRange']:
+            year_range = list(map(int, self.kwargs['YearRange'].split("-")))
+            names = [str(year) for year in range(year_range[0], year_range[1]+1)]
+
+        if not append:
+            self.written_partitions = set()
+        for name in names:
+            rows = partitions.get(name, np.array([], dtype=int))
+            partition_filename = f'{directory}/{basename}_{name}.{extension}'
+            written = partition_filename in self.written_partitions
+            self.written_partitions.add(partition_filename)
+            partition_filename, out = self.open_output(partition_filename, compression, mode='a' if written else 'w')
+            with out:
+                self.write_frame(out, rows, batch_size, header=not written)
 
     def add_demographics(self):
         demo_start = time.time()
-        patients = self.synthea_output.patients_df()
-        patients['patient_id'] = patients.iloc[:, 0]
+        self.output_df = self.shared_stage('demographics', self.demographics)
+        print('Demographics added. Shape: ', self.output_df.shape)
+        self.timers.record_time('Demographics', demo_start)
+
+    # One row of demographics per patient
+    def demographics(self):
+        # Only read the patients.csv columns we use
+        patients = self.read_input('patients')
+        patients['patient_id'] = patients['Id']
         try:
-            patients['Date of Birth'] = patients.iloc[:, 1].apply(lambda x: x.strftime('%m%d%Y'))
-            patients['Date of Birth Raw'] = patients.iloc[:, 1].apply(lambda x: x.strftime('%m%d%Y'))
+            patients['Date of Birth'] = patients['BIRTHDATE'].apply(lambda x: x.strftime('%m%d%Y'))
+            patients['Date of Birth Raw'] = patients['BIRTHDATE'].apply(lambda x: x.strftime('%m%d%Y'))
         except AttributeError:
-            patients['Date of Birth'] = patients.iloc[:, 1].apply(
+            patients['Date of Birth'] = patients['BIRTHDATE'].apply(
                 lambda x: dt.datetime.strptime(x, '%Y-%m-%d').strftime('%m%d%Y'))
-            patients['Date of Birth Raw'] = patients.iloc[:, 1 ].apply(
+            patients['Date of Birth Raw'] = patients['BIRTHDATE'].apply(
                 lambda x: dt.datetime.strptime(x, '%Y-%m-%d').strftime('%m%d%Y'))
-        patients['Race'] = mappings.race(patients.iloc[:, 13])
-        patients['Ethnicity'] = mappings.ethnicity(patients.iloc[:, 14])
-        patients['Sex'] = patients.iloc[:, 15]
-        patients['Social Security Number'] = patients.iloc[:, 3].fillna('000000001').apply(lambda x: x.replace('-', ''))
-        patients['Record Linkage Number'] = patients.iloc[:, 3].fillna('000000001').apply(lambda x: x.replace('-', ''))
-        patients['Abstract Record Number'] = patients.iloc[:, 3].fillna('000000001')
-        patients['Patient Address - Address Number and Street Name'] = patients.iloc[:, 17]
-        patients['Patient Address - City'] = patients.iloc[:, 18]
-        patients['Patient Address - State'] = patients.iloc[:, 19]
-        patients['Patient Address - County'] = mappings.CAcounty(patients.iloc[:, 20])
-        patients['Patient Address - Zip Code'] = patients.iloc[:, 22].fillna('XXXXX')
+        patients['Race'] = mappings.race(patients['RACE'])
+        patients['Ethnicity'] = mappings.ethnicity(patients['ETHNICITY'])
+        patients['Sex'] = patients['GENDER']
+        patients['Social Security Number'] = patients['SSN'].fillna('000000001').apply(lambda x: x.replace('-', ''))
+        patients['Record Linkage Number'] = patients['SSN'].fillna('000000001').apply(lambda x: x.replace('-', ''))
+        patients['Abstract Record Number'] = patients['SSN'].fillna('000000001')
+        patients['Patient Address - Address Number and Street Name'] = patients['ADDRESS']
+        patients['Patient Address - City'] = patients['CITY']
+        patients['Patient Address - State'] = patients['STATE']
+        patients['Patient Address - County'] = mappings.CAcounty(patients['COUNTY'])
+        patients['Patient Address - Zip Code'] = patients['ZIP'].fillna('XXXXX')
         patients['Patient Address - Country Code'] = self.country_code
-        self.output_df = patients[['patient_id', 'Date of Birth', 'Date of Birth Raw', 'Sex', 'Ethnicity', 'Race',
-                                   'Social Security Number', 'Record Linkage Number', 'Abstract Record Number',
-                                   'Patient Address - Address Number and Street Name', 'Patient Address - City',
-                                   'Patient Address - State', 'Patient Address - County', 'Patient Address - Zip Code',
-                                   'Patient Address - Country Code']]
-        print('Demographics added. Shape: ', self.output_df.shape)
+        return patients[['patient_id', 'Date of Birth', 'Date of Birth Raw', 'Sex', 'Ethnicity', 'Race',
+                         'Social Security Number', 'Record Linkage Number', 'Abstract Record Number',
+                         'Patient Address - Address Number and Street Name', 'Patient Address - City',
+                         'Patient Address - State', 'Patient Address - County', 'Patient Address - Zip Code',
+                         'Patient Address - Country Code']]
 
-        del patients
-        self.timers.record_time('Demographics', demo_start)
+    # Row filter for the encounters reader (see EncounterFilter)
+    def encounter_filter(self, by_year=False):
+        return EncounterFilter(self.kwargs['EncounterType'], self.kwargs['YearRange'] if by_year else False)
+
+    # Row filter for the observations reader: just the preferred language observations
+    @staticmethod
+    def language_filter(chunk):
+        return chunk['DESCRIPTION'] == 'Preferred language'
 
     @abstractmethod
     def add_encounters(self) -> pd.DataFrame:
@@ -103,24 +365,58 @@ class HCAIBase(Formatter, ABC):
 
     def add_procedures(self):
         proc_start = time.time()
-        procedures = self.synthea_output.procedures_df(subfields=[0, 3, 4])
+        procedure_lists = self.shared_stage('procedures', lambda: self.group_procedures(proc_start))
+        procedures = procedure_lists.keys.assign(procedure_group=np.arange(len(procedure_lists)))
+        print('SUB-CHECK - Procedures Shape post group: ', procedures.shape)
+
+        # Merge the encounter's lists into output_df and then do a special formatting operation for the lists
+        self.output_df = self.output_df.merge(procedures[['encounter_id', 'procedure_group']], how='left',
+                                              on='encounter_id')
+        print('Procedures info added.  Shape: ', self.output_df.shape)
+        self.timers.record_time('Procedures Output DF merge', proc_start)
+
+        # The first procedure in the list is used as the principal procedure
+        groups = self.output_df.pop('procedure_group')
+        self.output_df = procedure_lists.spread(
+            self.output_df, groups, ['Procedure Codes', 'Procedure Dates', 'Procedure Days'],
+            [[f'Principal {name}'] + [f'{name} {i}' for i in range(1, 25)]
+             for name in ['Procedure Code', 'Procedure Date', 'Procedure Days']])
+        # The whole lists are only written out by the verbose outputs
+        if self.kwargs['Verbose']:
+            for field in ['Procedure Codes', 'Procedure Dates', 'Procedure Days']:
+                self.output_df[field] = procedure_lists.tuples(field, groups)
+        print('Procedure info formatted.   Shape: ', self.output_df.shape)
+        self.timers.record_time('Procedures List Modifications', proc_start)
+
+        # Kept for the MS-DRG grouper
+        self.procedure_lists = procedure_lists
+        del procedures
+        self.timers.record_time('Procedures', proc_start)
+
+    # Each encounter's procedure codes, dates and days since admission (with the admission dates of the encounters in
+    # output_df, so shared lists must be built by the formatter with the most encounters, see HCAIAllFormats)
+    def group_procedures(self, proc_start):
+        procedures = self.read_input('procedures')
         self.timers.record_time('Procedures CSV Read', proc_start)
 
         # TODO procedures are not included in the current basic snomed map, find them.  Pass-through for now.
         #  Note that these are also longer and get truncated by field length later!
-        #  procedures['Procedure Codes'] = mappings.snomedicdbasicmap(procedures.iloc[:, 2])
-        # Reminder that column index 1 here is the column index 3 from the procedures.csv due to our subfields parameter
-        procedures['encounter_id'] = procedures.iloc[:, 1]
+        #  procedures['Procedure Codes'] = mappings.snomedicdbasicmap(procedures['CODE'])
+        procedures['encounter_id'] = procedures['ENCOUNTER']
 
         # TODO - make this programmatically selected based on study args?
         # We do have some static LARC-related mappings, so try those, but for most results, its a passthrough of SNOMED
-        procedures['Procedure Codes'] = mappings.larcsnomedmap(procedures.iloc[:, 2])
+        # Each substitution is drawn from the procedure's encounter, date and code so it does not depend on row order, and
+        # numbered so the same procedure done twice in an encounter gets two draws
+        keys = mappings.numbered_keys(pd.concat([self.synthea_output.decode_keys('encounter', procedures['ENCOUNTER']),
+                                                 procedures[['START', 'CODE']]], axis=1))
+        procedures['Procedure Codes'] = mappings.larcsnomedmap(procedures['CODE'], keys=keys, seed=self.seed)
 
         # Similar to encounters, we handle either date formatting here
         try:
-            procedures['Procedure Dates'] = procedures.iloc[:, 0].apply(lambda x: x.strftime('%Y%m%d'))
+            procedures['Procedure Dates'] = procedures['START'].apply(lambda x: x.strftime('%Y%m%d'))
         except TypeError:
-            procedures['Procedure Dates'] = procedures.iloc[:, 0].apply(
+            procedures['Procedure Dates'] = procedures['START'].apply(
                 lambda x: dt.datetime.strptime(x, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y%m%d'))
 
         # Grab Admission Date from output_df
@@ -133,80 +429,87 @@ class HCAIBase(Formatter, ABC):
 
         self.timers.record_time('Procedures Staydays Calculation', proc_start)
 
-        # Group codes by encounter_id to consolidate to one row for each encounter - this makes later merges easier
+        # Group codes by encounter_id to consolidate to one row for each encounter - this makes later merges easier.  The
+        # lists are kept as flat arrays and only each encounter's position in them is merged into output_df
         print('SUB-CHECK - Procedures Shape pre group: ', procedures.shape)
-        procedures = procedures.groupby('encounter_id').agg(lambda x: tuple(x)).reset_index()
+        procedure_lists = RaggedLists(procedures, 'encounter_id',
+                                      ['Procedure Codes', 'Procedure Dates', 'Procedure Days'])
         self.timers.record_time('Procedures Group By Calculation', proc_start)
+        return procedure_lists
 
-        print('SUB-CHECK - Procedures Shape post group: ', procedures.shape)
-
-        # Assign some MSDRG codes used in the LARC study.  Ordered so the most accurate one assigns.
-        procedures.loc[procedures['Procedure Codes'].apply(lambda x: '66348005' in x),              # Parturition
-                       ['Medicare Severity-Diagnosis Related Group', 'Major Diagnostic Category']] = ['807', '14']
-        procedures.loc[procedures['Procedure Codes'].apply(lambda x: '85548006' in x),              # Episiotomy
-                       ['Medicare Severity-Diagnosis Related Group', 'Major Diagnostic Category']] = ['768', '14']
-        procedures.loc[procedures['Procedure Codes'].apply(lambda x: '11466000' in x),              # C-section
-                       ['Medicare Severity-Diagnosis Related Group', 'Major Diagnostic Category']] = ['788', '14']
-        self.timers.record_time('Procedures Add MSDRGs', proc_start)
-
-        # Merge procedure code and date into output_df and then do a special formatting operation for the lists
-        self.output_df = self.output_df.merge(procedures[['encounter_id', 'Procedure Codes', 'Procedure Dates', 'Procedure Days', 'Medicare Severity-Diagnosis Related Group']],
+    def add_other_diagnosis(self):
+        diagnosis_start = time.time()
+        diagnosis_lists, diagnosis = self.shared_stage('diagnoses', self.group_diagnoses)
+        self.output_df = self.output_df.merge(diagnosis[['encounter_id', 'diagnosis_group', 'Type of Coverage']],
                                               how='left', on='encounter_id')
-        print('Procedures info added.  Shape: ', self.output_df.shape)
-        self.timers.record_time('Procedures Output DF merge', proc_start)
 
-        self.output_df = self.output_df.apply(modify_procedure_row, axis=1, args=(
-            ['Procedure Codes', 'Procedure Dates', 'Procedure Days'], ['Procedure Code', 'Procedure Date', 'Procedure Days']))
-        print('Procedure info formatted.   Shape: ', self.output_df.shape)
-        self.timers.record_time('Procedures List Modifications', proc_start)
+        print('Diagnosis info added.  Shape: ', self.output_df.shape)
 
-        del procedures
-        self.timers.record_time('Procedures', proc_start)
+        # The first claim diagnosis replaces the encounter's Principal Diagnosis
+        groups = self.output_df.pop('diagnosis_group')
+        self.output_df = diagnosis_lists.spread(
+            self.output_df, groups, ['Diagnosis Codes', 'Present on Admission'],
+            [['Principal Diagnosis'] + [f'Diagnosis {i}' for i in range(1, 25)],
+             ['Present on Admission for Principal Diagnosis'] + [f'Present on Admission {i}' for i in range(1, 25)]])
+        if self.kwargs['Verbose']:
+            for field in ['Diagnosis Codes', 'Present on Admission']:
+                self.output_df[field] = diagnosis_lists.tuples(field, groups)
+
+        del diagnosis, diagnosis_lists
+        self.timers.record_time('Diagnoses', diagnosis_start)
 
-    def add_other_diagnosis(self):
-        diagnosis_start = time.time()
-        # As the file sizes get large, a full read_csv becomes impossible, so we select the columns we want to use and
-        # effectively reindex them in the dataframe we are creating (i.e. column 8 in the csv becomes column 0, etc.)
-        diagnosis = self.synthea_output.diagnosis_df(subfields=[8, 21, 88, 90])
-
-        # Reminder that column index 0 here is the column index 8 from the CPCSD_Claims.csv due to our usecols parameter
-        diagnosis['encounter_id'] = diagnosis.iloc[:, 0]
-        diagnosis['coverage_id'] = diagnosis.iloc[:, 1]
-        diagnosis['Diagnosis Codes'] = mappings.snomedicdbasicmap(diagnosis.iloc[:, 2])
+    # Each encounter's claim diagnosis codes and present on admission flags, and the encounter's coverage type
+    def group_diagnoses(self):
+        # As the file sizes get large, a full read_csv becomes impossible, so we only read the claim columns we use
+        diagnosis = self.read_input('diagnosis')
+
+        diagnosis['encounter_id'] = diagnosis['ENCOUNTER']
+        diagnosis['coverage_id'] = diagnosis['COVERAGE']
+        diagnosis['Diagnosis Codes'] = mappings.snomedicdbasicmap(diagnosis['DIAGNOSIS_CODE'])
         diagnosis['Diagnosis Codes'].replace("", np.nan, inplace=True)
         diagnosis.dropna(subset=['Diagnosis Codes'], inplace=True)
-        diagnosis['Present on Admission'] = diagnosis.iloc[:, 3]
+        diagnosis['Present on Admission'] = diagnosis['DIAGNOSIS_POA']
 
 
         # Group up the diagnosis codes by encounter_id
         print('SUB-CHECK - Diagnosis Shape pre group: ', diagnosis.shape)
-        diagnosis = diagnosis.groupby(['encounter_id', 'coverage_id']).agg(lambda x: tuple(x)).reset_index()
+        diagnosis_lists = RaggedLists(diagnosis, ['encounter_id', 'coverage_id'],
+                                      ['Diagnosis Codes', 'Present on Admission'])
+        diagnosis = diagnosis_lists.keys.assign(diagnosis_group=np.arange(len(diagnosis_lists)))
         print('SUB-CHECK - Diagnosis Shape post group: ', diagnosis.shape)
 
         # Add in Coverage Type
-        coverages = self.synthea_output.coverages_df(subfields=[0, 4])
-        coverages['coverage_id'] = coverages.iloc[:, 0]
-        coverages['Type of Coverage'] = mappings.cov_to_pay_type(coverages.iloc[:, 1])
+        coverages = self.read_input('coverages')
+        coverages['coverage_id'] = coverages['Id']
+        coverages['Type of Coverage'] = mappings.cov_to_pay_type(coverages['TYPE'])
         diagnosis = diagnosis.merge(coverages[['coverage_id', 'Type of Coverage']], how='left', left_on='coverage_id',
                                     right_on='coverage_id')
+        return diagnosis_lists, diagnosis
 
-        self.output_df = self.output_df.merge(diagnosis[['Type of Coverage', 'Diagnosis Codes', 'Present on Admission']],
-                                              how='left', left_on='encounter_id', right_on=diagnosis.iloc[:, 0])
-
-        print('Diagnosis info added.  Shape: ', self.output_df.shape)
+    # Assign each encounter its MS-DRG, MDC, MS-DRG category, severity and grouper version from the grouper rules
+    # matching its procedure codes
+    def add_drgs(self):
+        drg_start = time.time()
+        drgs = self.shared_stage('drgs', lambda: self.group_drgs(self.procedure_lists))
+        self.output_df = self.output_df.merge(drgs, how='left', on='encounter_id')
+        print('MS-DRGs assigned.  Shape: ', self.output_df.shape)
 
-        self.output_df = self.output_df.apply(modify_diagnosis_row, axis=1, args=(
-            ['Diagnosis Codes', 'Present on Admission'], ['Diagnosis', 'Present on Admission']))
+        del self.procedure_lists
+        self.timers.record_time('MS-DRGs', drg_start)
 
-        del diagnosis
-        self.timers.record_time('Diagnoses', diagnosis_start)
+    @staticmethod
+    def group_drgs(procedure_lists):
+        drgs = mappings.msdrg_grouper(procedure_lists.item_groups, procedure_lists.values['Procedure Codes'])
+        return procedure_lists.keys.join(drgs, how='inner')
 
+    # The hard-coded and generated fields, returned as columns for allocate_output to add to output_df
     def hard_coding(self):
         hardcoding_start = time.time()
+        rows = len(self.output_df)
+        columns = {}
 
         # Hard code Type of Care to be 1 ("Acute Care") always for now
-        care_s = pd.Series([1 for _ in range(len(self.output_df.index))])
-        self.output_df = pd.concat([self.output_df, care_s.rename('Type of Care')], axis=1)
+        columns['Type of Care'] = np.ones(rows, dtype=np.int64)
 
         # Display coverage type = 0 for any payer catagory 07,08,09
         self.output_df.loc[self.output_df['Payer Category'].isin(['07', '08', '09']), 'Type of Coverage'] = '0'
@@ -215,53 +518,104 @@ class HCAIBase(Formatter, ABC):
         self.output_df.loc[self.output_df['Type of Coverage'].isin(['0', '2', '3']), 'Plan Code Number'] = '0000'
 
         # Randomly assign Type of Admission, Point of Origin, Route of Admission
-        ta_s = pd.Series(np.random.choice(['1', '2', '3', '4', '5', '9'], size=len(self.output_df)))
-        self.output_df = pd.concat([self.output_df, ta_s.rename('Type of Admission')], axis=1)
-        po_s = pd.Series(np.random.choice(['1', '2', '4', '5', '6', '8', 'D', 'E', 'F', 'G'], size=len(self.output_df)))
-        self.output_df = pd.concat([self.output_df, po_s.rename('Point of Origin')], axis=1)
-        ra_s = pd.Series([3 for _ in range(len(self.output_df.index))])
-        self.output_df = pd.concat([self.output_df, ra_s.rename('Route of Admission')], axis=1)
+        columns['Type of Admission'] = self.random_choice(['1', '2', '3', '4', '5', '9'], 'Type of Admission')
+        columns['Point of Origin'] = self.random_choice(['1', '2', '4', '5', '6', '8', 'D', 'E', 'F', 'G'],
+                                                        'Point of Origin')
+        columns['Route of Admission'] = np.full(rows, 3, dtype=object)
 
         # Narrow the choices of Point of Origin or Route of Admission depending on Type of Admission Value
-        self.output_df.loc[self.output_df['Type of Admission'] == '4', 'Point of Origin'] = \
-            np.random.choice(['5', '6'], size=len(self.output_df.loc[self.output_df['Type of Admission'] == '4']))
-        self.output_df.loc[self.output_df['Type of Admission'] == '1', 'Route of Admission'] = \
-            np.random.choice(['1', '2'], size=len(self.output_df.loc[self.output_df['Type of Admission'] == '1']))
-
-        disposition_s = pd.Series(np.random.choice(mappings.disposition(), size=len(self.output_df)))
-        self.output_df = pd.concat([self.output_df, disposition_s.rename('Disposition of Patient')], axis=1)
+        newborn = columns['Type of Admission'] == '4'
+        columns['Point of Origin'][newborn] = self.random_choice(['5', '6'], 'Newborn Point of Origin', rows=newborn)
+        emergency = columns['Type of Admission'] == '1'
+        columns['Route of Admission'][emergency] = \
+            self.random_choice(['1', '2'], 'Emergency Route of Admission', rows=emergency)
 
-        dnr_s = pd.Series(np.random.choice(['Y', 'N'], size=len(self.output_df)))
-        self.output_df = pd.concat([self.output_df, dnr_s.rename('Prehospital Care & Resuscitation - DNR Order')],
-                                   axis=1)
+        columns['Disposition of Patient'] = self.random_choice(mappings.disposition(), 'Disposition of Patient')
+        columns['Prehospital Care & Resuscitation - DNR Order'] = self.random_choice(['Y', 'N'], 'DNR Order')
 
-        # The patients are already processed in order, so we can go through them and count unique SSNs to assign an ID
-        result_series = pd.Series(0, index=range(len(self.output_df)))
-        for i in range(len(self.output_df)):
-            subset_series = self.output_df['Social Security Number'].iloc[:i + 1]
-            unique_count = 100000000000 + subset_series.nunique()
-            result_series.iloc[i] = unique_count
-        self.output_df['Patient Identification Number'] = result_series
+        columns.update(self.row_numbers())
 
-        dsi_s = pd.Series(np.arange(1000000001, len(self.output_df) + 1000000001))
-        self.output_df = pd.concat([self.output_df, dsi_s.rename('Data Set Identification Number')], axis=1)
-
-        count_s = pd.Series(np.arange(1, len(self.output_df) + 1))
-        self.output_df = pd.concat([self.output_df, count_s.rename('Counter')], axis=1)
-
-        print('Hard-coded fields added.  Shape: ', self.output_df.shape)
+        print('Hard-coded fields added.  Shape: ', (rows, self.output_df.shape[1] + len(columns)))
         self.timers.record_time('Hardcoding', hardcoding_start)
-
-    def fill_missing(self):
-        cols = list(self.output_df.columns)
-        missing = sorted(list(set(self.final_fields['name'].tolist()).difference(cols)))
-        none_s = pd.Series([None for _ in range(len(self.output_df.index))])
+        return columns
+
+    # The fields that number the output rows.  They carry on from the rows of earlier partitions (row_offset and the
+    # patients counted so far), so a partitioned run is numbered as one output
+    def row_numbers(self):
+        rows = len(self.output_df)
+        # The patients are already processed in order, so we count unique SSNs as they are first seen to assign an ID
+        return {'Patient Identification Number': self.patient_id_counter.assign(
+                    self.output_df['Social Security Number']).to_numpy(),
+                'Data Set Identification Number': np.arange(1000000001, rows + 1000000001) + self.row_offset,
+                'Counter': np.arange(1, rows + 1) + self.row_offset}
+
+    # Renumber a partition gathered on its own (see gather_partition) as the next rows of the whole output
+    def number_rows(self):
+        if len(self.output_df):
+            for name, values in self.row_numbers().items():
+                self.output_df[name] = values
+
+    # Pick one of options (with equal weights) for every row of output_df, or only the rows selected by rows.  Each
+    # field draws from its own stream keyed on the encounter id (numbered, for an encounter with several rows, e.g. one
+    # per coverage) and the run seed, so a row gets the same value however the rows are chunked or split between
+    # processes
+    def random_choice(self, options, stream, rows=None):
+        keys = mappings.numbered_keys(self.synthea_output.decode_keys('encounter', self.output_df['encounter_id']))
+        if rows is not None:
+            keys = keys[rows]
+        uniforms = mappings.keyed_uniforms(keys, self.seed, stream)
+        return mappings.weighted_choice(options, np.ones(len(options)), uniforms)
+
+    # Lay out the final output frame in one step: the gathered fields, the given (hard-coded) columns and a null column
+    # for every field of the layout that is still missing.  Adding these one concat at a time copied the whole, wide,
+    # frame again for each of them
+    def allocate_output(self, columns):
+        missing = sorted(set(self.final_fields['name'].tolist()).difference(self.output_df.columns, columns))
         print("\n", "Missing Fields: assigning null values", "\n")
         for col in missing:
             print("  ", col)
-            # self.output_df[col] = None
-            self.output_df = pd.concat([self.output_df, none_s.rename(col)], axis=1)
+            columns[col] = np.full(len(self.output_df), None, dtype=object)
         print("End Missing Fields")
+        self.output_df = pd.concat([self.output_df, pd.DataFrame(columns, index=self.output_df.index)], axis=1)
 
+    # Convert each column to the type convert_dtypes infers for it (Int64 for whole number floats, and so on).  Columns
+    # are replaced one at a time, so only one column is ever held twice rather than the whole frame
     def type_data(self):
-        self.output_df = self.output_df.convert_dtypes()
+        typing_start = time.time()
+        for name in self.output_df.columns:
+            self.output_df[name] = self.output_df[name].convert_dtypes()
+        self.timers.record_time('Output Types', typing_start)
+
+
+# Row filter for the encounters reader (see SyntheaOutput.chunk_csv_reader) by ENCOUNTERCLASS and the year of STOP.
+# Filters that keep the same rows are equal, so formatters sharing their reads can tell they want the same encounters
+class EncounterFilter:
+    def __init__(self, encounter_type, year_range):
+        self.encounter_type = encounter_type
+        self.year_range = year_range
+
+    def __call__(self, chunk):
+        mask = pd.Series(True, index=chunk.index)
+        if self.encounter_type:
+            mask &= chunk['ENCOUNTERCLASS'] == self.encounter_type
+        if self.year_range:
+            year_range = list(map(int, self.year_range.split("-")))
+            discharge_year = pd.to_datetime(chunk['STOP']).dt.year
+            mask &= (discharge_year >= year_range[0]) & (discharge_year <= year_range[1])
+        return mask
+
+    def __eq__(self, other):
+        return isinstance(other, EncounterFilter) and \
+            (self.encounter_type, self.year_range) == (other.encounter_type, other.year_range)
+
+    def __hash__(self):
+        return hash((self.encounter_type, self.year_range))
+
+
+# Gather the output of one patient partition with a new formatter_class formatter (the work of a formatting worker).
+# Returns the output and the worker's timers (see CreateTimers.summary)
+def gather_partition(formatter_class, kwargs, synthea_output):
+    formatter = formatter_class(CreateTimers(), **kwargs)
+    formatter.synthea_output = synthea_output
+    formatter.gather_data()
+    return formatter.output_df, formatter.timers.summary()
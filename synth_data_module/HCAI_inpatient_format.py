@@ -1,10 +1,9 @@
 import datetime as dt
-from synth_data_module import HCAIBase, get_procedure_list, get_diagnosis_list
+from synth_data_module import HCAIBase, get_procedure_list, get_diagnosis_list, write_fixed_width, whole_dollars
 import pandas as pd
 import numpy as np
 import synth_data_module.mappings as mappings
 import time
-from io import StringIO
 
 
 class HCAIInpatientFormat(HCAIBase):
@@ -73,98 +72,92 @@ class HCAIInpatientFormat(HCAIBase):
         return f'{self.synthea_output.output_loc}/formatted_data/HCAIInpatient/{ftype}_HCAIInpatient_' \
                f'{date_time.strftime("%m-%d-%Y_%H%M")}.{fextension}'
 
-    def format_data(self):
-        # StringIO acts like a file object, but collects its output in
-        # a string instead of writing to a file.
-        sbuffer = StringIO()
-        df = self.output_df.copy()
+    def output_columns(self):
+        fields = self.all_fields if "CSV" in self.kwargs['FormatType'] and self.kwargs['Verbose'] else self.final_fields
+        return fields['name'].tolist(), fields['name'].tolist()
 
+    def encode_rows(self, df, out, header=True):
         # CSV data formatting
         if "CSV" in self.kwargs['FormatType']:
-            if self.kwargs['Verbose']:
-                df[self.all_fields['name'].tolist()].to_csv(sbuffer, index=False)
-            else:
-                df[self.final_fields['name'].tolist()].to_csv(sbuffer, index=False)
+            df.to_csv(out, header=header, index=False)
 
-        # Fixed width data formatting
+        # Fixed width data formatting (no header), each column left/right justified and cut to its length
         else:
-            df = df[self.final_fields['name'].tolist()]
-            # Force left/right justification, min/max length and string type for each column and
-            # keep a list of this format for all our columns
-            formats = []
-            for length, justification in zip(self.final_fields.length, self.final_fields.justification):
-                if justification == 'left':
-                    justchar = '-'
-                else:
-                    justchar = ''
-                fmt = f'%{justchar}{length}.{length}s'
-                formats += [fmt]
-            df.fillna('', inplace=True)
-            np.savetxt(sbuffer, df, fmt=formats, delimiter='')
-
-        # getvalue() returns the string built up inside of the StringIO.
-        return sbuffer.getvalue()
+            write_fixed_width(df, self.final_fields['length'], self.final_fields['justification'], out)
+
+    def input_reads(self):
+        return {**super().input_reads(),
+                'encounters': {'subfields': ['Id', 'START', 'STOP', 'PATIENT', 'ORGANIZATION', 'PAYER',
+                                               'ENCOUNTERCLASS', 'TOTAL_CLAIM_COST', 'REASONCODE'],
+                                'where': self.encounter_filter()},
+                'organizations': {'subfields': ['Id', 'NAME']},
+                'payers': {'subfields': ['Id', 'NAME', 'OWNERSHIP']},
+                'observations': {'subfields': ['ENCOUNTER', 'DESCRIPTION', 'VALUE'], 'where': self.language_filter}}
 
     def add_encounters(self):
-        encounters = self.synthea_output.encounters_df()
-        encounters['encounter_id'] = encounters.iloc[:, 0]
-        encounters['organization_id'] = encounters.iloc[:, 4]
-        encounters['payer_id'] = encounters.iloc[:, 6]
-        encounters['EncounterClass'] = encounters.iloc[:, 7]
-        if self.kwargs['EncounterType']:
-            encounters = encounters.loc[encounters['EncounterClass'] == self.kwargs['EncounterType'], :].copy()
+        # The encounter type filter is applied as the csv is read
+        encounters = self.read_input('encounters')
+        encounters['encounter_id'] = encounters['Id']
+        encounters['organization_id'] = encounters['ORGANIZATION']
+        encounters['payer_id'] = encounters['PAYER']
+        encounters['EncounterClass'] = encounters['ENCOUNTERCLASS']
 
         # We had some issues getting the date format correct if headers were used in synthea, this try/except handles
         # both cases more smoothly now
         try:
-            encounters['Admission Date'] = encounters.iloc[:, 1].apply(lambda x: x.strftime('%Y%m%d'))
-            encounters['Discharge Date'] = encounters.iloc[:, 2].apply(lambda x: x.strftime('%Y%m%d'))
+            encounters['Admission Date'] = encounters['START'].apply(lambda x: x.strftime('%Y%m%d'))
+            encounters['Discharge Date'] = encounters['STOP'].apply(lambda x: x.strftime('%Y%m%d'))
         except TypeError:
-            encounters['Admission Date'] = encounters.iloc[:, 1].apply(
+            encounters['Admission Date'] = encounters['START'].apply(
                 lambda x: dt.datetime.strptime(x, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y%m%d'))
-            encounters['Discharge Date'] = encounters.iloc[:, 2].apply(
+            encounters['Discharge Date'] = encounters['STOP'].apply(
                 lambda x: dt.datetime.strptime(x, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y%m%d'))
-        # encounters['Principal Diagnosis'] = encounters.iloc[:, 13]  # Needs mapping for ICD-10
-        encounters['Principal Diagnosis'] = mappings.snomedicdbasicmap(encounters.iloc[:, 13])
-        encounters['Total Charges'] = encounters.iloc[:, 11].apply(lambda x: str(min(int(x.split('.')[0]), 9999999)))
+        # encounters['Principal Diagnosis'] = encounters['REASONCODE']  # Needs mapping for ICD-10
+        encounters['Principal Diagnosis'] = mappings.snomedicdbasicmap(encounters['REASONCODE'])
+        encounters['Total Charges'] = whole_dollars(encounters['TOTAL_CLAIM_COST'])
         print('SUB-CHECK - Encounters Shape: ', encounters.shape)
 
-        # Prepare and merge organizations name as Facility Name (replace IDs with real names) into encounters
-        organizations = self.synthea_output.organizations_df()
-        organizations['organization_id'] = organizations.iloc[:, 0]
-        organizations['Facility Name'] = organizations.iloc[:, 1]
-        encounters = encounters.merge(organizations[['organization_id', 'Facility Name']], how='left',
-                                      left_on='organization_id', right_on='organization_id')
+        # Prepare and merge organizations name as Facility Name (replace IDs with real names) and HCAI facility id into
+        # encounters
+        organizations = self.read_input('organizations')
+        organizations['organization_id'] = organizations['Id']
+        organizations['Facility Name'] = organizations['NAME']
+        organizations['Facility Identification Number'] = mappings.hcai(organizations['NAME'], length=6)
+        encounters = encounters.merge(organizations[['organization_id', 'Facility Name',
+                                                     'Facility Identification Number']],
+                                      how='left', left_on='organization_id', right_on='organization_id')
         print('SUB-CHECK - Facility Name merged.  Encounters Shape: ', encounters.shape)
 
         # Prepare and merge payers info (replace IDs with real payer data) into encounters
-        payers = self.synthea_output.payers_df()
-        payers['payer_id'] = payers.iloc[:, 0]
-        payers['Payer Category'] = payers.apply(mappings.payer_category, axis=1).astype(str)
+        payers = self.read_input('payers')
+        payers['payer_id'] = payers['Id']
+        payers['Payer Category'] = mappings.payer_category(payers['NAME'], payers['OWNERSHIP'])
         encounters = encounters.merge(payers[['payer_id', 'Payer Category']], how='left', left_on='payer_id',
                                       right_on='payer_id')
         print('SUB-CHECK - Payers and codes merged.  Encounters Shape: ', encounters.shape)
 
         # Prepare and merge observations info (for language) into encounters
-        observations = self.synthea_output.observations_df(subfields=[2, 5, 6])
-        observations['encounter_id'] = observations.iloc[:, 0]
-        observations['description'] = observations.iloc[:, 1]
-        observations = observations.loc[observations['description'] == 'Preferred language']
-        observations['Preferred Language Spoken Write In'] = observations.iloc[:, 2]
+        observations = self.read_input('observations')
+        observations['encounter_id'] = observations['ENCOUNTER']
+        observations['description'] = observations['DESCRIPTION']
+        observations['Preferred Language Spoken Write In'] = observations['VALUE']
         encounters = encounters.merge(observations[['encounter_id', 'Preferred Language Spoken Write In']],
                                       how='left', left_on='encounter_id', right_on='encounter_id')
         print('SUB-CHECK - observations and language merged.  Encounters Shape: ', encounters.shape)
 
+        encounter_keys = self.synthea_output.decode_keys('encounter', encounters['encounter_id'])
         encounters['Preferred Language Spoken Write In'] = mappings.languagewritein(
-            encounters['Preferred Language Spoken Write In'])
+            encounters['Preferred Language Spoken Write In'], keys=encounter_keys, seed=self.seed)
         encounters['Preferred Language Spoken'] = mappings.language(encounters['Preferred Language Spoken Write In'])
 
         # Merge the encounters dataframe into self.output_df, keeping only the fields we care about
         self.output_df = self.output_df.merge(encounters[['encounter_id', 'Admission Date', 'Discharge Date',
                                                           'Principal Diagnosis', 'Total Charges', 'Payer Category',
-                                                          'Facility Name']],
-                                              how='left', left_on='patient_id', right_on=encounters.iloc[:, 3])
+                                                          'Facility Name', 'Facility Identification Number']],
+                                              how='left', left_on='patient_id', right_on=encounters['PATIENT'])
         print('Encounter info added.  Shape: ', self.output_df.shape)
+        # The left merge leaves patients without encounters as NaN, so the encounter codes come back as floats
         self.output_df = self.output_df.dropna(subset=['encounter_id']).reset_index(drop=True)
+        self.output_df['encounter_id'] = self.output_df['encounter_id'].astype(np.int64)
         print('Patients with no encounters of desired type dropped.  Shape: ', self.output_df.shape)
         del encounters
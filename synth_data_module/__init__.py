@@ -1,8 +1,32 @@
-from .synthea import Synthea, SyntheaOutput
-from .formatting_helpers import Formatter, get_procedure_list, get_diagnosis_list, get_morbidity_list, \
-    modify_procedure_row, modify_diagnosis_row, clear_old_files, parse_city, calculate_age
-from .HCAI_base_format import HCAIBase
-from .HCAI_inpatient_format import HCAIInpatientFormat
-from .HCAI_PDD_format import HCAIPDDFormat
-from .formatting_factory import create_formatter
-from .logging_helpers import *
+import importlib
+
+# The package's public names and the submodule each one lives in.  Names are imported from their submodule the first
+# time they are used, so importing the package (or a single submodule such as mappings) does not load pandas, numpy
+# and every formatter up front.  `from synth_data_module import *` still loads everything.
+_exports = {
+    'synthea': ['Synthea', 'SyntheaOutput'],
+    'formatting_helpers': ['Formatter', 'get_procedure_list', 'get_diagnosis_list', 'get_morbidity_list',
+                           'clear_old_files', 'parse_city', 'calculate_age', 'FirstSeenCounter',
+                           'parse_date_vectorized', 'write_fixed_width', 'whole_dollars', 'RaggedLists'],
+    'HCAI_base_format': ['HCAIBase'],
+    'HCAI_inpatient_format': ['HCAIInpatientFormat'],
+    'HCAI_PDD_format': ['HCAIPDDFormat'],
+    'HCAI_all_formats': ['HCAIAllFormats'],
+    'formatting_factory': ['create_formatter'],
+    'logging_helpers': ['setSysOut', 'printLogDetails', 'printSectionHeader', 'printSectionSubHeader',
+                        'printElapsedTime', 'CreateTimers', 'ProgressTimer'],
+}
+_locations = {name: module for module, names in _exports.items() for name in names}
+__all__ = list(_locations)
+
+
+def __getattr__(name):
+    if name not in _locations:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_locations[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
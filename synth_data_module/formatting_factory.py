@@ -1,10 +1,12 @@
-from synth_data_module import HCAIInpatientFormat, HCAIPDDFormat, Formatter
+from synth_data_module import HCAIInpatientFormat, HCAIPDDFormat, HCAIAllFormats, Formatter
 
 
 # Factory method
 def create_formatter(timers, **kwargs) -> Formatter: #, settings: argparse.Namespace
     print("FORMATTER", kwargs['FormatType'])
-    if "HCAI_Inpatient" in kwargs['FormatType']:
+    if kwargs['FormatType'] == 'all':
+        return HCAIAllFormats(timers, **kwargs)
+    elif "HCAI_Inpatient" in kwargs['FormatType']:
         return HCAIInpatientFormat(timers, **kwargs)
     elif "HCAI_PDD" in kwargs['FormatType']:
         return HCAIPDDFormat(timers, **kwargs)
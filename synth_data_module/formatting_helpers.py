@@ -1,6 +1,7 @@
 ########################################
 # Functions to help with formatting data
 ########################################
+import codecs
 import glob
 import os
 import math
@@ -24,7 +25,15 @@ class Formatter(ABC):
         pass
 
     @abstractmethod
-    def write_data(self, data):
+    def write_data(self, data, filename=None):
+        pass
+
+    @abstractmethod
+    def stream_data(self, filename=None, compression=None, batch_size=100000):
+        pass
+
+    @abstractmethod
+    def stream_partitioned(self, memory_budget=None, workers=1, filename=None, compression=None, batch_size=100000):
         pass
 
 
@@ -75,37 +84,143 @@ def get_morbidity_list():
     return morbidity_list
 
 
-def modify_procedure_row(row, df_fields, new_fields):
-    first = row[df_fields[0]]
-    second = row[df_fields[1]]
-    third = row[df_fields[2]]
-    if True:  # 'Procedure Codes' in df_fields:
-        if isinstance(first, tuple) and isinstance(second, tuple) and isinstance(third, tuple):
-            for code, date, days, i in zip(first, second, third, range(0, 25)):
-                if i == 0:
-                    row[f'Principal {new_fields[0]}'] = code
-                    row[f'Principal {new_fields[1]}'] = date
-                    row[f'Principal {new_fields[2]}'] = days
-                else:
-                    row[f'{new_fields[0]} {i}'] = code
-                    row[f'{new_fields[1]} {i}'] = date
-                    row[f'{new_fields[2]} {i}'] = days
-    return row
-
-
-def modify_diagnosis_row(row, df_fields, new_fields):
-    first = row[df_fields[0]]
-    second = row[df_fields[1]]
-    if True:  # 'Procedure Codes' in df_fields:
-        if isinstance(first, tuple) and isinstance(second, tuple):
-            for code, date, i in zip(first, second, range(0, 25)):
-                if i == 0:
-                    row[f'Principal {new_fields[0]}'] = code
-                    row[f'{new_fields[1]} for Principal {new_fields[0]}'] = date
-                else:
-                    row[f'{new_fields[0]} {i}'] = code
-                    row[f'{new_fields[1]} {i}'] = date
-    return row
+# Set column_names[j][positions[k]] to flats[j][k] on row item_rows[k] of df, for every item k.  Existing columns keep
+# their values on the rows that are not filled.
+def _fill_numbered_columns(df, item_rows, positions, flats, column_names):
+    if len(item_rows) == 0:
+        return df
+
+    # Group the items by position so each numbered column is filled with a single slice assignment
+    order = np.argsort(positions, kind='stable')
+    bounds = np.searchsorted(positions[order], np.arange(positions.max() + 2))
+    new_columns = {}
+    for flat, names in zip(flats, column_names):
+        for i in range(positions.max() + 1):
+            if names[i] in df.columns:
+                column = df[names[i]].to_numpy(dtype=object, copy=True)
+            else:
+                column = np.full(len(df), np.nan, dtype=object)
+            selected = order[bounds[i]:bounds[i + 1]]
+            column[item_rows[selected]] = flat[selected]
+            new_columns[names[i]] = column
+
+    new_df = pd.DataFrame(new_columns, index=df.index).infer_objects()
+    df = df.drop(columns=[name for name in new_columns if name in df.columns])
+    return pd.concat([df, new_df], axis=1)
+
+
+# The lists of values that each group of rows holds (e.g. the procedure codes and dates of every encounter), kept as
+# one flat array per field in group order plus the offset where each group starts, rather than a tuple per group and
+# field.  keys has one row per group holding its by values (groups are sorted by them, and each list keeps the order
+# of the rows), so the groups can be merged onto another frame by their position in keys.  As with groupby, rows with
+# a missing by value belong to no group.
+class RaggedLists:
+    def __init__(self, df, by, fields):
+        by = [by] if isinstance(by, str) else list(by)
+        group = df.groupby(by, sort=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        order = np.argsort(group, kind='stable')
+        order = order[group[order] >= 0]
+        counts = np.bincount(group[order], minlength=group.max() + 1 if len(order) else 0)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.keys = df[by].iloc[order[self.offsets[:-1]]].reset_index(drop=True)
+        self.values = {field: df[field].to_numpy()[order] for field in fields}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    # The group of each item of the flat arrays
+    @property
+    def item_groups(self):
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    # Whether each group's list of field holds value
+    def contains(self, field, value):
+        hits = np.flatnonzero(self.values[field] == value)
+        found = np.zeros(len(self), dtype=bool)
+        found[np.searchsorted(self.offsets, hits, side='right') - 1] = True
+        return found
+
+    # The group (position in keys) of each row of a frame the groups were merged onto, -1 where there is none
+    @staticmethod
+    def _groups(groups):
+        return pd.Series(groups).fillna(-1).to_numpy(dtype=np.int64)
+
+    # The lists of field as tuples, one per entry of groups (NaN where there is no group), for outputs that show them
+    def tuples(self, field, groups):
+        lists = np.empty(len(self) + 1, dtype=object)
+        lists[:-1] = [tuple(values) for values in np.split(self.values[field], self.offsets[1:-1])] if len(self) else []
+        lists[-1] = np.nan
+        return lists[self._groups(groups)]
+
+    # Spread the lists of fields (e.g. the codes, dates and POA flags of an encounter) out into numbered fields of df,
+    # where groups gives the group of each row of df.  column_names[j][i] is the output column for the ith item of
+    # fields[j], and anything past the given names is dropped.  Existing columns keep their values on the rows that are
+    # not filled
+    def spread(self, df, groups, fields, column_names):
+        groups = self._groups(groups)
+        rows = np.flatnonzero(groups >= 0)
+        lengths = np.minimum(self.lengths[groups[rows]], min(len(names) for names in column_names))
+        item_rows = np.repeat(rows, lengths)
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        items = np.repeat(self.offsets[groups[rows]], lengths) + positions
+        return _fill_numbered_columns(df, item_rows, positions, [self.values[field][items] for field in fields],
+                                     column_names)
+
+
+# Write df to out as fixed width records (one newline terminated line per row, no header).  Each column is turned into
+# a block of UCS4 code points cut to its length, blocks are laid side by side and the unused space is blanked out, so a
+# whole block of rows is decoded into text at once instead of formatting every cell.  Missing values are written as
+# blanks.
+def write_fixed_width(df, lengths, justifications, out, block_size=10000):
+    lengths = [int(length) for length in lengths]
+    offsets = np.cumsum([0] + lengths)
+    # Columns with no values at all (e.g. unused procedure slots) are left blank without being converted
+    filled = df.notna().any().to_numpy()
+    for start in range(0, len(df), block_size):
+        block = df.iloc[start:start + block_size]
+        records = np.zeros((len(block), offsets[-1] + 1), dtype='<u4')
+        for i, (length, justification) in enumerate(zip(lengths, justifications)):
+            if length == 0 or not filled[i]:
+                continue
+            text = block.iloc[:, i].to_numpy(dtype=object, na_value='').astype(f'<U{length}')
+            codes = text.view('<u4').reshape(len(block), length)
+            if justification == 'right':
+                # Shift each value right by its unused width (the run of trailing zero padding)
+                source = np.arange(length) - (codes == 0).sum(axis=1)[:, None]
+                codes = np.where(source < 0, 0, np.take_along_axis(codes, np.maximum(source, 0), axis=1))
+            records[:, offsets[i]:offsets[i + 1]] = codes
+        records[records == 0] = ord(' ')
+        records[:, -1] = ord('\n')
+        out.write(codecs.decode(memoryview(records), 'utf-32-le'))
+
+
+# Costs as whole dollars (cents dropped) capped at maximum, as strings
+def whole_dollars(costs, maximum=9999999):
+    dollars = np.minimum(np.trunc(costs.to_numpy(dtype=float)), maximum).astype(np.int64)
+    return pd.Series(dollars.astype(str), index=costs.index, dtype=object)
+
+
+# Assigns running distinct-value counts in first-seen order (i.e. the nth new value seen gets start + n).  State is
+# kept between calls so a frame processed in chunks or partitions gets the same numbers as a single full pass.
+class FirstSeenCounter:
+    def __init__(self, start=0):
+        self.count = start
+        self.seen = set()
+
+    def assign(self, col):
+        # A value is new if it is the first occurrence in this chunk and was not seen in any earlier chunk.  Nulls are
+        # never counted (matching nunique).  Only the chunk's distinct values are looked up in (and added to) the set of
+        # values seen so far, so each chunk costs the same however many came before it
+        new = ~col.duplicated() & col.notna()
+        new[new] = [value not in self.seen for value in col[new]]
+        result = self.count + new.cumsum()
+        self.count += int(new.sum())
+        self.seen.update(col[new])
+        return result
 
 
 # Function to parse dates with multiple formats
@@ -120,29 +235,73 @@ def parse_date(date):
 
 
 def parse_date_vectorized(series):
-    parsed_dates = pd.to_datetime(series, errors='coerce', format='%m%d%Y').fillna(pd.to_datetime(series, errors='coerce'))
+    # Try the HCAI date format first and only fall back to general parsing for values that did not match it
+    parsed_dates = pd.to_datetime(series, errors='coerce', format='%m%d%Y')
+    retry = parsed_dates.isna() & series.notna()
+    if retry.any():
+        parsed_dates = parsed_dates.fillna(pd.to_datetime(series.where(retry), errors='coerce'))
     return parsed_dates.dt.tz_localize(None)
 
 
+# Parse a date column once and reuse it on later calls.  parsed_dates is a dict owned by the caller and keyed by column
+# name, so it should only be shared between calls on the same frame
+def parse_date_cached(df, column, parsed_dates=None):
+    if parsed_dates is None:
+        return parse_date_vectorized(df[column])
+    if column not in parsed_dates:
+        parsed_dates[column] = parse_date_vectorized(df[column])
+    return parsed_dates[column]
+
+
+# Whole calendar years between two datetime Series, matching relativedelta(date2, date1).years exactly (including month
+# end clipping, time of day and negative spans) using array math instead of a python call per row.  Returns Int64 with
+# <NA> where either date is missing
+def calendar_years(date1, date2):
+    valid = (date1.notna() & date2.notna()).to_numpy()
+    date1, date2 = date1[valid], date2[valid]
+    months = ((date2.dt.year - date1.dt.year) * 12 + (date2.dt.month - date1.dt.month)).to_numpy()
+
+    # relativedelta adds the month difference to date1 (clipping the day to the end of date2's month) and then steps
+    # back one month if that overshoots date2, or forward one month for spans that run backwards
+    shifted_day = np.minimum(date1.dt.day.to_numpy(), date2.dt.days_in_month.to_numpy())
+    day2 = date2.dt.day.to_numpy()
+    time1 = (date1 - date1.dt.normalize()).to_numpy()
+    time2 = (date2 - date2.dt.normalize()).to_numpy()
+    before_shifted = (day2 < shifted_day) | ((day2 == shifted_day) & (time2 < time1))
+    after_shifted = (day2 > shifted_day) | ((day2 == shifted_day) & (time2 > time1))
+    forward = (date2 >= date1).to_numpy()
+    months = months - (forward & before_shifted) + (~forward & after_shifted)
+
+    years = np.zeros(len(valid), dtype='int64')
+    years[valid] = np.sign(months) * (np.abs(months) // 12)
+    return pd.arrays.IntegerArray(years, ~valid)
+
+
+# Age bucket of (years + 1) // width as a zero padded string, with <NA> where years is missing
+def age_range(years, width):
+    ranges = pd.Series((years + 1) // width, dtype=object)
+    return ranges.where(ranges.isna(), ranges.astype(str).str.zfill(2)).to_numpy()
+
+
 # HCAI has specific criteria for age reporting
-def calculate_age(df, date1, date2, form="agedays", fieldname='Procedure Days'):
+def calculate_age(df, date1, date2, form="agedays", fieldname='Procedure Days', parsed_dates=None):
     # Ensure Date Formatting, then calculate specialized date differences according to desired format
-    df['date1'] = parse_date_vectorized(df[date1])
-    df['date2'] = parse_date_vectorized(df[date2])
-    df['basic_days'] = (df['date2'] - df['date1']).dt.days
+    parsed_date1 = parse_date_cached(df, date1, parsed_dates)
+    parsed_date2 = parse_date_cached(df, date2, parsed_dates)
+    basic_days = (parsed_date2 - parsed_date1).dt.days
 
     if form == "agedays":
-        df[fieldname] = np.where(df['basic_days'] < 366, df['basic_days'].clip(lower=1), 0)
+        df[fieldname] = np.where(basic_days < 366, basic_days.clip(lower=1), 0)
     elif form == "staydays":
-        df[fieldname] = df['basic_days'].astype(float)  # Handle NaNs automatically
+        df[fieldname] = basic_days.astype(float)  # Handle NaNs automatically
     elif form == 'adjstaydays':
-        df[fieldname] = df['basic_days'].clip(lower=1)
+        df[fieldname] = basic_days.clip(lower=1)
     elif form == "years":
-        df[fieldname] = df.apply(lambda row: relativedelta(row['date2'], row['date1']).years if pd.notna(row['date2']) and pd.notna(row['date1']) else pd.NA, axis=1)
+        df[fieldname] = calendar_years(parsed_date1, parsed_date2)
     elif form == "range5":
-        df[fieldname] = df.apply(lambda row: str((relativedelta(row['date2'], row['date1']).years + 1) // 5).zfill(2) if pd.notna(row['date2']) and pd.notna(row['date1']) else pd.NA, axis=1)
+        df[fieldname] = age_range(calendar_years(parsed_date1, parsed_date2), 5)
     elif form == "range10":
-        df[fieldname] = df.apply(lambda row: str((relativedelta(row['date2'], row['date1']).years + 1) // 10).zfill(2) if pd.notna(row['date2']) and pd.notna(row['date1']) else pd.NA, axis=1)
+        df[fieldname] = age_range(calendar_years(parsed_date1, parsed_date2), 10)
     # elif form == 'years':
     #     df[fieldname] = df.apply(lambda row: relativedelta(row['date2'], row['date1']).years, axis=1)
     # elif form == 'range5':
@@ -162,6 +321,7 @@ def clear_old_files():
     output_csvs = 'output/csv/*'
     output_fhirs = 'output/fhir/*'
     output_metadata = 'output/metadata/*'
+    output_cache = 'output/cache/*'
 
     files0 = glob.glob(output_cpcds)
     for f in files0:
@@ -175,6 +335,9 @@ def clear_old_files():
     files3 = glob.glob(output_metadata)
     for f in files3:
         os.remove(f)
+    files4 = glob.glob(output_cache)
+    for f in files4:
+        os.remove(f)
 
 
 def parse_city(specify_city=None):
@@ -3,8 +3,11 @@
 ########################################
 import getpass
 import datetime as dt
+import os
 import sys
+import threading
 import time
+import weakref
 
 
 def setSysOut(logname):
@@ -42,15 +45,125 @@ def printElapsedTime(start_time, statement='Elapsed Time: ', suppress=False):
     return elapsed_time
 
 
+# The memory (resident set size) the process holds right now, in MB, or None where the platform cannot tell us (there
+# is no /proc/self/statm outside of Linux)
+def currentMemory():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# The timers the memory sampler feeds, and the process it is running in.  One thread per process samples the memory for
+# every CreateTimers, however many of them there are (e.g. one per formatting step in a worker)
+_sampled_timers = weakref.WeakSet()
+_sampler_pid = None
+_sampler_lock = threading.Lock()
+
+
+def _sample_memory():
+    while True:
+        time.sleep(CreateTimers.sample_interval)
+        memory = currentMemory()
+        with _sampler_lock:
+            sampled_timers = list(_sampled_timers)
+        for timers in sampled_timers:
+            timers.note_memory(memory)
+        del sampled_timers
+
+
 class CreateTimers:
+    # How often (in seconds) the memory is sampled to find the peak of each step
+    sample_interval = 0.01
+
     def __init__(self):
         self.start = time.time()
         self.timers = {}
+        self.peaks = {}
+        # The peak memory of each stretch between two recorded steps, as (end of the stretch, peak), and the peak of
+        # the stretch still going.  The process's memory sampler feeds it in the background while the timers are in use
+        self.stretches = []
+        self.stretch_peak = currentMemory()
+        self.lock = threading.Lock()
+        if self.stretch_peak is not None:
+            self.start_sampling()
+
+    # Have the process's sampler thread (started by the first timers in the process, forked workers included) feed these
+    # timers too
+    def start_sampling(self):
+        global _sampler_pid
+        with _sampler_lock:
+            if _sampler_pid != os.getpid():
+                # A forked process has the parent's timers, but not its sampler thread
+                _sampled_timers.clear()
+                _sampler_pid = os.getpid()
+                threading.Thread(target=_sample_memory, daemon=True).start()
+            _sampled_timers.add(self)
 
+    def note_memory(self, memory=None):
+        if memory is None:
+            memory = currentMemory()
+        with self.lock:
+            self.stretch_peak = max(self.stretch_peak, memory)
+
+    # Also notes the peak memory during the step (the highest of the stretches since start), so each step reports its
+    # own peak rather than the highest the process has reached so far
     def record_time(self, name, start, suppress=False):
         elapsed_time = printElapsedTime(start, name + " Ran In: ", suppress)
         self.timers[name] = elapsed_time
+        if self.stretch_peak is None:
+            return
+        self.note_memory()
+        with self.lock:
+            self.stretches.append((time.time(), self.stretch_peak))
+            self.stretch_peak = currentMemory()
+        self.peaks[name] = max(peak for end, peak in self.stretches if end > start)
+
+    # The time and peak memory of every step, to hand back from another process (see add_timers)
+    def summary(self):
+        return {name: (elapsed_time, self.peaks.get(name)) for name, elapsed_time in self.timers.items()}
+
+    # Add the steps another process timed (e.g. a formatting worker): times add up and the peak is the highest any one
+    # process reached in the step
+    def add_timers(self, summary):
+        for name, (elapsed_time, peak) in summary.items():
+            self.timers[name] = self.timers.get(name, 0) + elapsed_time
+            if peak is not None:
+                self.peaks[name] = max(self.peaks.get(name) or 0, peak)
 
     def print_timers(self):
         for key, value in self.timers.items():
-            print(key, ": ", round(value, 1))
+            if self.peaks.get(key) is None:
+                print(key, ": ", round(value, 1))
+            else:
+                print(key, ": ", round(value, 1), f"  (peak memory {round(self.peaks[key])} MB)")
+
+
+# Periodic progress report for long running steps: count done out of total, the rate so far and the time remaining.
+# Safe to update from several threads (e.g. one per synthea shard)
+class ProgressTimer:
+    def __init__(self, total, statement='Progress: ', interval=30):
+        self.start = time.time()
+        self.total = total
+        self.statement = statement
+        self.interval = interval
+        self.done = 0
+        self.last_print = self.start
+        self.lock = threading.Lock()
+
+    def update(self, count=1):
+        with self.lock:
+            self.done += count
+            if time.time() - self.last_print >= self.interval:
+                self.print_progress()
+
+    def print_progress(self):
+        self.last_print = time.time()
+        elapsed_time = self.last_print - self.start
+        rate = self.done / elapsed_time if elapsed_time > 0 else 0
+        minutes, seconds = divmod((self.total - self.done) / rate if rate > 0 else 0, 60)
+        hours, minutes = divmod(minutes, 60)
+        print(self.statement, f'{self.done} of {self.total} ({round(rate, 2)}/sec), ETA ',
+              f'{int(hours)} hrs ' * (hours > 0), f'{int(minutes)} mins ' * (minutes > 0), f'{int(seconds)} secs.',
+              sep='', flush=True)
@@ -1,139 +1,244 @@
 import csv
+import functools
+import hashlib
+import os
 import random
+import numpy as np
 import pandas as pd
 
-with open('synth_data_module/snomedbasicmappings.csv') as f:
-    next(f)  # Skip the header
-    reader = csv.reader(f, skipinitialspace=True)
-    snomeddict = dict(reader)
+# Mapping tables are found relative to the package (not the working directory) and are only read the first time
+# they are used
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PACKAGE_DIR)
+
+
+@functools.lru_cache(maxsize=None)
+def snomed_table():
+    with open(os.path.join(PACKAGE_DIR, 'snomedbasicmappings.csv')) as f:
+        next(f)  # Skip the header
+        reader = csv.reader(f, skipinitialspace=True)
+        return dict(reader)
 
-with open('StudyOverrides/LARC/hospitals.csv') as f:
-    next(f)  # Skip the header
-    reader = csv.reader(f, skipinitialspace=True)
-    HCAImap = {rows[2]: rows[19] for rows in reader}
 
+@functools.lru_cache(maxsize=None)
+def hcai_table():
+    with open(os.path.join(PROJECT_DIR, 'StudyOverrides', 'LARC', 'hospitals.csv')) as f:
+        next(f)  # Skip the header
+        reader = csv.reader(f, skipinitialspace=True)
+        return {rows[2]: rows[19] for rows in reader}
 
-def ethnicity(col):
-    dic = {'hispanic': 'E1',
-           'nonhispanic': 'E2'}
-    col = col.apply(lambda x: dic.get(x, '99'))
-    return col
 
+# The MS-DRG grouper rules, one row per procedure code of each rule's code set (see msdrg_grouper)
+@functools.lru_cache(maxsize=None)
+def msdrg_table():
+    return pd.read_csv(os.path.join(PACKAGE_DIR, 'msdrgrules.csv'), dtype=str).astype({'PRECEDENCE': int})
 
-def gender(col):
-    dic = {'M': 'M',
-           'F': 'F'}
-    col = col.apply(lambda x: dic.get(x, 'U'))
-    return col
 
+# Read every mapping table now.  Call this before starting worker processes so forked workers share the loaded
+# tables instead of each reading them again
+def load_tables():
+    snomed_table()
+    hcai_table()
+    msdrg_table()
 
-def languagewritein(col):
+
+# A code lookup table compiled once at import.  Calling it on a Series factorizes the column and looks up each distinct
+# value once (through key, if given, e.g. to normalise case), so repeated values cost nothing extra.  Values missing
+# from the table get default and missing (NA) values get na (the default unless given).  The table may be given as a
+# loader function so file-backed tables are only read when first used.
+class CodeMap:
+    def __init__(self, table, default, key=None, na=None):
+        self._table = table
+        self.default = default
+        self.key = key
+        self.na = default if na is None else na
+
+    @property
+    def table(self):
+        return self._table() if callable(self._table) else self._table
+
+    # value, if given, is applied to each looked up code (once per distinct value as well)
+    def __call__(self, col, value=None):
+        codes, uniques = pd.factorize(col)
+        keys = uniques if self.key is None else map(self.key, uniques)
+        table = self.table
+        mapped = [table.get(k, self.default) for k in keys] + [self.na]
+        if value is not None:
+            mapped = [value(code) for code in mapped]
+        lookup = np.empty(len(mapped), dtype=object)
+        lookup[:] = mapped
+        # NA rows have code -1, which picks the na entry at the end of the lookup
+        return pd.Series(lookup[codes], index=col.index, name=col.name)
+
+
+# One uniform [0, 1) draw per row of keys (a Series or DataFrame identifying each row, e.g. encounter ids), made by
+# hashing the key with the seed.  A row gets the same draw for a given seed however the data is chunked or
+# partitioned, and each stream name gives an independent set of draws.  Without a seed the draws come from the random
+# module's state.
+def keyed_uniforms(keys, seed=None, stream=''):
+    if seed is None:
+        seed = random.getrandbits(64)
+    hash_key = hashlib.md5(f'{stream}:{seed}'.encode()).hexdigest()[:16]
+    hashes = pd.util.hash_pandas_object(keys, index=False, hash_key=hash_key).to_numpy()
+    return (hashes >> np.uint64(11)) * 2.0 ** -53
+
+
+# Keys to draw with when the caller has none: the column's values plus their row position (so only reproducible for
+# the same rows in the same order)
+def row_keys(col, keys=None):
+    if keys is not None:
+        return keys
+    return pd.DataFrame({'value': col.astype(str).to_numpy(), 'position': np.arange(len(col))})
+
+
+# keys with the rows that share a key numbered 0, 1, ... in row order, so they still get independent draws.  The nth
+# row of a key gets the same draw however the rows are chunked or split between processes
+def numbered_keys(keys):
+    keys = keys.to_frame() if isinstance(keys, pd.Series) else keys
+    return keys.assign(key_number=keys.groupby(list(keys.columns), sort=False, dropna=False).cumcount().to_numpy())
+
+
+# Pick from options with the given weights for each uniform draw, all at once
+def weighted_choice(options, weights, uniforms):
+    cumulative = np.cumsum(weights, dtype=float)
+    picks = np.searchsorted(cumulative / cumulative[-1], uniforms, side='right')
+    choices = np.empty(len(options), dtype=object)
+    choices[:] = options
+    return choices[picks]
+
+
+ethnicity = CodeMap({'hispanic': 'E1',
+                     'nonhispanic': 'E2'}, default='99')
+
+
+gender = CodeMap({'M': 'M',
+                  'F': 'F'}, default='U')
+
+
+def languagewritein(col, keys=None, seed=None):
     language_list = ['English', 'Spanish', 'Mandarin', 'Tagalog', 'Vietnamese', 'Korean', 'Farsi', 'Armenian', 'Arabic',
                      'Hindi']
     language_weights = (58.2, 28.8, 3.2, 2.2, 1.5, 1, 0.5, 0.5, 0.5, 0.5)
-    col = col.apply(lambda x: random.choices(language_list, weights=language_weights)[0] if pd.isnull(x) else x)
-    return col
-
-
-def language(col):
-    dic = {
-            'English': 'ENG',
-            'Spanish': 'SPA',
-            'Mandarin': 'CMN',
-            'Tagalog': 'TGL',
-            'Vietnamese': 'VIE',
-            'Korean': 'KOR',
-            'Farsi': 'PES',
-            'Armenian': 'ARM',
-            'Arabic': 'ARA',
-            'Hindi': 'HIN',
-            '': ''
-            }
-    col = col.apply(lambda x: dic.get(x, '-'))
-    return col
-
-
-def larcsnomedmap(col):
-    dic = {'65200003':  {'0UH97HZ': 99, '0UH98HZ': 1},
-           '169553002': {'0JHD3HZ': 10, '0JHF3HZ': 90},
-           }
-    col = col.apply(lambda x: random.choices(list(dic.get(x, {x: x}).keys()),
-                                             weights=tuple(dic.get(x, {x: 1}).values()))[0])
-    return col
-
-
-def cov_to_pay_type(col):
-    dic = {
-        'HMO': '1',
-        'PPO': '2',
-        'EPO': '2',
-        'POS': '2',
-    }
-    col = col.apply(lambda x: dic.get(x, '-'))
-    return col
-
-
-def hmo_plan_codes(col):
-    dic = {
-        'Humana': '0476',
-        'Blue Cross Blue Shield': '0043',
-        'UnitedHealthcare': '0126',
-        'Aetna': '0176',
-        'Cigna Health': '0152',
-        'Anthem': '0303',
-        'Kaiser': '0055',
-    }
-    col = col.apply(lambda x: dic.get(x, '0000'))
-    return col
-
-
-def payer_category(df, study=None):
-    govdic = {'medicare': '01',
-              'medi-cal': '02',
-              'medical': '02',
-              # Designate dual eligible payers as medicare:
-              'dual eligible': '01',
-              # County Indigent Programs : '05',
-              }
-    privdic = {
-           # Workers’ Compensation : '04',
-           # Other Indigent : '07',
-           }
-    # If Gov owned payer identify if medicare or medical, otherwise return 06 ('OTHER Gov'). lower match for accuracy
-    # Add a path to get medical in for gov if doing a specific study
-    if df[2] in ['GOVERNMENT', ]:
-        if study == 'LARC':
-            category = govdic.get(df[1].lower(), '02')
-        else:
-            category = govdic.get(df[1].lower(), '06')
-    # If Private owned, look up specific designations (to be added as necessary) otherwise return 03 = private coverage
-    elif df[2] in ['PRIVATE', ]:
-        category = privdic.get(df[1], '03')
-    # Return Self Pay if NO_INSURANCE
-    elif df[2] in ['NO_INSURANCE', ]:
-        category = '08'
-    else:
-        category = '09'
-    return category
-
-
-def drg_catagories(col):
-    dic = {'788': '788',  # CESAREAN SECTION WITHOUT STERILIZATION WITHOUT CC/MCC
-           '768': '768',  # VAGINAL DELIVERY WITH O.R. PROCEDURE EXCEPT STERILIZATION AND/OR D&C
-           '807': '807'}  # VAGINAL DELIVERY WITHOUT STERILIZATION OR D&C WITHOUT CC/MCC
-    col = col.apply(lambda x: dic.get(x, ''))
-    return col
-
-
-def race(col):
-    dic = {'native': 'R1',
-           'asian': 'R2',
-           'black': 'R3',
-           'hawaiian': 'R4',
-           'white': 'R5',
-           'other': 'R9'}
-    col = col.apply(lambda x: dic.get(x, '99'))
-    return col
+    result = col.to_numpy(dtype=object, copy=True)
+    missing = col.isna().to_numpy()
+    uniforms = keyed_uniforms(row_keys(col, keys), seed, 'languagewritein')
+    result[missing] = weighted_choice(language_list, language_weights, uniforms[missing])
+    return pd.Series(result, index=col.index, name=col.name)
+
+
+language = CodeMap({
+    'English': 'ENG',
+    'Spanish': 'SPA',
+    'Mandarin': 'CMN',
+    'Tagalog': 'TGL',
+    'Vietnamese': 'VIE',
+    'Korean': 'KOR',
+    'Farsi': 'PES',
+    'Armenian': 'ARM',
+    'Arabic': 'ARA',
+    'Hindi': 'HIN',
+    '': ''
+}, default='-')
+
+
+larc_substitutions = {'65200003':  {'0UH97HZ': 99, '0UH98HZ': 1},
+                      '169553002': {'0JHD3HZ': 10, '0JHF3HZ': 90},
+                      }
+
+
+# Codes with LARC substitutions are swapped for one of them (by weight), everything else passes through
+def larcsnomedmap(col, keys=None, seed=None):
+    result = col.to_numpy(dtype=object, copy=True)
+    uniforms = keyed_uniforms(row_keys(col, keys), seed, 'larcsnomedmap')
+    for code, options in larc_substitutions.items():
+        rows = (col == code).to_numpy()
+        result[rows] = weighted_choice(list(options), list(options.values()), uniforms[rows])
+    return pd.Series(result, index=col.index, name=col.name)
+
+
+cov_to_pay_type = CodeMap({
+    'HMO': '1',
+    'PPO': '2',
+    'EPO': '2',
+    'POS': '2',
+}, default='-')
+
+
+hmo_plan_codes = CodeMap({
+    'Humana': '0476',
+    'Blue Cross Blue Shield': '0043',
+    'UnitedHealthcare': '0126',
+    'Aetna': '0176',
+    'Cigna Health': '0152',
+    'Anthem': '0303',
+    'Kaiser': '0055',
+}, default='0000')
+
+
+government_payers = {'medicare': '01',
+                     'medi-cal': '02',
+                     'medical': '02',
+                     # Designate dual eligible payers as medicare:
+                     'dual eligible': '01',
+                     # County Indigent Programs : '05',
+                     }
+private_payers = {
+    # Workers’ Compensation : '04',
+    # Other Indigent : '07',
+}
+
+# Payer category rules by payer ownership: each ownership looks the payer name up in its own table with its own default
+# - If Gov owned payer identify if medicare or medical (lower match for accuracy), otherwise 06 ('OTHER Gov')
+# - If Private owned, look up specific designations (to be added as necessary) otherwise 03 = private coverage
+# - Self Pay (08) if NO_INSURANCE, and 09 for any other ownership
+payer_category_rules = {'GOVERNMENT': CodeMap(government_payers, default='06', key=str.lower),
+                        'PRIVATE': CodeMap(private_payers, default='03'),
+                        'NO_INSURANCE': CodeMap({}, default='08')}
+payer_category_default = '09'
+# Study specific replacements for the rules above, e.g. a path to get medical in for gov if doing the LARC study
+study_payer_category_rules = {'LARC': {'GOVERNMENT': CodeMap(government_payers, default='02', key=str.lower)}}
+
+
+# Classify payers (or encounters joined to their payer) from their payer name and ownership columns
+def payer_category(names, ownership, study=None):
+    rules = {**payer_category_rules, **study_payer_category_rules.get(study, {})}
+    category = np.full(len(names), payer_category_default, dtype=object)
+    for owner, rule in rules.items():
+        rows = (ownership == owner).to_numpy()
+        if rows.any():
+            category[rows] = rule(names[rows]).to_numpy()
+    return pd.Series(category, index=names.index)
+
+
+# The output fields the MS-DRG grouper fills from the columns of a rule
+msdrg_fields = {'MSDRG': 'Medicare Severity-Diagnosis Related Group', 'MDC': 'Major Diagnostic Category',
+                'CATEGORY': 'MS-DRG Category', 'SEVERITY': 'MS-DRG Severity Code', 'GROUPER': 'MS-DRG Grouper Version'}
+
+
+# Group encounters into MS-DRGs.  Each rule of the table is a code set (one row per code, all sharing the rule's
+# precedence and outputs) and an encounter is assigned the matching rule with the lowest precedence, where a rule
+# matches if the encounter holds any code in its set.  groups and codes give the encounter and code of every
+# procedure, so the rules are matched with a single join instead of scanning each encounter's codes once per rule.
+# Returns the outputs of the assigned rule for each encounter that matched one, indexed by encounter.
+def msdrg_grouper(groups, codes, rules=None):
+    rules = msdrg_table() if rules is None else rules
+    procedures = pd.DataFrame({'group': groups, 'CODE': np.asarray(codes, dtype=object)})
+    matches = procedures.merge(rules[['CODE', 'PRECEDENCE'] + list(msdrg_fields)], on='CODE')
+    matches = matches.sort_values(['group', 'PRECEDENCE'], kind='stable').drop_duplicates('group')
+    return matches.set_index('group')[list(msdrg_fields)].rename(columns=msdrg_fields)
+
+
+drg_catagories = CodeMap({'788': '788',  # CESAREAN SECTION WITHOUT STERILIZATION WITHOUT CC/MCC
+                          '768': '768',  # VAGINAL DELIVERY WITH O.R. PROCEDURE EXCEPT STERILIZATION AND/OR D&C
+                          '807': '807'}, default='')  # VAGINAL DELIVERY WITHOUT STERILIZATION OR D&C WITHOUT CC/MCC
+
+
+race = CodeMap({'native': 'R1',
+                'asian': 'R2',
+                'black': 'R3',
+                'hawaiian': 'R4',
+                'white': 'R5',
+                'other': 'R9'}, default='99')
 
 
 def disposition():
@@ -142,572 +247,570 @@ def disposition():
     return opts
 
 
-def snomedicdbasicmap(col):
-    dic = snomeddict
-    col = col.apply(lambda x: dic.get(x, ''))
-    return col
+snomedicdbasicmap = CodeMap(snomed_table, default='')
+
+
+hcai_codes = CodeMap(hcai_table, default='')
 
 
 def hcai(col, length):
-    dic = HCAImap
-    col = col.apply(lambda x: dic.get(x, '')[-length:])
-    return col
+    return hcai_codes(col, value=lambda code: code[-length:])
+
+
+county_codes = CodeMap({'Invalid': '-',
+                        'Not a California county Unknown or Homeless': '00',
+                        'Alameda': '01',
+                        'Alpine': '02',
+                        'Amador': '03',
+                        'Butte': '04',
+                        'Calaveras': '05',
+                        'Colusa': '06',
+                        'Contra Costa': '07',
+                        'Del Norte': '08',
+                        'El Dorado': '09',
+                        'Fresno': '10',
+                        'Glenn': '11',
+                        'Humboldt': '12',
+                        'Imperial': '13',
+                        'Inyo': '14',
+                        'Kern': '15',
+                        'Kings': '16',
+                        'Lake': '17',
+                        'Lassen': '18',
+                        'Los Angeles': '19',
+                        'Madera': '20',
+                        'Marin': '21',
+                        'Mariposa': '22',
+                        'Mendocino': '23',
+                        'Merced': '24',
+                        'Modoc': '25',
+                        'Mono': '26',
+                        'Monterey': '27',
+                        'Napa': '28',
+                        'Nevada': '29',
+                        'Orange': '30',
+                        'Placer': '31',
+                        'Plumas': '32',
+                        'Riverside': '33',
+                        'Sacramento': '34',
+                        'San Benito': '35',
+                        'San Bernardino': '36',
+                        'San Diego': '37',
+                        'San Francisco': '38',
+                        'San Joaquin': '39',
+                        'San Luis Obispo': '40',
+                        'San Mateo': '41',
+                        'Santa Barbara': '42',
+                        'Santa Clara': '43',
+                        'Santa Cruz': '44',
+                        'Shasta': '45',
+                        'Sierra': '46',
+                        'Siskiyou': '47',
+                        'Solano': '48',
+                        'Sonoma': '49',
+                        'Stanislaus': '50',
+                        'Sutter': '51',
+                        'Tehama': '52',
+                        'Trinity': '53',
+                        'Tulare': '54',
+                        'Tuolumne': '55',
+                        'Ventura': '56',
+                        'Yolo': '57',
+                        'Yuba': '58'},
+                       default='00', key=lambda x: x.replace(" County", ""), na=' ')
 
 
 def CAcounty(col):
-    dic = {'Invalid': '-',
-           'Not a California county Unknown or Homeless': '00',
-           'Alameda': '01',
-           'Alpine': '02',
-           'Amador': '03',
-           'Butte': '04',
-           'Calaveras': '05',
-           'Colusa': '06',
-           'Contra Costa': '07',
-           'Del Norte': '08',
-           'El Dorado': '09',
-           'Fresno': '10',
-           'Glenn': '11',
-           'Humboldt': '12',
-           'Imperial': '13',
-           'Inyo': '14',
-           'Kern': '15',
-           'Kings': '16',
-           'Lake': '17',
-           'Lassen': '18',
-           'Los Angeles': '19',
-           'Madera': '20',
-           'Marin': '21',
-           'Mariposa': '22',
-           'Mendocino': '23',
-           'Merced': '24',
-           'Modoc': '25',
-           'Mono': '26',
-           'Monterey': '27',
-           'Napa': '28',
-           'Nevada': '29',
-           'Orange': '30',
-           'Placer': '31',
-           'Plumas': '32',
-           'Riverside': '33',
-           'Sacramento': '34',
-           'San Benito': '35',
-           'San Bernardino': '36',
-           'San Diego': '37',
-           'San Francisco': '38',
-           'San Joaquin': '39',
-           'San Luis Obispo': '40',
-           'San Mateo': '41',
-           'Santa Barbara': '42',
-           'Santa Clara': '43',
-           'Santa Cruz': '44',
-           'Shasta': '45',
-           'Sierra': '46',
-           'Siskiyou': '47',
-           'Solano': '48',
-           'Sonoma': '49',
-           'Stanislaus': '50',
-           'Sutter': '51',
-           'Tehama': '52',
-           'Trinity': '53',
-           'Tulare': '54',
-           'Tuolumne': '55',
-           'Ventura': '56',
-           'Yolo': '57',
-           'Yuba': '58',
-           pd.NA: ' ',
-           }
     if type(col) == str:
-        col = dic[col]
-    else:
-        col = col.apply(lambda x: dic.get(x.replace(" County", ""), '00'))
-    return col
+        return county_codes.table[col]
+    return county_codes(col)
+
+
+city_counties = CodeMap({
+    'Adelanto': 'San Bernardino',
+    'Agoura Hills': 'Los Angeles',
+    'Alameda': 'Alameda',
+    'Albany': 'Alameda',
+    'Alhambra': 'Los Angeles',
+    'Aliso Viejo': 'Orange',
+    'Alturas': 'Modoc',
+    'Amador City': 'Amador',
+    'American Canyon': 'Napa',
+    'Anaheim': 'Orange',
+    'Anderson': 'Shasta',
+    'Angels': 'Calaveras',
+    'Antioch': 'Contra Costa',
+    'Apple Valley': 'San Bernardino',
+    'Arcadia': 'Los Angeles',
+    'Arcata': 'Humboldt',
+    'Arroyo Grande': 'San Luis Obispo',
+    'Artesia': 'Los Angeles',
+    'Arvin': 'Kern',
+    'Atascadero': 'San Luis Obispo',
+    'Atherton': 'San Mateo',
+    'Atwater': 'Merced',
+    'Auburn': 'Placer',
+    'Avalon': 'Los Angeles',
+    'Avenal': 'Kings',
+    'Azusa': 'Los Angeles',
+    'Bakersfield': 'Kern',
+    'Baldwin Park': 'Los Angeles',
+    'Banning': 'Riverside',
+    'Barstow': 'San Bernardino',
+    'Beaumont': 'Riverside',
+    'Bell': 'Los Angeles',
+    'Bell Gardens': 'Los Angeles',
+    'Bellflower': 'Los Angeles',
+    'Belmont': 'San Mateo',
+    'Belvedere': 'Marin',
+    'Benicia': 'Solano',
+    'Berkeley': 'Alameda',
+    'Beverly Hills': 'Los Angeles',
+    'Big Bear Lake': 'San Bernardino',
+    'Biggs': 'Butte',
+    'Bishop': 'Inyo',
+    'Blue Lake': 'Humboldt',
+    'Blythe': 'Riverside',
+    'Bradbury': 'Los Angeles',
+    'Brawley': 'Imperial',
+    'Brea': 'Orange',
+    'Brentwood': 'Contra Costa',
+    'Brisbane': 'San Mateo',
+    'Buellton': 'Santa Barbara',
+    'Buena Park': 'Orange',
+    'Burbank': 'Los Angeles',
+    'Burlingame': 'San Mateo',
+    'Calabasas': 'Los Angeles',
+    'Calexico': 'Imperial',
+    'California': 'Kern',
+    'Calimesa': 'Riverside',
+    'Calipatria': 'Imperial',
+    'Calistoga': 'Napa',
+    'Camarillo': 'Ventura',
+    'Campbell': 'Santa Clara',
+    'Canyon Lake': 'Riverside',
+    'Capitola': 'Santa Cruz',
+    'Carlsbad': 'San Diego',
+    'Carmel-by-the-Sea': 'Monterey',
+    'Carpinteria': 'Santa Barbara',
+    'Carson': 'Los Angeles',
+    'Cathedral City': 'Riverside',
+    'Ceres': 'Stanislaus',
+    'Cerritos': 'Los Angeles',
+    'Chico': 'Butte',
+    'Chino': 'San Bernardino',
+    'Chino Hills': 'San Bernardino',
+    'Chowchilla': 'Madera',
+    'Chula Vista': 'San Diego',
+    'Citrus Heights': 'Sacramento',
+    'Claremont': 'Los Angeles',
+    'Clayton': 'Contra Costa',
+    'Clearlake': 'Lake',
+    'Cloverdale': 'Sonoma',
+    'Clovis': 'Fresno',
+    'Coachella': 'Riverside',
+    'Coalinga': 'Fresno',
+    'Colfax': 'Placer',
+    'Colma': 'San Mateo',
+    'Colton': 'San Bernardino',
+    'Colusa': 'Colusa',
+    'Commerce': 'Los Angeles',
+    'Compton': 'Los Angeles',
+    'Concord': 'Contra Costa',
+    'Corcoran': 'Kings',
+    'Corning': 'Tehama',
+    'Corona': 'Riverside',
+    'Coronado': 'San Diego',
+    'Corte Madera': 'Marin',
+    'Costa Mesa': 'Orange',
+    'Cotati': 'Sonoma',
+    'Covina': 'Los Angeles',
+    'Crescent City': 'Del Norte',
+    'Cudahy': 'Los Angeles',
+    'Culver City': 'Los Angeles',
+    'Cupertino': 'Santa Clara',
+    'Cypress': 'Orange',
+    'Daly City': 'San Mateo',
+    'Dana Point': 'Orange',
+    'Danville': 'Contra Costa',
+    'Davis': 'Yolo',
+    'Del Mar': 'San Diego',
+    'Del Rey Oaks': 'Monterey',
+    'Delano': 'Kern',
+    'Desert Hot Springs': 'Riverside',
+    'Diamond Bar': 'Los Angeles',
+    'Dinuba': 'Tulare',
+    'Dixon': 'Solano',
+    'Dorris': 'Siskiyou',
+    'Dos Palos': 'Merced',
+    'Downey': 'Los Angeles',
+    'Duarte': 'Los Angeles',
+    'Dublin': 'Alameda',
+    'Dunsmuir': 'Siskiyou',
+    'East Palo Alto': 'San Mateo',
+    'Eastvale': 'Riverside',
+    'El Cajon': 'San Diego',
+    'El Centro': 'Imperial',
+    'El Cerrito': 'Contra Costa',
+    'El Monte': 'Los Angeles',
+    'El Segundo': 'Los Angeles',
+    'Elk Grove': 'Sacramento',
+    'Emeryville': 'Alameda',
+    'Encinitas': 'San Diego',
+    'Escalon': 'San Joaquin',
+    'Escondido': 'San Diego',
+    'Etna': 'Siskiyou',
+    'Eureka': 'Humboldt',
+    'Exeter': 'Tulare',
+    'Fairfax': 'Marin',
+    'Fairfield': 'Solano',
+    'Farmersville': 'Tulare',
+    'Ferndale': 'Humboldt',
+    'Fillmore': 'Ventura',
+    'Firebaugh': 'Fresno',
+    'Folsom': 'Sacramento',
+    'Fontana': 'San Bernardino',
+    'Fort Bragg': 'Mendocino',
+    'Fort Jones': 'Siskiyou',
+    'Fortuna': 'Humboldt',
+    'Foster City': 'San Mateo',
+    'Fountain Valley': 'Orange',
+    'Fowler': 'Fresno',
+    'Fremont': 'Alameda',
+    'Fresno': 'Fresno',
+    'Fullerton': 'Orange',
+    'Galt': 'Sacramento',
+    'Garden Grove': 'Orange',
+    'Gardena': 'Los Angeles',
+    'Gilroy': 'Santa Clara',
+    'Glendale': 'Los Angeles',
+    'Glendora': 'Los Angeles',
+    'Goleta': 'Santa Barbara',
+    'Gonzales': 'Monterey',
+    'Grand Terrace': 'San Bernardino',
+    'Grass Valley': 'Nevada',
+    'Greenfield': 'Monterey',
+    'Gridley': 'Butte',
+    'Grover Beach': 'San Luis Obispo',
+    'Guadalupe': 'Santa Barbara',
+    'Gustine': 'Merced',
+    'Half Moon Bay': 'San Mateo',
+    'Hanford': 'Kings',
+    'Hawaiian Gardens': 'Los Angeles',
+    'Hawthorne': 'Los Angeles',
+    'Hayward': 'Alameda',
+    'Healdsburg': 'Sonoma',
+    'Hemet': 'Riverside',
+    'Hercules': 'Contra Costa',
+    'Hermosa Beach': 'Los Angeles',
+    'Hesperia': 'San Bernardino',
+    'Hidden Hills': 'Los Angeles',
+    'Highland': 'San Bernardino',
+    'Hillsborough': 'San Mateo',
+    'Hollister': 'San Benito',
+    'Holtville': 'Imperial',
+    'Hughson': 'Stanislaus',
+    'Huntington Beach': 'Orange',
+    'Huntington Park': 'Los Angeles',
+    'Huron': 'Fresno',
+    'Imperial': 'Imperial',
+    'Imperial Beach': 'San Diego',
+    'Indian Wells': 'Riverside',
+    'Indio': 'Riverside',
+    'Industry': 'Los Angeles',
+    'Inglewood': 'Los Angeles',
+    'Ione': 'Amador',
+    'Irvine': 'Orange',
+    'Irwindale': 'Los Angeles',
+    'Isleton': 'Sacramento',
+    'Jackson': 'Amador',
+    'Jurupa Valley': 'Riverside',
+    'Kerman': 'Fresno',
+    'King City': 'Monterey',
+    'Kingsburg': 'Fresno',
+    'La Cañada Flintridge': 'Los Angeles',
+    'La Habra': 'Orange',
+    'La Habra Heights': 'Los Angeles',
+    'La Mesa': 'San Diego',
+    'La Mirada': 'Los Angeles',
+    'La Palma': 'Orange',
+    'La Puente': 'Los Angeles',
+    'La Quinta': 'Riverside',
+    'La Verne': 'Los Angeles',
+    'Lafayette': 'Contra Costa',
+    'Laguna Beach': 'Orange',
+    'Laguna Hills': 'Orange',
+    'Laguna Niguel': 'Orange',
+    'Laguna Woods': 'Orange',
+    'Lake Elsinore': 'Riverside',
+    'Lake Forest': 'Orange',
+    'Lakeport': 'Lake',
+    'Lakewood': 'Los Angeles',
+    'Lancaster': 'Los Angeles',
+    'Larkspur': 'Marin',
+    'Lathrop': 'San Joaquin',
+    'Lawndale': 'Los Angeles',
+    'Lemon Grove': 'San Diego',
+    'Lemoore': 'Kings',
+    'Lincoln': 'Placer',
+    'Lindsay': 'Tulare',
+    'Live Oak': 'Sutter',
+    'Livermore': 'Alameda',
+    'Livingston': 'Merced',
+    'Lodi': 'San Joaquin',
+    'Loma Linda': 'San Bernardino',
+    'Lomita': 'Los Angeles',
+    'Lompoc': 'Santa Barbara',
+    'Long Beach': 'Los Angeles',
+    'Loomis': 'Placer',
+    'Los Alamitos': 'Orange',
+    'Los Altos': 'Santa Clara',
+    'Los Altos Hills': 'Santa Clara',
+    'Los Angeles': 'Los Angeles',
+    'Los Banos': 'Merced',
+    'Los Gatos': 'Santa Clara',
+    'Loyalton': 'Sierra',
+    'Lynwood': 'Los Angeles',
+    'Madera': 'Madera',
+    'Malibu': 'Los Angeles',
+    'Mammoth Lakes': 'Mono',
+    'Manhattan Beach': 'Los Angeles',
+    'Manteca': 'San Joaquin',
+    'Maricopa': 'Kern',
+    'Marina': 'Monterey',
+    'Martinez': 'Contra Costa',
+    'Marysville': 'Yuba',
+    'Maywood': 'Los Angeles',
+    'McFarland': 'Kern',
+    'Mendota': 'Fresno',
+    'Menifee': 'Riverside',
+    'Menlo Park': 'San Mateo',
+    'Merced': 'Merced',
+    'Mill Valley': 'Marin',
+    'Millbrae': 'San Mateo',
+    'Milpitas': 'Santa Clara',
+    'Mission Viejo': 'Orange',
+    'Modesto': 'Stanislaus',
+    'Monrovia': 'Los Angeles',
+    'Montague': 'Siskiyou',
+    'Montclair': 'San Bernardino',
+    'Monte Sereno': 'Santa Clara',
+    'Montebello': 'Los Angeles',
+    'Monterey': 'Monterey',
+    'Monterey Park': 'Los Angeles',
+    'Moorpark': 'Ventura',
+    'Moraga': 'Contra Costa',
+    'Moreno Valley': 'Riverside',
+    'Morgan Hill': 'Santa Clara',
+    'Morro Bay': 'San Luis Obispo',
+    'Mount Shasta': 'Siskiyou',
+    'Mountain View': 'Santa Clara',
+    'Murrieta': 'Riverside',
+    'Napa': 'Napa',
+    'National City': 'San Diego',
+    'Needles': 'San Bernardino',
+    'Nevada City': 'Nevada',
+    'Newark': 'Alameda',
+    'Newman': 'Stanislaus',
+    'Newport Beach': 'Orange',
+    'Norco': 'Riverside',
+    'Norwalk': 'Los Angeles',
+    'Novato': 'Marin',
+    'Oakdale': 'Stanislaus',
+    'Oakland': 'Alameda',
+    'Oakley': 'Contra Costa',
+    'Oceanside': 'San Diego',
+    'Ojai': 'Ventura',
+    'Ontario': 'San Bernardino',
+    'Orange': 'Orange',
+    'Orange Cove': 'Fresno',
+    'Orinda': 'Contra Costa',
+    'Orland': 'Glenn',
+    'Oroville': 'Butte',
+    'Oxnard': 'Ventura',
+    'Pacific Grove': 'Monterey',
+    'Pacifica': 'San Mateo',
+    'Palm Desert': 'Riverside',
+    'Palm Springs': 'Riverside',
+    'Palmdale': 'Los Angeles',
+    'Palo Alto': 'Santa Clara',
+    'Palos Verdes Estates': 'Los Angeles',
+    'Paradise': 'Butte',
+    'Paramount': 'Los Angeles',
+    'Parlier': 'Fresno',
+    'Pasadena': 'Los Angeles',
+    'Paso Robles': 'San Luis Obispo',
+    'Patterson': 'Stanislaus',
+    'Perris': 'Riverside',
+    'Petaluma': 'Sonoma',
+    'Pico Rivera': 'Los Angeles',
+    'Piedmont': 'Alameda',
+    'Pinole': 'Contra Costa',
+    'Pismo Beach': 'San Luis Obispo',
+    'Pittsburg': 'Contra Costa',
+    'Placentia': 'Orange',
+    'Placerville': 'El Dorado',
+    'Pleasant Hill': 'Contra Costa',
+    'Pleasanton': 'Alameda',
+    'Plymouth': 'Amador',
+    'Point Arena': 'Mendocino',
+    'Pomona': 'Los Angeles',
+    'Port Hueneme': 'Ventura',
+    'Porterville': 'Tulare',
+    'Portola': 'Plumas',
+    'Portola Valley': 'San Mateo',
+    'Poway': 'San Diego',
+    'Rancho Cordova': 'Sacramento',
+    'Rancho Cucamonga': 'San Bernardino',
+    'Rancho Mirage': 'Riverside',
+    'Rancho Palos Verdes': 'Los Angeles',
+    'Rancho Santa Margarita': 'Orange',
+    'Red Bluff': 'Tehama',
+    'Redding': 'Shasta',
+    'Redlands': 'San Bernardino',
+    'Redondo Beach': 'Los Angeles',
+    'Redwood City': 'San Mateo',
+    'Reedley': 'Fresno',
+    'Rialto': 'San Bernardino',
+    'Richmond': 'Contra Costa',
+    'Ridgecrest': 'Kern',
+    'Rio Dell': 'Humboldt',
+    'Rio Vista': 'Solano',
+    'Ripon': 'San Joaquin',
+    'Riverbank': 'Stanislaus',
+    'Riverside': 'Riverside',
+    'Rocklin': 'Placer',
+    'Rohnert Park': 'Sonoma',
+    'Rolling Hills': 'Los Angeles',
+    'Rolling Hills Estates': 'Los Angeles',
+    'Rosemead': 'Los Angeles',
+    'Roseville': 'Placer',
+    'Ross': 'Marin',
+    'Sacramento': 'Sacramento',
+    'Salinas': 'Monterey',
+    'San Anselmo': 'Marin',
+    'San Bernardino': 'San Bernardino',
+    'San Bruno': 'San Mateo',
+    'San Carlos': 'San Mateo',
+    'San Clemente': 'Orange',
+    'San Diego': 'San Diego',
+    'San Dimas': 'Los Angeles',
+    'San Fernando': 'Los Angeles',
+    'San Francisco': 'San Francisco',
+    'San Gabriel': 'Los Angeles',
+    'San Jacinto': 'Riverside',
+    'San Joaquin': 'Fresno',
+    'San Jose': 'Santa Clara',
+    'San Juan Bautista': 'San Benito',
+    'San Juan Capistrano': 'Orange',
+    'San Leandro': 'Alameda',
+    'San Luis Obispo': 'San Luis Obispo',
+    'San Marcos': 'San Diego',
+    'San Marino': 'Los Angeles',
+    'San Mateo': 'San Mateo',
+    'San Pablo': 'Contra Costa',
+    'San Rafael': 'Marin',
+    'San Ramon': 'Contra Costa',
+    'Sand City': 'Monterey',
+    'Sanger': 'Fresno',
+    'Santa Ana': 'Orange',
+    'Santa Barbara': 'Santa Barbara',
+    'Santa Clara': 'Santa Clara',
+    'Santa Clarita': 'Los Angeles',
+    'Santa Cruz': 'Santa Cruz',
+    'Santa Fe Springs': 'Los Angeles',
+    'Santa Maria': 'Santa Barbara',
+    'Santa Monica': 'Los Angeles',
+    'Santa Paula': 'Ventura',
+    'Santa Rosa': 'Sonoma',
+    'Santee': 'San Diego',
+    'Saratoga': 'Santa Clara',
+    'Sausalito': 'Marin',
+    'Scotts Valley': 'Santa Cruz',
+    'Seal Beach': 'Orange',
+    'Seaside': 'Monterey',
+    'Sebastopol': 'Sonoma',
+    'Selma': 'Fresno',
+    'Shafter': 'Kern',
+    'Shasta Lake': 'Shasta',
+    'Sierra Madre': 'Los Angeles',
+    'Signal Hill': 'Los Angeles',
+    'Simi Valley': 'Ventura',
+    'Solana Beach': 'San Diego',
+    'Soledad': 'Monterey',
+    'Solvang': 'Santa Barbara',
+    'Sonoma': 'Sonoma',
+    'Sonora': 'Tuolumne',
+    'South El Monte': 'Los Angeles',
+    'South Gate': 'Los Angeles',
+    'South Lake Tahoe': 'El Dorado',
+    'South Pasadena': 'Los Angeles',
+    'South San Francisco': 'San Mateo',
+    'St. Helena': 'Napa',
+    'Stanton': 'Orange',
+    'Stockton': 'San Joaquin',
+    'Suisun City': 'Solano',
+    'Sunnyvale': 'Santa Clara',
+    'Susanville': 'Lassen',
+    'Sutter Creek': 'Amador',
+    'Taft': 'Kern',
+    'Tehachapi': 'Kern',
+    'Tehama': 'Tehama',
+    'Temecula': 'Riverside',
+    'Temple City': 'Los Angeles',
+    'Thousand Oaks': 'Ventura',
+    'Tiburon': 'Marin',
+    'Torrance': 'Los Angeles',
+    'Tracy': 'San Joaquin',
+    'Trinidad': 'Humboldt',
+    'Truckee': 'Nevada',
+    'Tulare': 'Tulare',
+    'Tulelake': 'Siskiyou',
+    'Turlock': 'Stanislaus',
+    'Tustin': 'Orange',
+    'Twentynine Palms': 'San Bernardino',
+    'Ukiah': 'Mendocino',
+    'Union City': 'Alameda',
+    'Upland': 'San Bernardino',
+    'Vacaville': 'Solano',
+    'Vallejo': 'Solano',
+    'Ventura': 'Ventura',
+    'Vernon': 'Los Angeles',
+    'Victorville': 'San Bernardino',
+    'Villa Park': 'Orange',
+    'Visalia': 'Tulare',
+    'Vista': 'San Diego',
+    'Walnut': 'Los Angeles',
+    'Walnut Creek': 'Contra Costa',
+    'Wasco': 'Kern',
+    'Waterford': 'Stanislaus',
+    'Watsonville': 'Santa Cruz',
+    'Weed': 'Siskiyou',
+    'West Covina': 'Los Angeles',
+    'West Hollywood': 'Los Angeles',
+    'West Sacramento': 'Yolo',
+    'Westlake Village': 'Los Angeles',
+    'Westminster': 'Orange',
+    'Westmorland': 'Imperial',
+    'Wheatland': 'Yuba',
+    'Whittier': 'Los Angeles',
+    'Wildomar': 'Riverside',
+    'Williams': 'Colusa',
+    'Willits': 'Mendocino',
+    'Willows': 'Glenn',
+    'Windsor': 'Sonoma',
+    'Winters': 'Yolo',
+    'Woodlake': 'Tulare',
+    'Woodland': 'Yolo',
+    'Woodside': 'San Mateo',
+    'Yorba Linda': 'Orange',
+    'Yountville': 'Napa',
+    'Yreka': 'Siskiyou',
+    'Yuba City': 'Sutter',
+    'Yucaipa': 'San Bernardino',
+    'Yucca Valley': 'San Bernardino',
+}, default='Los Angeles', key=str.title)
 
 
 def CAcity(col):
-    dic = {
-        'Adelanto': 'San Bernardino',
-        'Agoura Hills': 'Los Angeles',
-        'Alameda': 'Alameda',
-        'Albany': 'Alameda',
-        'Alhambra': 'Los Angeles',
-        'Aliso Viejo': 'Orange',
-        'Alturas': 'Modoc',
-        'Amador City': 'Amador',
-        'American Canyon': 'Napa',
-        'Anaheim': 'Orange',
-        'Anderson': 'Shasta',
-        'Angels': 'Calaveras',
-        'Antioch': 'Contra Costa',
-        'Apple Valley': 'San Bernardino',
-        'Arcadia': 'Los Angeles',
-        'Arcata': 'Humboldt',
-        'Arroyo Grande': 'San Luis Obispo',
-        'Artesia': 'Los Angeles',
-        'Arvin': 'Kern',
-        'Atascadero': 'San Luis Obispo',
-        'Atherton': 'San Mateo',
-        'Atwater': 'Merced',
-        'Auburn': 'Placer',
-        'Avalon': 'Los Angeles',
-        'Avenal': 'Kings',
-        'Azusa': 'Los Angeles',
-        'Bakersfield': 'Kern',
-        'Baldwin Park': 'Los Angeles',
-        'Banning': 'Riverside',
-        'Barstow': 'San Bernardino',
-        'Beaumont': 'Riverside',
-        'Bell': 'Los Angeles',
-        'Bell Gardens': 'Los Angeles',
-        'Bellflower': 'Los Angeles',
-        'Belmont': 'San Mateo',
-        'Belvedere': 'Marin',
-        'Benicia': 'Solano',
-        'Berkeley': 'Alameda',
-        'Beverly Hills': 'Los Angeles',
-        'Big Bear Lake': 'San Bernardino',
-        'Biggs': 'Butte',
-        'Bishop': 'Inyo',
-        'Blue Lake': 'Humboldt',
-        'Blythe': 'Riverside',
-        'Bradbury': 'Los Angeles',
-        'Brawley': 'Imperial',
-        'Brea': 'Orange',
-        'Brentwood': 'Contra Costa',
-        'Brisbane': 'San Mateo',
-        'Buellton': 'Santa Barbara',
-        'Buena Park': 'Orange',
-        'Burbank': 'Los Angeles',
-        'Burlingame': 'San Mateo',
-        'Calabasas': 'Los Angeles',
-        'Calexico': 'Imperial',
-        'California': 'Kern',
-        'Calimesa': 'Riverside',
-        'Calipatria': 'Imperial',
-        'Calistoga': 'Napa',
-        'Camarillo': 'Ventura',
-        'Campbell': 'Santa Clara',
-        'Canyon Lake': 'Riverside',
-        'Capitola': 'Santa Cruz',
-        'Carlsbad': 'San Diego',
-        'Carmel-by-the-Sea': 'Monterey',
-        'Carpinteria': 'Santa Barbara',
-        'Carson': 'Los Angeles',
-        'Cathedral City': 'Riverside',
-        'Ceres': 'Stanislaus',
-        'Cerritos': 'Los Angeles',
-        'Chico': 'Butte',
-        'Chino': 'San Bernardino',
-        'Chino Hills': 'San Bernardino',
-        'Chowchilla': 'Madera',
-        'Chula Vista': 'San Diego',
-        'Citrus Heights': 'Sacramento',
-        'Claremont': 'Los Angeles',
-        'Clayton': 'Contra Costa',
-        'Clearlake': 'Lake',
-        'Cloverdale': 'Sonoma',
-        'Clovis': 'Fresno',
-        'Coachella': 'Riverside',
-        'Coalinga': 'Fresno',
-        'Colfax': 'Placer',
-        'Colma': 'San Mateo',
-        'Colton': 'San Bernardino',
-        'Colusa': 'Colusa',
-        'Commerce': 'Los Angeles',
-        'Compton': 'Los Angeles',
-        'Concord': 'Contra Costa',
-        'Corcoran': 'Kings',
-        'Corning': 'Tehama',
-        'Corona': 'Riverside',
-        'Coronado': 'San Diego',
-        'Corte Madera': 'Marin',
-        'Costa Mesa': 'Orange',
-        'Cotati': 'Sonoma',
-        'Covina': 'Los Angeles',
-        'Crescent City': 'Del Norte',
-        'Cudahy': 'Los Angeles',
-        'Culver City': 'Los Angeles',
-        'Cupertino': 'Santa Clara',
-        'Cypress': 'Orange',
-        'Daly City': 'San Mateo',
-        'Dana Point': 'Orange',
-        'Danville': 'Contra Costa',
-        'Davis': 'Yolo',
-        'Del Mar': 'San Diego',
-        'Del Rey Oaks': 'Monterey',
-        'Delano': 'Kern',
-        'Desert Hot Springs': 'Riverside',
-        'Diamond Bar': 'Los Angeles',
-        'Dinuba': 'Tulare',
-        'Dixon': 'Solano',
-        'Dorris': 'Siskiyou',
-        'Dos Palos': 'Merced',
-        'Downey': 'Los Angeles',
-        'Duarte': 'Los Angeles',
-        'Dublin': 'Alameda',
-        'Dunsmuir': 'Siskiyou',
-        'East Palo Alto': 'San Mateo',
-        'Eastvale': 'Riverside',
-        'El Cajon': 'San Diego',
-        'El Centro': 'Imperial',
-        'El Cerrito': 'Contra Costa',
-        'El Monte': 'Los Angeles',
-        'El Segundo': 'Los Angeles',
-        'Elk Grove': 'Sacramento',
-        'Emeryville': 'Alameda',
-        'Encinitas': 'San Diego',
-        'Escalon': 'San Joaquin',
-        'Escondido': 'San Diego',
-        'Etna': 'Siskiyou',
-        'Eureka': 'Humboldt',
-        'Exeter': 'Tulare',
-        'Fairfax': 'Marin',
-        'Fairfield': 'Solano',
-        'Farmersville': 'Tulare',
-        'Ferndale': 'Humboldt',
-        'Fillmore': 'Ventura',
-        'Firebaugh': 'Fresno',
-        'Folsom': 'Sacramento',
-        'Fontana': 'San Bernardino',
-        'Fort Bragg': 'Mendocino',
-        'Fort Jones': 'Siskiyou',
-        'Fortuna': 'Humboldt',
-        'Foster City': 'San Mateo',
-        'Fountain Valley': 'Orange',
-        'Fowler': 'Fresno',
-        'Fremont': 'Alameda',
-        'Fresno': 'Fresno',
-        'Fullerton': 'Orange',
-        'Galt': 'Sacramento',
-        'Garden Grove': 'Orange',
-        'Gardena': 'Los Angeles',
-        'Gilroy': 'Santa Clara',
-        'Glendale': 'Los Angeles',
-        'Glendora': 'Los Angeles',
-        'Goleta': 'Santa Barbara',
-        'Gonzales': 'Monterey',
-        'Grand Terrace': 'San Bernardino',
-        'Grass Valley': 'Nevada',
-        'Greenfield': 'Monterey',
-        'Gridley': 'Butte',
-        'Grover Beach': 'San Luis Obispo',
-        'Guadalupe': 'Santa Barbara',
-        'Gustine': 'Merced',
-        'Half Moon Bay': 'San Mateo',
-        'Hanford': 'Kings',
-        'Hawaiian Gardens': 'Los Angeles',
-        'Hawthorne': 'Los Angeles',
-        'Hayward': 'Alameda',
-        'Healdsburg': 'Sonoma',
-        'Hemet': 'Riverside',
-        'Hercules': 'Contra Costa',
-        'Hermosa Beach': 'Los Angeles',
-        'Hesperia': 'San Bernardino',
-        'Hidden Hills': 'Los Angeles',
-        'Highland': 'San Bernardino',
-        'Hillsborough': 'San Mateo',
-        'Hollister': 'San Benito',
-        'Holtville': 'Imperial',
-        'Hughson': 'Stanislaus',
-        'Huntington Beach': 'Orange',
-        'Huntington Park': 'Los Angeles',
-        'Huron': 'Fresno',
-        'Imperial': 'Imperial',
-        'Imperial Beach': 'San Diego',
-        'Indian Wells': 'Riverside',
-        'Indio': 'Riverside',
-        'Industry': 'Los Angeles',
-        'Inglewood': 'Los Angeles',
-        'Ione': 'Amador',
-        'Irvine': 'Orange',
-        'Irwindale': 'Los Angeles',
-        'Isleton': 'Sacramento',
-        'Jackson': 'Amador',
-        'Jurupa Valley': 'Riverside',
-        'Kerman': 'Fresno',
-        'King City': 'Monterey',
-        'Kingsburg': 'Fresno',
-        'La Cañada Flintridge': 'Los Angeles',
-        'La Habra': 'Orange',
-        'La Habra Heights': 'Los Angeles',
-        'La Mesa': 'San Diego',
-        'La Mirada': 'Los Angeles',
-        'La Palma': 'Orange',
-        'La Puente': 'Los Angeles',
-        'La Quinta': 'Riverside',
-        'La Verne': 'Los Angeles',
-        'Lafayette': 'Contra Costa',
-        'Laguna Beach': 'Orange',
-        'Laguna Hills': 'Orange',
-        'Laguna Niguel': 'Orange',
-        'Laguna Woods': 'Orange',
-        'Lake Elsinore': 'Riverside',
-        'Lake Forest': 'Orange',
-        'Lakeport': 'Lake',
-        'Lakewood': 'Los Angeles',
-        'Lancaster': 'Los Angeles',
-        'Larkspur': 'Marin',
-        'Lathrop': 'San Joaquin',
-        'Lawndale': 'Los Angeles',
-        'Lemon Grove': 'San Diego',
-        'Lemoore': 'Kings',
-        'Lincoln': 'Placer',
-        'Lindsay': 'Tulare',
-        'Live Oak': 'Sutter',
-        'Livermore': 'Alameda',
-        'Livingston': 'Merced',
-        'Lodi': 'San Joaquin',
-        'Loma Linda': 'San Bernardino',
-        'Lomita': 'Los Angeles',
-        'Lompoc': 'Santa Barbara',
-        'Long Beach': 'Los Angeles',
-        'Loomis': 'Placer',
-        'Los Alamitos': 'Orange',
-        'Los Altos': 'Santa Clara',
-        'Los Altos Hills': 'Santa Clara',
-        'Los Angeles': 'Los Angeles',
-        'Los Banos': 'Merced',
-        'Los Gatos': 'Santa Clara',
-        'Loyalton': 'Sierra',
-        'Lynwood': 'Los Angeles',
-        'Madera': 'Madera',
-        'Malibu': 'Los Angeles',
-        'Mammoth Lakes': 'Mono',
-        'Manhattan Beach': 'Los Angeles',
-        'Manteca': 'San Joaquin',
-        'Maricopa': 'Kern',
-        'Marina': 'Monterey',
-        'Martinez': 'Contra Costa',
-        'Marysville': 'Yuba',
-        'Maywood': 'Los Angeles',
-        'McFarland': 'Kern',
-        'Mendota': 'Fresno',
-        'Menifee': 'Riverside',
-        'Menlo Park': 'San Mateo',
-        'Merced': 'Merced',
-        'Mill Valley': 'Marin',
-        'Millbrae': 'San Mateo',
-        'Milpitas': 'Santa Clara',
-        'Mission Viejo': 'Orange',
-        'Modesto': 'Stanislaus',
-        'Monrovia': 'Los Angeles',
-        'Montague': 'Siskiyou',
-        'Montclair': 'San Bernardino',
-        'Monte Sereno': 'Santa Clara',
-        'Montebello': 'Los Angeles',
-        'Monterey': 'Monterey',
-        'Monterey Park': 'Los Angeles',
-        'Moorpark': 'Ventura',
-        'Moraga': 'Contra Costa',
-        'Moreno Valley': 'Riverside',
-        'Morgan Hill': 'Santa Clara',
-        'Morro Bay': 'San Luis Obispo',
-        'Mount Shasta': 'Siskiyou',
-        'Mountain View': 'Santa Clara',
-        'Murrieta': 'Riverside',
-        'Napa': 'Napa',
-        'National City': 'San Diego',
-        'Needles': 'San Bernardino',
-        'Nevada City': 'Nevada',
-        'Newark': 'Alameda',
-        'Newman': 'Stanislaus',
-        'Newport Beach': 'Orange',
-        'Norco': 'Riverside',
-        'Norwalk': 'Los Angeles',
-        'Novato': 'Marin',
-        'Oakdale': 'Stanislaus',
-        'Oakland': 'Alameda',
-        'Oakley': 'Contra Costa',
-        'Oceanside': 'San Diego',
-        'Ojai': 'Ventura',
-        'Ontario': 'San Bernardino',
-        'Orange': 'Orange',
-        'Orange Cove': 'Fresno',
-        'Orinda': 'Contra Costa',
-        'Orland': 'Glenn',
-        'Oroville': 'Butte',
-        'Oxnard': 'Ventura',
-        'Pacific Grove': 'Monterey',
-        'Pacifica': 'San Mateo',
-        'Palm Desert': 'Riverside',
-        'Palm Springs': 'Riverside',
-        'Palmdale': 'Los Angeles',
-        'Palo Alto': 'Santa Clara',
-        'Palos Verdes Estates': 'Los Angeles',
-        'Paradise': 'Butte',
-        'Paramount': 'Los Angeles',
-        'Parlier': 'Fresno',
-        'Pasadena': 'Los Angeles',
-        'Paso Robles': 'San Luis Obispo',
-        'Patterson': 'Stanislaus',
-        'Perris': 'Riverside',
-        'Petaluma': 'Sonoma',
-        'Pico Rivera': 'Los Angeles',
-        'Piedmont': 'Alameda',
-        'Pinole': 'Contra Costa',
-        'Pismo Beach': 'San Luis Obispo',
-        'Pittsburg': 'Contra Costa',
-        'Placentia': 'Orange',
-        'Placerville': 'El Dorado',
-        'Pleasant Hill': 'Contra Costa',
-        'Pleasanton': 'Alameda',
-        'Plymouth': 'Amador',
-        'Point Arena': 'Mendocino',
-        'Pomona': 'Los Angeles',
-        'Port Hueneme': 'Ventura',
-        'Porterville': 'Tulare',
-        'Portola': 'Plumas',
-        'Portola Valley': 'San Mateo',
-        'Poway': 'San Diego',
-        'Rancho Cordova': 'Sacramento',
-        'Rancho Cucamonga': 'San Bernardino',
-        'Rancho Mirage': 'Riverside',
-        'Rancho Palos Verdes': 'Los Angeles',
-        'Rancho Santa Margarita': 'Orange',
-        'Red Bluff': 'Tehama',
-        'Redding': 'Shasta',
-        'Redlands': 'San Bernardino',
-        'Redondo Beach': 'Los Angeles',
-        'Redwood City': 'San Mateo',
-        'Reedley': 'Fresno',
-        'Rialto': 'San Bernardino',
-        'Richmond': 'Contra Costa',
-        'Ridgecrest': 'Kern',
-        'Rio Dell': 'Humboldt',
-        'Rio Vista': 'Solano',
-        'Ripon': 'San Joaquin',
-        'Riverbank': 'Stanislaus',
-        'Riverside': 'Riverside',
-        'Rocklin': 'Placer',
-        'Rohnert Park': 'Sonoma',
-        'Rolling Hills': 'Los Angeles',
-        'Rolling Hills Estates': 'Los Angeles',
-        'Rosemead': 'Los Angeles',
-        'Roseville': 'Placer',
-        'Ross': 'Marin',
-        'Sacramento': 'Sacramento',
-        'Salinas': 'Monterey',
-        'San Anselmo': 'Marin',
-        'San Bernardino': 'San Bernardino',
-        'San Bruno': 'San Mateo',
-        'San Carlos': 'San Mateo',
-        'San Clemente': 'Orange',
-        'San Diego': 'San Diego',
-        'San Dimas': 'Los Angeles',
-        'San Fernando': 'Los Angeles',
-        'San Francisco': 'San Francisco',
-        'San Gabriel': 'Los Angeles',
-        'San Jacinto': 'Riverside',
-        'San Joaquin': 'Fresno',
-        'San Jose': 'Santa Clara',
-        'San Juan Bautista': 'San Benito',
-        'San Juan Capistrano': 'Orange',
-        'San Leandro': 'Alameda',
-        'San Luis Obispo': 'San Luis Obispo',
-        'San Marcos': 'San Diego',
-        'San Marino': 'Los Angeles',
-        'San Mateo': 'San Mateo',
-        'San Pablo': 'Contra Costa',
-        'San Rafael': 'Marin',
-        'San Ramon': 'Contra Costa',
-        'Sand City': 'Monterey',
-        'Sanger': 'Fresno',
-        'Santa Ana': 'Orange',
-        'Santa Barbara': 'Santa Barbara',
-        'Santa Clara': 'Santa Clara',
-        'Santa Clarita': 'Los Angeles',
-        'Santa Cruz': 'Santa Cruz',
-        'Santa Fe Springs': 'Los Angeles',
-        'Santa Maria': 'Santa Barbara',
-        'Santa Monica': 'Los Angeles',
-        'Santa Paula': 'Ventura',
-        'Santa Rosa': 'Sonoma',
-        'Santee': 'San Diego',
-        'Saratoga': 'Santa Clara',
-        'Sausalito': 'Marin',
-        'Scotts Valley': 'Santa Cruz',
-        'Seal Beach': 'Orange',
-        'Seaside': 'Monterey',
-        'Sebastopol': 'Sonoma',
-        'Selma': 'Fresno',
-        'Shafter': 'Kern',
-        'Shasta Lake': 'Shasta',
-        'Sierra Madre': 'Los Angeles',
-        'Signal Hill': 'Los Angeles',
-        'Simi Valley': 'Ventura',
-        'Solana Beach': 'San Diego',
-        'Soledad': 'Monterey',
-        'Solvang': 'Santa Barbara',
-        'Sonoma': 'Sonoma',
-        'Sonora': 'Tuolumne',
-        'South El Monte': 'Los Angeles',
-        'South Gate': 'Los Angeles',
-        'South Lake Tahoe': 'El Dorado',
-        'South Pasadena': 'Los Angeles',
-        'South San Francisco': 'San Mateo',
-        'St. Helena': 'Napa',
-        'Stanton': 'Orange',
-        'Stockton': 'San Joaquin',
-        'Suisun City': 'Solano',
-        'Sunnyvale': 'Santa Clara',
-        'Susanville': 'Lassen',
-        'Sutter Creek': 'Amador',
-        'Taft': 'Kern',
-        'Tehachapi': 'Kern',
-        'Tehama': 'Tehama',
-        'Temecula': 'Riverside',
-        'Temple City': 'Los Angeles',
-        'Thousand Oaks': 'Ventura',
-        'Tiburon': 'Marin',
-        'Torrance': 'Los Angeles',
-        'Tracy': 'San Joaquin',
-        'Trinidad': 'Humboldt',
-        'Truckee': 'Nevada',
-        'Tulare': 'Tulare',
-        'Tulelake': 'Siskiyou',
-        'Turlock': 'Stanislaus',
-        'Tustin': 'Orange',
-        'Twentynine Palms': 'San Bernardino',
-        'Ukiah': 'Mendocino',
-        'Union City': 'Alameda',
-        'Upland': 'San Bernardino',
-        'Vacaville': 'Solano',
-        'Vallejo': 'Solano',
-        'Ventura': 'Ventura',
-        'Vernon': 'Los Angeles',
-        'Victorville': 'San Bernardino',
-        'Villa Park': 'Orange',
-        'Visalia': 'Tulare',
-        'Vista': 'San Diego',
-        'Walnut': 'Los Angeles',
-        'Walnut Creek': 'Contra Costa',
-        'Wasco': 'Kern',
-        'Waterford': 'Stanislaus',
-        'Watsonville': 'Santa Cruz',
-        'Weed': 'Siskiyou',
-        'West Covina': 'Los Angeles',
-        'West Hollywood': 'Los Angeles',
-        'West Sacramento': 'Yolo',
-        'Westlake Village': 'Los Angeles',
-        'Westminster': 'Orange',
-        'Westmorland': 'Imperial',
-        'Wheatland': 'Yuba',
-        'Whittier': 'Los Angeles',
-        'Wildomar': 'Riverside',
-        'Williams': 'Colusa',
-        'Willits': 'Mendocino',
-        'Willows': 'Glenn',
-        'Windsor': 'Sonoma',
-        'Winters': 'Yolo',
-        'Woodlake': 'Tulare',
-        'Woodland': 'Yolo',
-        'Woodside': 'San Mateo',
-        'Yorba Linda': 'Orange',
-        'Yountville': 'Napa',
-        'Yreka': 'Siskiyou',
-        'Yuba City': 'Sutter',
-        'Yucaipa': 'San Bernardino',
-        'Yucca Valley': 'San Bernardino',
-        }
-    col = col.apply(lambda x: dic.get(x.title(), 'Los Angeles'))
-    return CAcounty(col)
+    return CAcounty(city_counties(col))
@@ -0,0 +1,119 @@
+########################################################################
+# Schema registry for the Synthea CSV and CPCDS files the formatters read
+########################################################################
+import pandas as pd
+
+
+# The columns of one output file in file order (so a column's position is its index in the list) and the compact dtype
+# each column is decoded into: 'category' for repetitive values (classes, codes, demographics), float64 for costs and
+# amounts, and 'datetime' for timestamps, which are parsed as dates.  Any other column (free text, zip codes) is read as
+# a string.  keys names the key space (encounter, patient, ...) of each id column, which the reader replaces with shared
+# integer codes.  Files we only know by position (the CPCDS files) give the columns we use names by position, and the
+# reader reads them under those names, so every column is selected by name whatever the file's header calls it
+class FileSchema:
+    def __init__(self, path, columns=None, dtypes=None, keys=None, names=None):
+        self.path = path
+        self.columns = columns or []
+        self.dtypes = dtypes or {}
+        self.keys = keys or {}
+        self.names = names or {}
+
+    def position(self, name):
+        return self.columns.index(name)
+
+    # The dtype (or key space) for each column of header that the schema knows about, keyed by column name
+    def resolve(self, header, mapping=None):
+        return {name: value for name, value in (self.dtypes if mapping is None else mapping).items() if name in header}
+
+    # This schema for the file's actual header, with the columns named by position renamed, so that it can be applied by
+    # name to any selection of the file's columns.  Its columns are the names the reader reads the file with
+    def for_header(self, header):
+        header = [self.names.get(i, name) for i, name in enumerate(header)]
+        return FileSchema(self.path, header, self.resolve(header), self.resolve(header, self.keys))
+
+    # Arguments for read_csv that decode the selected columns straight into their compact types
+    def read_csv_args(self, header, columns=None):
+        resolved = {name: dtype for name, dtype in self.resolve(header).items() if columns is None or name in columns}
+        dtypes = {name: str for name in (header if columns is None else columns)}
+        dtypes.update({name: dtype for name, dtype in resolved.items() if dtype != 'datetime'})
+        parse_dates = [name for name, dtype in resolved.items() if dtype == 'datetime']
+        return {'dtype': dtypes, 'parse_dates': parse_dates or None}
+
+    # Put a chunk that came from somewhere other than read_csv (i.e. the cache) into the same types
+    def apply(self, chunk):
+        for name, dtype in self.resolve(list(chunk.columns)).items():
+            if dtype == 'datetime':
+                if not pd.api.types.is_datetime64_any_dtype(chunk[name]):
+                    chunk[name] = pd.to_datetime(chunk[name])
+            elif chunk[name].dtype != dtype:
+                chunk[name] = chunk[name].astype(dtype)
+        return chunk
+
+
+schemas = {schema.path: schema for schema in [
+    FileSchema('/csv/patients.csv',
+               columns=['Id', 'BIRTHDATE', 'DEATHDATE', 'SSN', 'DRIVERS', 'PASSPORT', 'PREFIX', 'FIRST', 'MIDDLE',
+                        'LAST', 'SUFFIX', 'MAIDEN', 'MARITAL', 'RACE', 'ETHNICITY', 'GENDER', 'BIRTHPLACE', 'ADDRESS',
+                        'CITY', 'STATE', 'COUNTY', 'FIPS', 'ZIP', 'LAT', 'LON', 'HEALTHCARE_EXPENSES',
+                        'HEALTHCARE_COVERAGE', 'INCOME'],
+               dtypes={'BIRTHDATE': 'datetime', 'DEATHDATE': 'datetime', 'PREFIX': 'category', 'SUFFIX': 'category',
+                       'MARITAL': 'category', 'RACE': 'category', 'ETHNICITY': 'category', 'GENDER': 'category',
+                       'CITY': 'category', 'STATE': 'category', 'COUNTY': 'category', 'LAT': 'float64',
+                       'LON': 'float64', 'HEALTHCARE_EXPENSES': 'float64', 'HEALTHCARE_COVERAGE': 'float64',
+                       'INCOME': 'float64'},
+               keys={'Id': 'patient'}),
+    FileSchema('/csv/encounters.csv',
+               columns=['Id', 'START', 'STOP', 'PATIENT', 'ORGANIZATION', 'PROVIDER', 'PAYER', 'ENCOUNTERCLASS',
+                        'CODE', 'DESCRIPTION', 'BASE_ENCOUNTER_COST', 'TOTAL_CLAIM_COST', 'PAYER_COVERAGE',
+                        'REASONCODE', 'REASONDESCRIPTION'],
+               dtypes={'START': 'datetime', 'STOP': 'datetime', 'ENCOUNTERCLASS': 'category', 'CODE': 'category',
+                       'DESCRIPTION': 'category', 'BASE_ENCOUNTER_COST': 'float64', 'TOTAL_CLAIM_COST': 'float64',
+                       'PAYER_COVERAGE': 'float64', 'REASONCODE': 'category', 'REASONDESCRIPTION': 'category'},
+               keys={'Id': 'encounter', 'PATIENT': 'patient', 'ORGANIZATION': 'organization', 'PROVIDER': 'provider',
+                     'PAYER': 'payer'}),
+    FileSchema('/csv/procedures.csv',
+               columns=['START', 'STOP', 'PATIENT', 'ENCOUNTER', 'CODE', 'DESCRIPTION', 'BASE_COST', 'REASONCODE',
+                        'REASONDESCRIPTION'],
+               dtypes={'START': 'datetime', 'STOP': 'datetime', 'CODE': 'category', 'DESCRIPTION': 'category',
+                       'BASE_COST': 'float64', 'REASONCODE': 'category', 'REASONDESCRIPTION': 'category'},
+               keys={'PATIENT': 'patient', 'ENCOUNTER': 'encounter'}),
+    FileSchema('/csv/organizations.csv',
+               columns=['Id', 'NAME', 'ADDRESS', 'CITY', 'STATE', 'ZIP', 'LAT', 'LON', 'PHONE', 'REVENUE',
+                        'UTILIZATION'],
+               dtypes={'STATE': 'category', 'LAT': 'float64', 'LON': 'float64', 'REVENUE': 'float64',
+                       'UTILIZATION': 'float64'},
+               keys={'Id': 'organization'}),
+    FileSchema('/csv/payers.csv',
+               columns=['Id', 'NAME', 'OWNERSHIP', 'ADDRESS', 'CITY', 'STATE_HEADQUARTERED', 'ZIP', 'PHONE',
+                        'AMOUNT_COVERED', 'AMOUNT_UNCOVERED', 'REVENUE', 'COVERED_ENCOUNTERS', 'UNCOVERED_ENCOUNTERS',
+                        'COVERED_MEDICATIONS', 'UNCOVERED_MEDICATIONS', 'COVERED_PROCEDURES', 'UNCOVERED_PROCEDURES',
+                        'COVERED_IMMUNIZATIONS', 'UNCOVERED_IMMUNIZATIONS', 'UNIQUE_CUSTOMERS', 'QOLS_AVG',
+                        'MEMBER_MONTHS'],
+               dtypes={'OWNERSHIP': 'category', 'STATE_HEADQUARTERED': 'category', 'AMOUNT_COVERED': 'float64',
+                       'AMOUNT_UNCOVERED': 'float64', 'REVENUE': 'float64', 'COVERED_ENCOUNTERS': 'float64',
+                       'UNCOVERED_ENCOUNTERS': 'float64', 'COVERED_MEDICATIONS': 'float64',
+                       'UNCOVERED_MEDICATIONS': 'float64', 'COVERED_PROCEDURES': 'float64',
+                       'UNCOVERED_PROCEDURES': 'float64', 'COVERED_IMMUNIZATIONS': 'float64',
+                       'UNCOVERED_IMMUNIZATIONS': 'float64', 'UNIQUE_CUSTOMERS': 'float64', 'QOLS_AVG': 'float64',
+                       'MEMBER_MONTHS': 'float64'},
+               keys={'Id': 'payer'}),
+    FileSchema('/csv/observations.csv',
+               columns=['DATE', 'PATIENT', 'ENCOUNTER', 'CATEGORY', 'CODE', 'DESCRIPTION', 'VALUE', 'UNITS', 'TYPE'],
+               dtypes={'DATE': 'datetime', 'CATEGORY': 'category', 'CODE': 'category', 'DESCRIPTION': 'category',
+                       'UNITS': 'category', 'TYPE': 'category'},
+               keys={'PATIENT': 'patient', 'ENCOUNTER': 'encounter'}),
+    # The claim's patient (account number), encounter and coverage, and the claim line diagnosis code and its present on
+    # admission flag
+    FileSchema('/cpcds/CPCDS_Claims.csv',
+               names={6: 'PATIENT', 8: 'ENCOUNTER', 21: 'COVERAGE', 88: 'DIAGNOSIS_CODE', 90: 'DIAGNOSIS_POA'},
+               dtypes={'DIAGNOSIS_CODE': 'category', 'DIAGNOSIS_POA': 'category'},
+               keys={'PATIENT': 'patient', 'ENCOUNTER': 'encounter', 'COVERAGE': 'coverage'}),
+    # The coverage and its type
+    FileSchema('/cpcds/CPCDS_Coverages.csv', names={0: 'Id', 4: 'TYPE'}, dtypes={'TYPE': 'category'},
+               keys={'Id': 'coverage'}),
+]}
+
+
+# Schema for a file in the output folder (an empty one, i.e. everything read as strings, for files we know nothing of)
+def schema_for(path):
+    return schemas.get(path, FileSchema(path))
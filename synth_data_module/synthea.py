@@ -1,78 +1,399 @@
+import glob
+import hashlib
+import math
+import os
+import re
+import shutil
 import subprocess
+import threading
 import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from synth_data_module.logging_helpers import ProgressTimer
+from synth_data_module.schemas import schema_for, schemas
 
+# pyarrow provides the Feather files used by the columnar cache.  Without it we simply read the CSVs every time
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
 
-class SyntheaOutput:
+
+# Dense integer codes for one key space (e.g. every encounter id), shared by all of the tables holding those keys so they
+# are joined and grouped on ints instead of 36 character UUID strings.  Codes are handed out in first-seen order and
+# missing keys get -1
+class KeyDictionary:
     def __init__(self):
-        self.output_loc = "output/"
+        self.keys = pd.Index([], dtype=object)
+        self.key_array = np.array([np.nan], dtype=object)
+
+    def encode(self, values):
+        codes = self.keys.get_indexer(values)
+        # Keys not in the dictionary yet are numbered on from its end, in the order the chunk first has them
+        unseen = (codes == -1) & np.asarray(pd.notna(values))
+        if unseen.any():
+            new_codes, new_keys = pd.factorize(values[unseen])
+            codes[unseen] = new_codes + len(self.keys)
+            self.keys = self.keys.append(pd.Index(new_keys, dtype=object))
+        return codes
+
+    def decode(self, codes):
+        if len(self.key_array) != len(self.keys) + 1:
+            self.key_array = np.append(self.keys.to_numpy(dtype=object), np.nan)
+        # Codes that went through a left merge may have become floats with NaN for missing rows
+        codes = pd.Series(codes).fillna(-1).to_numpy(dtype=np.int64)
+        return self.key_array[codes]
+
+
+# The partition files one input is split into, appended to through a few open files at a time (the most recently used),
+# so a small memory budget's many partitions do not run into the limit on open files.  The rows of most inputs are
+# grouped by patient, so they mostly go to the partition written last
+class PartitionFiles:
+    def __init__(self, paths, max_open):
+        self.paths = paths
+        self.max_open = max_open
+        self.open_files = OrderedDict()
+
+    def __getitem__(self, i):
+        if i in self.open_files:
+            self.open_files.move_to_end(i)
+        else:
+            if len(self.open_files) >= self.max_open:
+                self.open_files.popitem(last=False)[1].close()
+            self.open_files[i] = open(self.paths[i], 'a')
+        return self.open_files[i]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for open_file in self.open_files.values():
+            open_file.close()
+        self.open_files.clear()
+
+
+class SyntheaOutput:
+    # Roughly how many bytes of memory formatting takes per byte of per-patient CSV input (about 2 on test runs, plus
+    # some headroom), used to size the partitions for a memory budget (see partition_count)
+    memory_per_input_byte = 3
+    # The most partition files partition_by_patient holds open at once, well within the usual file descriptor limits
+    max_open_partition_files = 64
+
+    # The file behind each table reader (patients_df reads patients, ...)
+    tables = {'patients': '/csv/patients.csv',
+              'encounters': '/csv/encounters.csv',
+              'procedures': '/csv/procedures.csv',
+              'diagnosis': '/cpcds/CPCDS_Claims.csv',
+              'coverages': '/cpcds/CPCDS_Coverages.csv',
+              'organizations': '/csv/organizations.csv',
+              'payers': '/csv/payers.csv',
+              'observations': '/csv/observations.csv'}
+
+    # shared_loc, if given, is where files missing from output_loc are read from instead (i.e. the reference tables of
+    # a patient partition, see partition_by_patient)
+    def __init__(self, use_cache=True, output_loc='output/', shared_loc=None, chunk_size=100000):
+        self.output_loc = output_loc
+        self.shared_loc = shared_loc
+        self.chunk_size = chunk_size
+        # Columnar copies of the CSVs we have already parsed, so repeat (e.g. --FormatOnly) runs skip the CSV parsing
+        self.cache_loc = f'{self.output_loc}cache/'
+        self.use_cache = use_cache and pyarrow is not None
+        # One dictionary per key space, shared by every table read through this object
+        self.key_dictionaries = defaultdict(KeyDictionary)
+        self.partitions_loc = f'{self.output_loc}partitions/'
+        # Reads started by prefetch, keyed by file, subfields and where (see prefetch_key), until the reader is called for
+        # them
+        self.prefetched = {}
+
+    # The original ids for a column of codes from the given key space (e.g. for hashing or writing out)
+    def decode_keys(self, key_space, codes):
+        return pd.Series(self.key_dictionaries[key_space].decode(codes), index=codes.index, name=codes.name)
 
+    def encode_keys(self, chunk, schema):
+        keys = schema.resolve(list(chunk.columns), schema.keys)
+        return chunk.assign(**{name: self.key_dictionaries[space].encode(chunk[name]) for name, space in keys.items()})
+
+    # Concatenate chunks read with the same schema.  Each chunk has its own categories, so categorical columns are
+    # combined with the union of them (rather than falling back to object) and unused categories are dropped
     @staticmethod
-    def optimize_types(df):
-        """Optimize the data types of the DataFrame to reduce memory usage."""
-        for col in df.select_dtypes(include=['int']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='unsigned')
-        for col in df.select_dtypes(include=['float']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='float')
-        # for col in df.select_dtypes(include=['object']).columns:
-        #     num_unique_values = len(df[col].unique())
-        #     num_total_values = len(df[col])
-        #     if num_unique_values / num_total_values < 0.5:
-        #         # Replace null values with a placeholder
-        #         df[col] = df[col].fillna('Unknown')
-        #         unique_values = df[col].unique()
-        #         df[col] = pd.Categorical(df[col], categories=unique_values, ordered=False)
+    def concat_chunks(chunks):
+        if len(chunks) == 1:
+            df = chunks[0].reset_index(drop=True)
+        else:
+            categorical = [col for col in chunks[0].columns if isinstance(chunks[0][col].dtype, pd.CategoricalDtype)]
+            combined = {col: union_categoricals([chunk[col] for chunk in chunks]) for col in categorical}
+            df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+            for col in categorical:
+                df[col] = combined[col]
+            df = df[chunks[0].columns]
+        for col in df.select_dtypes(include=['category']).columns:
+            df[col] = df[col].cat.remove_unused_categories()
         return df
 
-    def chunk_csv_reader(self, path, parse_dates=None, subfields=None):
-        # Initialize an empty DataFrame for procedures
-        chunk_size = 100000
-        path = f'{self.output_loc}{path}'
+    def cache_file(self, path, columns):
+        # Cache entries are keyed by the source file's size and mtime (so regenerated output is never served stale) and
+        # by the set of columns that were read
+        stat = os.stat(path)
+        if columns is None:
+            column_key = 'all'
+        else:
+            column_key = hashlib.md5('|'.join(columns).encode()).hexdigest()[:12]
+        name = os.path.basename(path).split('.')[0]
+        return f'{self.cache_loc}{name}.{stat.st_size}.{stat.st_mtime_ns}.{column_key}.feather'
+
+    def read_cache(self, path, columns, schema, where=None, encode=True):
+        # Use an entry for exactly these columns if we have one, otherwise project them out of a full-file entry.  The
+        # entry holds one record batch per CSV chunk, so we filter batch by batch just like a CSV read
+        for cache_file in [self.cache_file(path, columns), self.cache_file(path, None)]:
+            if os.path.exists(cache_file):
+                reader = pyarrow.ipc.open_file(pyarrow.memory_map(cache_file))
+                # Entries written before the file's columns had their schema names are not used
+                if not set(columns if columns is not None else schema.columns) <= set(reader.schema.names):
+                    continue
+                all_chunks = []
+                for i in range(reader.num_record_batches):
+                    table = pyarrow.Table.from_batches([reader.get_batch(i)])
+                    chunk = (table.select(columns) if columns is not None else table).to_pandas()
+                    # Arrow hands back missing strings as None, put them back to NaN like read_csv gives us
+                    for col in chunk.select_dtypes(include=['object']).columns:
+                        chunk[col] = chunk[col].where(chunk[col].notna(), np.nan)
+                    all_chunks.append(self.filter_chunk(schema.apply(chunk), schema, where, encode))
+                return self.concat_chunks(all_chunks)
+        return None
+
+    def open_cache_writer(self, path, columns, chunk):
+        os.makedirs(self.cache_loc, exist_ok=True)
+        cache_file = self.cache_file(path, columns)
+        # Clear out entries for older versions of this file before adding the new one
+        name, size, mtime = os.path.basename(cache_file).split('.')[:3]
+        for old_file in glob.glob(f'{self.cache_loc}{name}.*.feather'):
+            if os.path.basename(old_file).split('.')[1:3] != [size, mtime]:
+                os.remove(old_file)
+        # Any column that is empty in the first chunk is a string.  Categorical columns are stored as plain strings, since
+        # every chunk has its own categories (they are made categorical again as the entry is read)
+        schema = pyarrow.Schema.from_pandas(chunk, preserve_index=False)
+        for i, field in enumerate(schema):
+            if field.type == pyarrow.null() or pyarrow.types.is_dictionary(field.type):
+                schema = schema.set(i, field.with_type(pyarrow.string()))
+        # Written under a temporary name so an interrupted read never leaves a partial entry behind
+        return pyarrow.ipc.new_file(f'{cache_file}.tmp', schema), cache_file, schema
+
+    # Keep the rows where selects and swap the id columns for their key codes (unless encode=False)
+    def filter_chunk(self, chunk, schema, where=None, encode=True):
+        if where is not None:
+            chunk = chunk[where(chunk)]
+        return self.encode_keys(chunk, schema) if encode else chunk
+
+    # subfields selects columns (by their names in the schema registry, see schemas.py) and where is a function returning
+    # a boolean mask for the rows to keep.  Both are applied chunk by chunk, so only the rows and columns we want are
+    # ever held in memory.  Columns are decoded into the types given by the file's entry in the schema registry
+    def chunk_csv_reader(self, path, subfields=None, where=None):
+        prefetched = self.prefetched.pop(self.prefetch_key(path, subfields, where), None)
+        if prefetched is not None:
+            df, schema = prefetched.result()
+            return self.encode_keys(df, schema)
+        return self.read_table(path, subfields, where)[0]
+
+    # A prefetched table is only handed over to a read of the same columns and rows, so the where filter is part of the
+    # key.  Filters are compared as objects, so the reads have to pass the same function (or an equal filter object,
+    # like HCAIBase's EncounterFilter)
+    @staticmethod
+    def prefetch_key(path, subfields, where):
+        return path, None if subfields is None else tuple(subfields), where
+
+    # The table and the schema it was read with.  With encode=False the id columns are left as they are in the file
+    def read_table(self, path, subfields=None, where=None, encode=True):
+        file_path = f'{self.output_loc}{path}'
+        if self.shared_loc is not None and not os.path.exists(file_path):
+            file_path = f'{self.shared_loc}{path}'
+        # Work out the names of the columns we are after (read_csv returns usecols in file order).  The file is read
+        # with the schema's names for its columns (see FileSchema.for_header)
+        schema = schema_for(path).for_header(list(pd.read_csv(file_path, nrows=0).columns))
+        header = schema.columns
+        path = file_path
+        columns = None
+        if subfields is not None:
+            columns = [col for i, col in enumerate(header) if i in subfields or col in subfields]
+
+        if self.use_cache:
+            df = self.read_cache(path, columns, schema, where, encode)
+            if df is not None:
+                return df, schema
+
+        # The cache gets every chunk before it is filtered, so it can serve later reads with different filters
         all_chunks = []
-        for chunk in pd.read_csv(path, dtype=str, parse_dates=parse_dates, header=0, usecols=subfields,
-                                 chunksize=chunk_size):
-            chunk = self.optimize_types(chunk)
-            all_chunks.append(chunk)
+        cache_writer, cache_file, cache_schema = None, None, None
+        for chunk in pd.read_csv(path, header=0, names=header, usecols=columns, chunksize=self.chunk_size,
+                                 **schema.read_csv_args(header, columns)):
+            if self.use_cache:
+                try:
+                    if cache_writer is None:
+                        cache_writer, cache_file, cache_schema = self.open_cache_writer(path, columns, chunk)
+                    cache_writer.write_batch(pyarrow.RecordBatch.from_pandas(chunk, schema=cache_schema,
+                                                                             preserve_index=False))
+                except pyarrow.ArrowException as e:
+                    print(f'Skipping cache for {path}: {e}')
+                    if cache_writer is not None:
+                        cache_writer.close()
+                        os.remove(f'{cache_file}.tmp')
+                    cache_writer, cache_file = None, None
+                    self.use_cache = False
+            all_chunks.append(self.filter_chunk(chunk, schema, where, encode))
         # Concatenate all chunks into a single DataFrame
-        df = pd.concat(all_chunks, ignore_index=True)
-        return df
+        df = self.concat_chunks(all_chunks)
+
+        if cache_writer is not None:
+            cache_writer.close()
+            os.replace(f'{cache_file}.tmp', cache_file)
+        return df, schema
+
+    # Start reading the tables in reads ({table: reader arguments}, see tables) all at once on background threads, so
+    # the disk reads and parsing overlap with whatever is done in the meantime.  Each table is handed over by the next
+    # call of its reader with the same subfields and where.  The keys are only encoded as the table is handed over, so
+    # every key space gets its codes in the same order as reading the tables one by one
+    def prefetch(self, reads):
+        executor = ThreadPoolExecutor(max_workers=max(len(reads), 1))
+        for table, args in reads.items():
+            path = self.tables[table]
+            self.prefetched[self.prefetch_key(path, args.get('subfields'), args.get('where'))] = executor.submit(
+                self.read_table, path, args.get('subfields'), args.get('where'), encode=False)
+        executor.shutdown(wait=False)
+
+    # Drop any prefetched tables nobody asked for, once the reads still running have finished
+    def end_prefetch(self):
+        for prefetched in self.prefetched.values():
+            if not prefetched.cancel():
+                prefetched.exception()
+        self.prefetched = {}
+
+    # The files holding rows of individual patients (those whose schema has a patient key), with the names of their
+    # columns (see FileSchema.for_header) and their patient column
+    def patient_files(self):
+        for path, schema in schemas.items():
+            file_path = f'{self.output_loc}{path}'
+            if not os.path.exists(file_path):
+                continue
+            schema = schema.for_header(list(pd.read_csv(file_path, nrows=0).columns))
+            patient = [name for name, space in schema.keys.items() if space == 'patient']
+            if patient:
+                yield path, file_path, schema.columns, patient[0]
 
-    def patients_df(self) -> pd.DataFrame:
-        return self.chunk_csv_reader('/csv/patients.csv')
+    # Enough partitions to format each one within memory_budget MB, judged from the size of the per-patient inputs.  With
+    # several workers that many partitions are formatted at once, so each one gets its share of the budget
+    def partition_count(self, memory_budget, workers=1):
+        input_bytes = sum(os.path.getsize(file_path) for _, file_path, _, _ in self.patient_files())
+        return max(1, math.ceil(input_bytes * self.memory_per_input_byte * workers / (memory_budget * 2**20)))
+
+    # Split every per-patient input into partitions of patients, so a partition holds all of the rows of its patients
+    # and can be formatted on its own.  Each partition is a contiguous run of patients.csv and keeps the rows of every
+    # file in their original order, so the partitions' outputs one after another are in the same order as the output
+    # of the whole.  The files are streamed through a chunk at a time rather than read whole, and the other files find
+    # their patient's partition by a 64 bit hash of the patient id, so only 8 bytes per patient are held.  Rows whose
+    # patient is not in patients.csv (which formatting drops anyway) go to the first partition.  Returns a SyntheaOutput
+    # for each partition, which reads the shared reference tables (organizations, payers, coverages, ...) from this
+    # output
+    def partition_by_patient(self, partitions):
+        self.remove_partitions()
+        patients_path = f'{self.output_loc}{self.tables["patients"]}'
+        patient_hashes = np.concatenate([np.array([], dtype=np.uint64)] + [
+            pd.util.hash_pandas_object(chunk['Id'], index=False).to_numpy()
+            for chunk in pd.read_csv(patients_path, usecols=['Id'], dtype=str, keep_default_na=False,
+                                     chunksize=self.chunk_size)])
+        if len(patient_hashes) == 0:
+            return []
+        partitions = min(partitions, len(patient_hashes))
+        order = np.argsort(patient_hashes, kind='stable')
+        sorted_hashes = patient_hashes[order]
+        sorted_partitions = (np.arange(len(patient_hashes)) * partitions // len(patient_hashes))[order]
+        del patient_hashes, order
+
+        locations = [f'{self.partitions_loc}part_{i}/' for i in range(partitions)]
+        for path, file_path, columns, patient in self.patient_files():
+            with open(file_path) as f:
+                header = f.readline()
+            for location in locations:
+                os.makedirs(os.path.dirname(f'{location}{path}'), exist_ok=True)
+                with open(f'{location}{path}', 'w') as partition_file:
+                    partition_file.write(header)
+            partition_files = PartitionFiles([f'{location}{path}' for location in locations],
+                                             self.max_open_partition_files)
+            with partition_files:
+                # Read as plain strings, so values are written back exactly as they were
+                for chunk in pd.read_csv(file_path, header=0, names=columns, dtype=str, keep_default_na=False,
+                                         chunksize=self.chunk_size):
+                    hashes = pd.util.hash_pandas_object(chunk[patient], index=False).to_numpy()
+                    found = np.searchsorted(sorted_hashes, hashes).clip(max=len(sorted_hashes) - 1)
+                    part = np.where(sorted_hashes[found] == hashes, sorted_partitions[found], 0)
+                    for i, rows in pd.Series(part).groupby(part).indices.items():
+                        chunk.iloc[rows].to_csv(partition_files[i], header=False, index=False)
+        return [SyntheaOutput(use_cache=False, output_loc=location, shared_loc=self.output_loc,
+                              chunk_size=self.chunk_size) for location in locations]
+
+    def remove_partitions(self):
+        shutil.rmtree(self.partitions_loc, ignore_errors=True)
+
+    def patients_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['patients'], subfields=subfields, where=where)
 
     # As the CSV files get large, a full read_csv becomes impractical, so we select the columns we want to use and
     # effectively reindex them in the dataframe we are creating (i.e. column 3 in the csv becomes new column 1, etc.)
-    def encounters_df(self, subfields: list = None) -> pd.DataFrame:
-        return self.chunk_csv_reader('/csv/encounters.csv', parse_dates=[1, 2], subfields=subfields)
+    def encounters_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['encounters'], subfields=subfields, where=where)
 
-    def procedures_df(self, subfields: list = None) -> pd.DataFrame:
-        return self.chunk_csv_reader('/csv/procedures.csv', parse_dates=[0, 1], subfields=subfields)
+    def procedures_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['procedures'], subfields=subfields, where=where)
 
-    def diagnosis_df(self, subfields: list = None) -> pd.DataFrame:
-        return self.chunk_csv_reader('/cpcds/CPCDS_Claims.csv', subfields=subfields)
+    def diagnosis_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['diagnosis'], subfields=subfields, where=where)
 
-    def coverages_df(self, subfields: list = None) -> pd.DataFrame:
-        return self.chunk_csv_reader('/cpcds/CPCDS_Coverages.csv', subfields=subfields)
+    def coverages_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['coverages'], subfields=subfields, where=where)
 
-    def organizations_df(self, subfields: list = None) -> pd.DataFrame:
-        return self.chunk_csv_reader('/csv/organizations.csv', parse_dates=[1, 2])
+    def organizations_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['organizations'], subfields=subfields, where=where)
 
-    def payers_df(self, subfields: list = None) -> pd.DataFrame:
-        return self.chunk_csv_reader('/csv/payers.csv', parse_dates=[1, 2])
+    def payers_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['payers'], subfields=subfields, where=where)
 
-    def observations_df(self, subfields: list = None) -> pd.DataFrame:
-        return self.chunk_csv_reader('/csv/observations.csv', subfields=subfields)
+    def observations_df(self, subfields: list = None, where=None) -> pd.DataFrame:
+        return self.chunk_csv_reader(self.tables['observations'], subfields=subfields, where=where)
 
 
 class Synthea:
+    # Reference tables that every shard exports in full (see run_synthea_shards) - only the first row per Id is kept,
+    # apart from the totals in shared_totals
+    shared_files = ['organizations.csv', 'providers.csv', 'payers.csv', 'Organizations.csv', 'PractitionerRoles.csv']
+
+    # Columns of the shared reference tables that total up the shard's own patients (revenue, utilization, covered
+    # encounters, ...), so they are summed across the shards instead.  QOLS_AVG is an average over the payer's customers
+    # and is combined weighted by each shard's UNIQUE_CUSTOMERS
+    shared_totals = {
+        'organizations.csv': ['REVENUE', 'UTILIZATION'],
+        'providers.csv': ['ENCOUNTERS', 'PROCEDURES', 'UTILIZATION'],
+        'payers.csv': ['AMOUNT_COVERED', 'AMOUNT_UNCOVERED', 'REVENUE', 'COVERED_ENCOUNTERS', 'UNCOVERED_ENCOUNTERS',
+                       'COVERED_MEDICATIONS', 'UNCOVERED_MEDICATIONS', 'COVERED_PROCEDURES', 'UNCOVERED_PROCEDURES',
+                       'COVERED_IMMUNIZATIONS', 'UNCOVERED_IMMUNIZATIONS', 'UNIQUE_CUSTOMERS', 'MEMBER_MONTHS'],
+    }
+
     # Intentionally using 2 spaces between args so they can be easily split later for passing into subprocess.Popen for
     # the synthea java run.  (to support city names that contain a single space staying together rather than splitting)
-    def __init__(self, jar_file, config_file):
+    def __init__(self, jar_file, config_file, output_loc='output/'):
         self.java_command = f'java  -jar  {jar_file}  -c  {config_file}'
+        self.output_loc = output_loc
+        self.popsize = None
+        self.seed = None
 
+    # Population size and seed are added when the command is run, since a sharded run splits them across processes
     def specify_popsize(self, size):
-        self.java_command = self.java_command + f'  -p  {size}'
+        self.popsize = size
+
+    def specify_seed(self, seed=None):
+        self.seed = seed
 
     def specify_gender(self, gender=None):
         if gender:
@@ -102,17 +423,178 @@ class Synthea:
         elif state:
             self.java_command = self.java_command + f'  {state}'
 
-    def run_synthea(self):
+    def command(self, size, seed=None, base_directory=None):
+        java_command = self.java_command + f'  -p  {size}'
+        if seed is not None:
+            java_command = java_command + f'  -s  {seed}'
+        if base_directory:
+            java_command = java_command + f'  --exporter.baseDirectory  {base_directory}'
+        return java_command
+
+    @staticmethod
+    def print_run_summary(output_str):
+        run_options = output_str[output_str.index('Running with options'):output_str.index(' -- ') - 2]
+        total_records = output_str[output_str.index('Records: '):output_str.index('RNG')]
+        print(run_options, total_records, sep='\n\n')
+
+    # Write the synthea output to the log file line by line as it is produced, counting the "N -- Name ..." line synthea
+    # prints per generated patient into progress.  Only the start of the output (up to the first patient, which holds
+    # the run options) and the last few lines (which hold the record totals) are kept for the run summary
+    @staticmethod
+    def stream_output(child, log_name, progress):
+        patient_line = re.compile(r'^\d+ -- ')
+        head, tail = [], deque(maxlen=50)
+        with open(log_name, 'w') as output:
+            for raw_line in child.stdout:
+                line = raw_line.decode(errors='replace')  # decode converts from bytes to string object
+                output.write(line)
+                if patient_line.match(line):
+                    if not head or not patient_line.match(head[-1]):
+                        head.append(line)
+                    progress.update()
+                elif not head or not patient_line.match(head[-1]):
+                    head.append(line)
+                else:
+                    tail.append(line)
+        child.wait()
+        return ''.join(head) + ''.join(tail)
+
+    def run_synthea(self, shards=1):
+        if shards > 1:
+            return self.run_synthea_shards(shards)
+        java_command = self.command(self.popsize, self.seed)
         # Split by double space to allow for multi-word city names (that are separated by 1 space).  It's very likely
         # there is a more elegant way to do this though.
-        print("Java Command: ", self.java_command)
-        java_command_list = self.java_command.split('  ')
+        print("Java Command: ", java_command)
+        java_command_list = java_command.split('  ')
+        progress = ProgressTimer(self.popsize, 'Patients Generated: ')
         child = subprocess.Popen(java_command_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        output_str = child.stdout.read().decode()  # decode converts from bytes to string object
         timestamp = time.time()
         date_time = dt.datetime.fromtimestamp(timestamp)
-        with open(f'logs/full_synthea_stdout_{date_time.strftime("%Y-%m-%d_%H%M%S")}.txt', 'w') as output:
-            output.write(output_str)
-        run_options = output_str[output_str.index('Running with options'):output_str.index(' -- ') - 2]
-        total_records = output_str[output_str.index('Records: '):output_str.index('RNG')]
-        print(run_options, total_records, sep='\n\n')
+        output_str = self.stream_output(child, f'logs/full_synthea_stdout_{date_time.strftime("%Y-%m-%d_%H%M%S")}.txt',
+                                        progress)
+        progress.print_progress()
+        self.print_run_summary(output_str)
+
+    # Split the population across several concurrent synthea processes, each with its own seed and output directory,
+    # then merge their exports into the usual output/ layout
+    def run_synthea_shards(self, shards):
+        shards = min(shards, self.popsize)
+        base_seed = self.seed if self.seed is not None else int(time.time())
+        date_time = dt.datetime.fromtimestamp(time.time())
+        # One progress count across all shards, fed by a thread per shard streaming that shard's output to its log
+        progress = ProgressTimer(self.popsize, 'Patients Generated (all shards): ')
+
+        shard_dirs, log_names, summaries, threads = [], [], {}, []
+        children = []
+        # Errors streaming a shard's output, kept to be reported once every shard has finished
+        errors = {}
+
+        def stream_shard(i, child, log_name):
+            try:
+                summaries[i] = self.stream_output(child, log_name, progress)
+            except Exception as e:
+                errors[i] = e
+                child.kill()
+                child.wait()
+
+        for i in range(shards):
+            size = self.popsize // shards + (i < self.popsize % shards)
+            shard_dir = f'{self.output_loc}shard_{i}/'
+            shutil.rmtree(shard_dir, ignore_errors=True)
+            java_command = self.command(size, base_seed + i, shard_dir)
+            print(f"Java Command (shard {i}): ", java_command)
+            log_name = f'logs/full_synthea_stdout_{date_time.strftime("%Y-%m-%d_%H%M%S")}_shard{i}.txt'
+            child = subprocess.Popen(java_command.split('  '), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            thread = threading.Thread(target=stream_shard, args=(i, child, log_name))
+            thread.start()
+            shard_dirs.append(shard_dir)
+            log_names.append(log_name)
+            children.append(child)
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+        progress.print_progress()
+
+        failed = []
+        for i, child in enumerate(children):
+            if i in errors:
+                failed.append(f'{log_names[i]} ({type(errors[i]).__name__}: {errors[i]})')
+                continue
+            if child.returncode != 0:
+                failed.append(log_names[i])
+                continue
+            print(f'\nShard {i}:')
+            self.print_run_summary(summaries[i])
+        if failed:
+            raise RuntimeError(f'Synthea shard(s) failed, see {", ".join(failed)}') from next(iter(errors.values()), None)
+
+        self.merge_shard_outputs(shard_dirs)
+
+    def merge_shard_outputs(self, shard_dirs):
+        # CSV exports are concatenated, keeping the header only once
+        for subfolder in ['csv', 'cpcds']:
+            os.makedirs(f'{self.output_loc}{subfolder}', exist_ok=True)
+            names = sorted({os.path.basename(f) for shard_dir in shard_dirs
+                            for f in glob.glob(f'{shard_dir}{subfolder}/*.csv')})
+            for name in names:
+                if name in self.shared_totals:
+                    self.merge_shared_totals([f'{shard_dir}{subfolder}/{name}' for shard_dir in shard_dirs],
+                                             f'{self.output_loc}{subfolder}/{name}', self.shared_totals[name])
+                    continue
+                seen_ids = set() if name in self.shared_files else None
+                header = None
+                with open(f'{self.output_loc}{subfolder}/{name}', 'w') as merged:
+                    for shard_dir in shard_dirs:
+                        path = f'{shard_dir}{subfolder}/{name}'
+                        if not os.path.exists(path):
+                            continue
+                        with open(path) as shard_file:
+                            first_line = shard_file.readline()
+                            if header is None:
+                                header = first_line
+                                merged.write(header)
+                            if seen_ids is None:
+                                shutil.copyfileobj(shard_file, merged)
+                                continue
+                            for line in shard_file:
+                                row_id = line.split(',', 1)[0]
+                                if row_id not in seen_ids:
+                                    seen_ids.add(row_id)
+                                    merged.write(line)
+
+        # Everything else (metadata, fhir, ...) is one file per run/patient, so it is just moved across
+        for shard_dir in shard_dirs:
+            for subfolder in os.listdir(shard_dir):
+                if subfolder in ['csv', 'cpcds'] or not os.path.isdir(f'{shard_dir}{subfolder}'):
+                    continue
+                os.makedirs(f'{self.output_loc}{subfolder}', exist_ok=True)
+                for name in os.listdir(f'{shard_dir}{subfolder}'):
+                    target = f'{self.output_loc}{subfolder}/{name}'
+                    if os.path.exists(target):
+                        target = f'{self.output_loc}{subfolder}/{os.path.basename(shard_dir.rstrip("/"))}_{name}'
+                    shutil.move(f'{shard_dir}{subfolder}/{name}', target)
+            shutil.rmtree(shard_dir)
+
+    # Merge a shared reference table, keeping the first shard's row per Id but with the totals columns summed over
+    # every shard's row for it.  Values are read and written back as text, so Ids only one shard has are unchanged
+    @staticmethod
+    def merge_shared_totals(paths, merged_path, totals):
+        df = pd.concat([pd.read_csv(path, dtype=str, keep_default_na=False) for path in paths if os.path.exists(path)],
+                       ignore_index=True)
+        ids = df[df.columns[0]]
+        merged = df.groupby(df.columns[0], sort=False).first()
+        repeated = ids.duplicated(keep=False).groupby(ids, sort=False).any()
+        numbers = df.apply(pd.to_numeric, errors='coerce').fillna(0)
+        for col in [col for col in totals if col in df.columns]:
+            # Written with as many decimals as the shards wrote (none for counts)
+            decimals = df[col].str.partition('.')[2].str.len().max()
+            sums = numbers[col].groupby(ids, sort=False).sum()[repeated]
+            merged.loc[repeated, col] = sums.map(lambda value: f'{value:.{decimals}f}')
+        if 'QOLS_AVG' in df.columns and 'UNIQUE_CUSTOMERS' in df.columns:
+            weighted = (numbers['QOLS_AVG'] * numbers['UNIQUE_CUSTOMERS']).groupby(ids, sort=False).sum()
+            customers = numbers['UNIQUE_CUSTOMERS'].groupby(ids, sort=False).sum()
+            qols = (weighted / customers.where(customers > 0))[repeated].dropna()
+            merged.loc[qols.index, 'QOLS_AVG'] = qols.map(lambda value: repr(float(value)))
+        merged.reset_index()[df.columns].to_csv(merged_path, index=False)
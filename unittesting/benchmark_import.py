@@ -0,0 +1,34 @@
+# Track how long it takes a fresh interpreter to import the package.  Each statement is timed in a new python process
+# (started in a temporary directory, so nothing relies on being run from the project root) and the median of the
+# repeats is reported next to the bare interpreter startup time.
+#   python unittesting/benchmark_import.py [repeats]
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATEMENTS = ['pass',
+              'import synth_data_module',
+              'import synth_data_module.mappings',
+              'import synth_data_module.mappings as m; m.load_tables()',
+              'from synth_data_module import *']
+
+
+def time_statement(statement, repeats, cwd):
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], cwd=cwd, env=env, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as cwd:
+        for statement in STATEMENTS:
+            print(f'{time_statement(statement, repeats, cwd) * 1000:8.1f} ms  {statement}')
@@ -0,0 +1,32 @@
+import os
+import unittest
+import pandas as pd
+from synth_data_module import CreateTimers, create_formatter
+
+project_loc = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BaseFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        # The formatters read synthea_settings from the project folder
+        os.chdir(project_loc)
+        self.addCleanup(os.chdir, cwd)
+        self.formatter = create_formatter(CreateTimers(), Study=None, FormatType='HCAI_PDD_CSV',
+                                          EncounterType='inpatient', Verbose=False, Yearly=False, YearRange=False,
+                                          PartitionBy=None, Seed=5)
+
+    def test_random_choice_draws_for_every_row_of_an_encounter(self):
+        encounters = self.formatter.synthea_output.key_dictionaries['encounter']
+        self.formatter.output_df = pd.DataFrame({'encounter_id': encounters.encode(pd.Series(['e1'] * 200 + ['e2']))})
+        choices = self.formatter.random_choice(['1', '2', '3', '4'], 'Type of Admission')
+        self.assertEqual(set(choices[:200]), {'1', '2', '3', '4'})
+        # The draws only depend on the encounter and its row number, not on the other rows
+        self.formatter.output_df = self.formatter.output_df.iloc[[200, 0, 1]]
+        self.assertEqual(list(self.formatter.random_choice(['1', '2', '3', '4'], 'Type of Admission')),
+                         [choices[200], choices[0], choices[1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import pandas as pd
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from io import StringIO
+from synth_data_module import FirstSeenCounter, calculate_age, write_fixed_width, RaggedLists
+from synth_data_module.formatting_helpers import calendar_years
+
+
+class FormattingHelpersTest(unittest.TestCase):
+
+    def test_first_seen_counter_matches_running_nunique(self):
+        ssn = pd.Series(['111', '111', '222', '000000001', '333', '222', '000000001', None, '444'])
+        expected = [100 + ssn.iloc[:i + 1].nunique() for i in range(len(ssn))]
+        self.assertEqual(FirstSeenCounter(start=100).assign(ssn).tolist(), expected)
+
+    def test_first_seen_counter_chunked(self):
+        ssn = pd.Series(['111', '111', '222', '333', '222', '444', '111', '555'])
+        whole = FirstSeenCounter(start=100).assign(ssn).tolist()
+        counter = FirstSeenCounter(start=100)
+        chunked = []
+        for start in range(0, len(ssn), 3):
+            chunked += counter.assign(ssn.iloc[start:start + 3]).tolist()
+        self.assertEqual(chunked, whole)
+
+    def test_ragged_lists_match_grouped_tuples(self):
+        items = pd.DataFrame({'encounter_id': [3, 1, 3, 2, 1, 3, np.nan],
+                              'Codes': ['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+                              'Flags': ['Y', 'N', 'U', 'W', 'Y', 'N', 'U']})
+        lists = RaggedLists(items, 'encounter_id', ['Codes', 'Flags'])
+        self.assertEqual(lists.keys['encounter_id'].tolist(), [1, 2, 3])
+        self.assertEqual(lists.contains('Codes', 'c').tolist(), [False, False, True])
+
+        df = pd.DataFrame({'encounter_id': [2, 4, 3, 1], 'Principal Code': ['x', 'y', 'z', 'w']})
+        groups = df['encounter_id'].map({1: 0, 2: 1, 3: 2})
+        names = [['Principal Code', 'Code 1'], ['Principal Flag', 'Flag 1']]
+        result = lists.spread(df, groups, ['Codes', 'Flags'], names)
+        self.assertEqual(result['Principal Code'].tolist(), ['d', 'y', 'a', 'b'])
+        self.assertEqual(result['Code 1'].tolist()[2:], ['c', 'e'])
+        self.assertEqual(result['Principal Flag'].tolist()[2:], ['Y', 'N'])
+        self.assertEqual(result['Flag 1'].tolist()[2:], ['U', 'Y'])
+        self.assertTrue(result['Code 1'].iloc[:2].isna().all())
+        self.assertTrue(pd.isna(result['Principal Flag'].iloc[1]))
+        self.assertNotIn('Code 2', result.columns)
+        self.assertEqual(list(lists.tuples('Codes', groups)[[0, 2]]), [('d',), ('a', 'c', 'f')])
+
+    def test_calendar_years_matches_relativedelta(self):
+        date1 = pd.to_datetime(pd.Series(['2000-02-29', '2001-01-31 10:00', '1990-06-15', '2010-03-01', None]))
+        date2 = pd.to_datetime(pd.Series(['2004-02-28', '2002-01-31 09:00', '1980-06-16', '2010-03-01', '2010-01-01']))
+        expected = [relativedelta(d2, d1).years for d1, d2 in zip(date1[:4], date2[:4])]
+        result = calendar_years(date1, date2)
+        self.assertEqual(list(result[:4]), expected)
+        self.assertTrue(pd.isna(result[4]))
+
+    def test_calculate_age_ranges(self):
+        df = pd.DataFrame({'Date of Birth': ['01152000', '06301975', None],
+                           'Admission Date': ['01142024', '07012024', '07012024']})
+        parsed_dates = {}
+        df = calculate_age(df, 'Date of Birth', 'Admission Date', form='range5', fieldname='Range 5',
+                           parsed_dates=parsed_dates)
+        df = calculate_age(df, 'Date of Birth', 'Admission Date', form='range10', fieldname='Range 10',
+                           parsed_dates=parsed_dates)
+        self.assertEqual(df['Range 5'].tolist()[:2], ['04', '10'])
+        self.assertEqual(df['Range 10'].tolist()[:2], ['02', '05'])
+        self.assertTrue(pd.isna(df['Range 5'].iloc[2]))
+        self.assertEqual(sorted(parsed_dates), ['Admission Date', 'Date of Birth'])
+
+    def test_write_fixed_width_matches_savetxt(self):
+        df = pd.DataFrame({'Code': ['A1', 'LONGVALUE', None, 'é'],
+                           'Charges': pd.array([12, None, 123456, 7], dtype='Int64'),
+                           'Unused': [None] * 4,
+                           'Flag': [1.5, np.nan, 'Y', 'N']})
+        lengths, justifications = [4, 5, 3, 2], ['left', 'right', 'left', 'left']
+        formats = [f"%{'-' if justification == 'left' else ''}{length}.{length}s"
+                   for length, justification in zip(lengths, justifications)]
+        expected = StringIO()
+        np.savetxt(expected, df.astype(object).fillna(''), fmt=formats, delimiter='')
+        for block_size in [1, 3, 10]:
+            result = StringIO()
+            write_fixed_width(df, lengths, justifications, result, block_size=block_size)
+            self.assertEqual(result.getvalue(), expected.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(statement):
+    # Run in a fresh interpreter from outside the project so nothing depends on the working directory
+    with tempfile.TemporaryDirectory() as cwd:
+        env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+        return subprocess.run([sys.executable, '-c', statement], cwd=cwd, env=env, check=True,
+                              capture_output=True, text=True).stdout.split()
+
+
+class ImportsTest(unittest.TestCase):
+
+    def test_package_import_is_lazy(self):
+        result = run_python('import sys, synth_data_module; print("pandas" in sys.modules, "mappings" in dir(synth_data_module))')
+        self.assertEqual(result, ['False', 'False'])
+
+    def test_mapping_tables_load_from_any_directory(self):
+        result = run_python('import synth_data_module.mappings as m; print(m.snomed_table.cache_info().currsize); '
+                            'm.load_tables(); print(len(m.snomed_table()) > 0, len(m.hcai_table()) > 0)')
+        self.assertEqual(result, ['0', 'True', 'True'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import numpy as np
+import pandas as pd
+import synth_data_module.mappings as mappings
+
+
+class MappingsTest(unittest.TestCase):
+
+    def test_code_map_matches_dict_lookup(self):
+        col = pd.Series(['white', 'asian', None, 'martian', 'white', np.nan], index=[5, 3, 1, 0, 2, 4], name='RACE')
+        result = mappings.race(col)
+        self.assertEqual(result.tolist(), ['R5', 'R2', '99', '99', 'R5', '99'])
+        self.assertEqual(result.index.tolist(), col.index.tolist())
+        self.assertEqual(result.name, 'RACE')
+
+    def test_county_lookups_use_key_and_na(self):
+        self.assertEqual(mappings.CAcounty(pd.Series(['Alameda County', 'Yuba', 'Nowhere', pd.NA])).tolist(),
+                         ['01', '58', '00', ' '])
+        self.assertEqual(mappings.CAcounty('Los Angeles'), '19')
+        self.assertEqual(mappings.CAcity(pd.Series(['OAKLAND', 'Springfield'])).tolist(), ['01', '19'])
+
+    def test_hcai_truncates_each_code(self):
+        name = next(iter(mappings.hcai_table()))
+        code = mappings.hcai_table()[name]
+        self.assertEqual(mappings.hcai(pd.Series([name, 'unknown']), length=6).tolist(), [code[-6:], ''])
+
+    def test_larc_substitution_is_seeded_and_chunk_independent(self):
+        codes = pd.Series(['65200003', '169553002', '12345'] * 2000)
+        keys = pd.DataFrame({'encounter': [f'e{i}' for i in range(len(codes))], 'code': codes})
+        result = mappings.larcsnomedmap(codes, keys=keys, seed=7)
+        chunked = pd.concat([mappings.larcsnomedmap(codes[start:start + 999], keys=keys[start:start + 999], seed=7)
+                             for start in range(0, len(codes), 999)])
+        self.assertTrue(result.equals(chunked))
+        self.assertFalse(result.equals(mappings.larcsnomedmap(codes, keys=keys, seed=8)))
+        self.assertTrue((result[2::3] == '12345').all())
+        self.assertEqual(set(result[0::3]), {'0UH97HZ', '0UH98HZ'})
+        self.assertAlmostEqual((result[1::3] == '0JHF3HZ').mean(), 0.9, delta=0.03)
+
+    def test_numbered_keys_give_repeated_keys_their_own_draws(self):
+        keys = mappings.numbered_keys(pd.DataFrame({'encounter': ['e1'] * 2000, 'code': '169553002'}))
+        self.assertEqual(keys['key_number'].tolist()[:3], [0, 1, 2])
+        result = mappings.larcsnomedmap(pd.Series(['169553002'] * 2000), keys=keys, seed=7)
+        self.assertAlmostEqual((result == '0JHF3HZ').mean(), 0.9, delta=0.03)
+        self.assertEqual(mappings.numbered_keys(pd.Series(['e2', 'e1', 'e2'], name='id'))['key_number'].tolist(),
+                         [0, 0, 1])
+
+    def test_languagewritein_only_fills_missing(self):
+        col = pd.Series(['Korean', None, np.nan, 'Farsi'] * 500)
+        result = mappings.languagewritein(col, keys=pd.Series(range(len(col))), seed=1)
+        self.assertTrue((result[0::4] == 'Korean').all())
+        self.assertTrue((result[3::4] == 'Farsi').all())
+        filled = pd.concat([result[1::4], result[2::4]])
+        self.assertTrue(filled.notna().all())
+        self.assertAlmostEqual((filled == 'English').mean(), 0.582, delta=0.04)
+
+    def test_payer_category_rules(self):
+        names = pd.Series(['Medicare', 'Medi-Cal', 'Dual Eligible', 'County Plan', 'Aetna', 'NO_INSURANCE', 'Other'])
+        ownership = pd.Series(['GOVERNMENT', 'GOVERNMENT', 'GOVERNMENT', 'GOVERNMENT', 'PRIVATE', 'NO_INSURANCE',
+                               'UNKNOWN'])
+        self.assertEqual(mappings.payer_category(names, ownership).tolist(),
+                         ['01', '02', '01', '06', '03', '08', '09'])
+        self.assertEqual(mappings.payer_category(names, ownership, study='LARC').tolist(),
+                         ['01', '02', '01', '02', '03', '08', '09'])
+
+
+    def test_msdrg_grouper_applies_precedence(self):
+        # Encounter 0 holds both a parturition and a C-section, 1 only a parturition and 2 neither
+        groups = [0, 0, 1, 2, 0]
+        codes = ['66348005', '12345', '66348005', '99999', '11466000']
+        result = mappings.msdrg_grouper(groups, codes)
+        self.assertEqual(result.index.tolist(), [0, 1])
+        self.assertEqual(result['Medicare Severity-Diagnosis Related Group'].tolist(), ['788', '807'])
+        self.assertEqual(result['Major Diagnostic Category'].tolist(), ['14', '14'])
+        self.assertEqual(result['MS-DRG Category'].tolist(), ['S', 'M'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from synth_data_module import CreateTimers, SyntheaOutput, create_formatter
+import synth_data_module.mappings as mappings
+
+project_loc = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+reference_loc = f'{project_loc}/Reference CSVs with Headers/csv'
+
+
+class PartitionedTest(unittest.TestCase):
+
+    # A small Synthea output from the reference CSVs, with made up claims, coverages and observations for them
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        os.chdir(project_loc)
+        cls.output_dir = tempfile.TemporaryDirectory()
+        cls.output_loc = f'{cls.output_dir.name}/'
+        os.makedirs(f'{cls.output_loc}csv')
+        os.makedirs(f'{cls.output_loc}cpcds')
+        patients = pd.read_csv(f'{reference_loc}/patients.csv', dtype=str, keep_default_na=False)
+        patients.insert(8, 'MIDDLE', 'M')
+        patients['COUNTY'] = [['Los Angeles County', 'Fresno County', 'Orange County'][i % 3]
+                              for i in range(len(patients))]
+        patients.to_csv(f'{cls.output_loc}csv/patients.csv', index=False)
+        for table in ['encounters', 'procedures', 'payers']:
+            pd.read_csv(f'{reference_loc}/{table}.csv', dtype=str, keep_default_na=False).to_csv(
+                f'{cls.output_loc}csv/{table}.csv', index=False)
+        # Every other organization is named after a California hospital, so it has an HCAI facility id
+        organizations = pd.read_csv(f'{reference_loc}/organizations.csv', dtype=str, keep_default_na=False)
+        hospitals = list(mappings.hcai_table())
+        organizations.loc[::2, 'NAME'] = [hospitals[i % len(hospitals)] for i in range(len(organizations[::2]))]
+        organizations.to_csv(f'{cls.output_loc}csv/organizations.csv', index=False)
+        encounters = pd.read_csv(f'{reference_loc}/encounters.csv', usecols=['Id', 'PATIENT'])
+        codes = pd.read_csv(f'{project_loc}/synth_data_module/snomedbasicmappings.csv', dtype=str).iloc[:50, 0]
+        claims = pd.DataFrame('', index=range(2 * len(encounters)), columns=[f'c{i}' for i in range(95)])
+        claims['c6'] = encounters['PATIENT'].tolist() * 2
+        claims['c8'] = encounters['Id'].tolist() * 2
+        claims['c21'] = ('cov-' + encounters['PATIENT']).tolist() * 2
+        claims['c88'] = [codes.iloc[i % len(codes)] for i in range(len(claims))]
+        claims['c90'] = [['Y', 'N', 'U', 'W'][i % 4] for i in range(len(claims))]
+        claims.to_csv(f'{cls.output_loc}cpcds/CPCDS_Claims.csv', index=False)
+        coverages = pd.DataFrame('', index=patients.index, columns=[f'v{i}' for i in range(10)])
+        coverages['v0'] = 'cov-' + patients['Id']
+        coverages['v4'] = [['HMO', 'PPO', 'Other'][i % 3] for i in range(len(patients))]
+        coverages.to_csv(f'{cls.output_loc}cpcds/CPCDS_Coverages.csv', index=False)
+        pd.DataFrame({'DATE': '2020-01-01', 'PATIENT': encounters['PATIENT'], 'ENCOUNTER': encounters['Id'],
+                      'CATEGORY': 'social', 'CODE': 'x', 'DESCRIPTION': 'Preferred language',
+                      'VALUE': [['English', 'Spanish', 'Korean'][i % 3] for i in range(len(encounters))],
+                      'UNITS': '', 'TYPE': 'text'}).to_csv(f'{cls.output_loc}csv/observations.csv', index=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.output_dir.cleanup()
+        os.chdir(cls.cwd)
+
+    def formatter(self, format_type, encounter_type, partition_by=None):
+        formatter = create_formatter(CreateTimers(), Study=None, FormatType=format_type, EncounterType=encounter_type,
+                                     Verbose=False, Yearly=False, YearRange=False, PartitionBy=partition_by, Seed=5)
+        formatter.synthea_output = SyntheaOutput(use_cache=False, output_loc=self.output_loc)
+        return formatter
+
+    def assert_same_as_serial(self, format_type, encounter_type):
+        serial = self.formatter(format_type, encounter_type)
+        serial.gather_data()
+        with open(serial.stream_data(f'{self.output_loc}serial.out'), 'rb') as stream:
+            expected = stream.read()
+        self.assertGreater(expected.count(b'\n'), 10)
+        for partitions, workers in [(1, 1), (7, 1), (7, 2)]:
+            with self.subTest(format_type=format_type, partitions=partitions, workers=workers):
+                formatter = self.formatter(format_type, encounter_type)
+                formatter.unbudgeted_partitions = partitions
+                with open(formatter.stream_partitioned(workers=workers, filename=f'{self.output_loc}partitioned.out'),
+                          'rb') as stream:
+                    self.assertEqual(stream.read(), expected)
+
+    def test_partitions_are_written_in_serial_order(self):
+        self.assert_same_as_serial('HCAI_Inpatient_CSV', 'ambulatory')
+        self.assert_same_as_serial('HCAI_PDD_CSV', 'inpatient')
+
+    def test_inpatient_output_is_split_by_facility(self):
+        formatter = self.formatter('HCAI_Inpatient_CSV', 'ambulatory', partition_by='facility')
+        formatter.gather_data()
+        formatter.stream_data(f'{self.output_loc}facility.csv')
+        facilities = sorted(os.listdir(f'{self.output_loc}facility'))
+        self.assertGreater(len(facilities), 2)
+        self.assertIn('facility_unknown.csv', facilities)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from synth_data_module import SyntheaOutput
+from synth_data_module.schemas import schema_for
+
+
+class SchemasTest(unittest.TestCase):
+
+    def test_encounters_are_read_into_compact_types(self):
+        with tempfile.TemporaryDirectory() as output_loc:
+            os.makedirs(f'{output_loc}/csv')
+            pd.DataFrame({'Id': ['e1', 'e2'], 'START': ['2020-01-01T10:00:00Z', '2021-05-02T10:00:00Z'],
+                          'STOP': ['2020-01-02T10:00:00Z', '2021-05-03T10:00:00Z'], 'PATIENT': ['p1', 'p2'],
+                          'ENCOUNTERCLASS': ['inpatient', 'ambulatory'], 'TOTAL_CLAIM_COST': ['129.16', '0.5']}
+                         ).to_csv(f'{output_loc}/csv/encounters.csv', index=False)
+            synthea_output = SyntheaOutput(use_cache=False)
+            synthea_output.output_loc = output_loc
+            df = synthea_output.encounters_df(subfields=[0, 1, 4, 5])
+        self.assertEqual(list(df.columns), ['Id', 'START', 'ENCOUNTERCLASS', 'TOTAL_CLAIM_COST'])
+        self.assertEqual(df['Id'].tolist(), [0, 1])
+        self.assertEqual(synthea_output.decode_keys('encounter', df['Id']).tolist(), ['e1', 'e2'])
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['START']))
+        self.assertIsInstance(df['ENCOUNTERCLASS'].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['TOTAL_CLAIM_COST'].tolist(), [129.16, 0.5])
+
+    def test_chunks_keep_the_union_of_their_categories(self):
+        schema = schema_for('/csv/encounters.csv')
+        chunks = [schema.apply(pd.DataFrame({'Id': ['e1'], 'ENCOUNTERCLASS': ['inpatient']})),
+                  schema.apply(pd.DataFrame({'Id': ['e2', 'e3'], 'ENCOUNTERCLASS': ['ambulatory', 'inpatient']}))]
+        df = SyntheaOutput.concat_chunks(chunks)
+        self.assertIsInstance(df['ENCOUNTERCLASS'].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['ENCOUNTERCLASS'].tolist(), ['inpatient', 'ambulatory', 'inpatient'])
+        self.assertEqual(df.index.tolist(), [0, 1, 2])
+        self.assertEqual(schema.position('ENCOUNTERCLASS'), 7)
+
+    def test_key_codes_are_shared_between_tables(self):
+        synthea_output = SyntheaOutput(use_cache=False)
+        schema = schema_for('/cpcds/CPCDS_Claims.csv').for_header([f'c{i}' for i in range(95)])
+        claims = synthea_output.encode_keys(pd.DataFrame({'ENCOUNTER': ['e2', None, 'e1', 'e2'],
+                                                          'COVERAGE': ['v1'] * 4}), schema)
+        encounters = synthea_output.encode_keys(pd.DataFrame({'Id': ['e1', 'e3', 'e2']}),
+                                                schema_for('/csv/encounters.csv'))
+        self.assertEqual(claims['ENCOUNTER'].tolist(), [0, -1, 1, 0])
+        self.assertEqual(claims['COVERAGE'].tolist(), [0] * 4)
+        self.assertEqual(encounters['Id'].tolist(), [1, 2, 0])
+        decoded = synthea_output.decode_keys('encounter', pd.Series([2, np.nan, 0]))
+        self.assertEqual(decoded.tolist()[::2], ['e3', 'e2'])
+        self.assertTrue(pd.isna(decoded[1]))
+
+
+    def test_patient_partitions_keep_each_patients_rows_together(self):
+        with tempfile.TemporaryDirectory() as output_loc:
+            os.makedirs(f'{output_loc}/csv')
+            patients = [f'p{i}' for i in range(20)]
+            pd.DataFrame({'Id': patients, 'FIRST': ['Ann, Jr'] * 20}).to_csv(f'{output_loc}/csv/patients.csv',
+                                                                           index=False)
+            pd.DataFrame({'Id': [f'e{i}' for i in range(60)], 'PATIENT': patients * 3}
+                         ).to_csv(f'{output_loc}/csv/encounters.csv', index=False)
+            pd.DataFrame({'Id': ['y1'], 'NAME': ['Medicare']}).to_csv(f'{output_loc}/csv/payers.csv', index=False)
+            synthea_output = SyntheaOutput(use_cache=False, output_loc=f'{output_loc}/', chunk_size=7)
+            # Fewer open files than partitions, so they are closed and reopened as the chunks come through
+            synthea_output.max_open_partition_files = 2
+            partitions = synthea_output.partition_by_patient(3)
+            seen = []
+            for partition in partitions:
+                partition_patients = partition.patients_df()
+                encounters = partition.encounters_df()
+                ids = partition.decode_keys('patient', partition_patients['Id']).tolist()
+                self.assertTrue(set(partition.decode_keys('patient', encounters['PATIENT'])) <= set(ids))
+                self.assertEqual(len(encounters), 3 * len(ids))
+                self.assertEqual(partition_patients['FIRST'].unique().tolist(), ['Ann, Jr'])
+                self.assertEqual(partition.payers_df()['NAME'].tolist(), ['Medicare'])
+                seen += ids
+            self.assertEqual(seen, patients)
+            self.assertGreater(len(partitions), 1)
+            synthea_output.remove_partitions()
+            self.assertFalse(os.path.exists(synthea_output.partitions_loc))
+
+    def test_prefetched_tables_get_the_same_key_codes_as_serial_reads(self):
+        with tempfile.TemporaryDirectory() as output_loc:
+            os.makedirs(f'{output_loc}/csv')
+            pd.DataFrame({'Id': ['p2', 'p1']}).to_csv(f'{output_loc}/csv/patients.csv', index=False)
+            pd.DataFrame({'Id': ['e1', 'e2', 'e3'], 'PATIENT': ['p1', 'p3', 'p2'],
+                          'ENCOUNTERCLASS': ['inpatient', 'ambulatory', 'inpatient']}
+                         ).to_csv(f'{output_loc}/csv/encounters.csv', index=False)
+            inpatient = {'subfields': ['Id', 'PATIENT', 'ENCOUNTERCLASS'],
+                         'where': lambda chunk: chunk['ENCOUNTERCLASS'] == 'inpatient'}
+            frames = []
+            for prefetch in [False, True]:
+                synthea_output = SyntheaOutput(use_cache=False, output_loc=f'{output_loc}/')
+                if prefetch:
+                    # Started in the opposite order to the reads below
+                    synthea_output.prefetch({'encounters': inpatient, 'patients': {}})
+                    self.assertEqual(len(synthea_output.prefetched), 2)
+                frames.append((synthea_output.patients_df(), synthea_output.encounters_df(**inpatient)))
+                self.assertEqual(synthea_output.prefetched, {})
+        for serial, prefetched in zip(*frames):
+            pd.testing.assert_frame_equal(serial, prefetched)
+        self.assertEqual(frames[1][1]['PATIENT'].tolist(), [1, 0])
+
+    def test_prefetched_tables_are_not_handed_to_reads_of_other_rows(self):
+        with tempfile.TemporaryDirectory() as output_loc:
+            os.makedirs(f'{output_loc}/csv')
+            pd.DataFrame({'Id': ['e1', 'e2'], 'ENCOUNTERCLASS': ['inpatient', 'ambulatory']}
+                         ).to_csv(f'{output_loc}/csv/encounters.csv', index=False)
+            synthea_output = SyntheaOutput(use_cache=False, output_loc=f'{output_loc}/')
+            synthea_output.prefetch({'encounters': {'where': lambda chunk: chunk['ENCOUNTERCLASS'] == 'inpatient'}})
+            df = synthea_output.encounters_df(where=lambda chunk: chunk['ENCOUNTERCLASS'] == 'ambulatory')
+            self.assertEqual(synthea_output.decode_keys('encounter', df['Id']).tolist(), ['e2'])
+            self.assertEqual(len(synthea_output.prefetched), 1)
+            synthea_output.end_prefetch()
+
+
+if __name__ == '__main__':
+    unittest.main()